@@ -135,6 +135,41 @@ DWH_SSH_PORT = env.str("DWH_SSH_PORT")
 DWH_SSH_USERNAME = env.str("DWH_SSH_USERNAME")
 DWH_SSH_KEY = env.str("DWH_SSH_KEY", multiline=True)
 DWH_SSH_KEY_PASSPHRASE = env.str("DWH_SSH_KEY_PASSPHRASE", default=None)
+DWH_POOL_SIZE = env.int("DWH_POOL_SIZE", 5)
+# "paramiko" (sshtunnel), "openssh" (ssh client subprocess) or "direct" (no tunnel, see data/transports.py)
+DWH_TRANSPORT = env.str("DWH_TRANSPORT", "paramiko")
+# Host reached by the `direct` transport, over TLS if DWH_SECURE (DWH_PORT and DWH_HTTP_PORT must be the TLS ports)
+DWH_HOST = env.str("DWH_HOST", DWH_SSH_HOST)
+DWH_SECURE = env.bool("DWH_SECURE", True)
+# "native" (SQLAlchemy, row based), "arrow" (HTTP interface, columnar transfer)
+# or "local" (DuckDB over the parquet files of DWH_LOCAL_DATA_DIR, see data/backends.py)
+DWH_BACKEND = env.str("DWH_BACKEND", "native")
+DWH_LOCAL_DATA_DIR = env.path("DWH_LOCAL_DATA_DIR", default=BASE_DIR / "local_warehouse")
+DWH_HTTP_PORT = env.str("DWH_HTTP_PORT", "8123")
+DWH_EXTRACTION_CONCURRENCY = env.int("DWH_EXTRACTION_CONCURRENCY", DWH_POOL_SIZE)
+# Extract the six BS weekly tables in a single UNION ALL query instead of one query per table
+DWH_BATCH_BS_EXTRACTION = env.bool("DWH_BATCH_BS_EXTRACTION", False)
+# Each extraction query is attempted up to DWH_QUERY_MAX_ATTEMPTS times, the delay (seconds) doubling between attempts
+DWH_QUERY_MAX_ATTEMPTS = env.int("DWH_QUERY_MAX_ATTEMPTS", 3)
+DWH_QUERY_RETRY_DELAY = env.int("DWH_QUERY_RETRY_DELAY", 10)
+
+# On-disk cache of query results, used for referential tables
+DWH_QUERY_CACHE_DIR = env.path("DWH_QUERY_CACHE_DIR", default=BASE_DIR / ".query_cache")
+DWH_QUERY_CACHE_MAX_SIZE = env.int("DWH_QUERY_CACHE_MAX_SIZE", 200 * 1024 * 1024)
+DWH_REFERENTIALS_CACHE_TTL = env.int("DWH_REFERENTIALS_CACHE_TTL", 7 * 24 * 3600)
+
+# Number of weeks extracted again before the last staged week, in incremental mode
+STATS_INCREMENTAL_REREAD_WEEKS = env.int("STATS_INCREMENTAL_REREAD_WEEKS", 8)
+# Compute the yearly and all-time totals on the warehouse (GROUP BY year) instead of from the weekly rows
+STATS_AGGREGATION_PUSHDOWN = env.bool("STATS_AGGREGATION_PUSHDOWN", False)
+# Also stage the datasets partitioned by year, so that the yearly builds only read the years they need
+STATS_PARTITIONED_STAGING = env.bool("STATS_PARTITIONED_STAGING", False)
+# Format read by the yearly builds: "parquet", or "ipc" to also stage uncompressed Arrow IPC copies, memory-mapped
+STATS_STAGING_FORMAT = env.str("STATS_STAGING_FORMAT", "parquet")
+# Number of processes computing the years in parallel (0: one per CPU available to the container)
+STATS_BUILD_JOBS = env.int("STATS_BUILD_JOBS", 1)
+# Plan the statistics and figures of the years as lazy queries, executed together (polars collect_all)
+STATS_LAZY_BUILD = env.bool("STATS_LAZY_BUILD", False)
 
 
 if gdal_path := env.str("GDAL_LIBRARY_PATH", ""):
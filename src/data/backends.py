@@ -0,0 +1,350 @@
+"""
+Backends answering the queries of `run_query` and `stream_query_to_parquet`.
+
+The backend is selected by `settings.DWH_BACKEND`:
+
+- `native`: ClickHouse native protocol through SQLAlchemy, rows fetched through the SSH tunnel;
+- `arrow`: ClickHouse HTTP interface through the SSH tunnel, results transferred in the ArrowStream format;
+- `local`: DuckDB over local parquet files holding the warehouse tables, e.g. to profile the build
+  without warehouse credentials.
+"""
+
+import re
+import urllib.error
+import urllib.request
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlencode
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from sqlalchemy import text
+
+from data.connection import warehouse_connection
+from data.telemetry import QueryMetrics
+
+DATE_COLUMNS = ["semaine"]
+
+# Settings sent along with queries run through the ClickHouse HTTP interface
+ARROW_QUERY_SETTINGS = {
+    "default_format": "ArrowStream",
+    "output_format_arrow_string_as_string": 1,
+}
+ARROW_QUERY_TIMEOUT = 600
+
+# Number of rows fetched at once when a result is read batch by batch (ClickHouse blocks are used by `arrow`)
+STREAM_BATCH_SIZE = 100_000
+
+CLICKHOUSE_CODE_PATTERN = re.compile(r"Code: (\d+)")
+
+
+class ClickHouseQueryError(RuntimeError):
+    """A query failed on the ClickHouse server. `code` is the ClickHouse error code, None if unknown."""
+
+    def __init__(self, message: str, code: int | None = None):
+        super().__init__(message)
+        self.code = code
+
+
+class WarehouseBackend:
+    """
+    Interface of the backends: executes a SQL query written for ClickHouse and returns its result.
+    """
+
+    def read(
+        self, sql_string: str, schema_overrides: dict | None = None, metrics: QueryMetrics | None = None
+    ) -> pl.DataFrame:
+        """
+        Returns the whole result of a query.
+
+        Parameters
+        ----------
+        sql_string : str
+            The SQL query string.
+        schema_overrides : dict, optional
+            Polars types applied to the result columns.
+        metrics : QueryMetrics, optional
+            Metrics of the query, completed with the connection time (and first batch time where available).
+
+        Returns
+        -------
+        pl.DataFrame
+            The query result. Decimal columns may be returned as is.
+        """
+        raise NotImplementedError
+
+    def iter_batches(
+        self, sql_string: str, schema: dict[str, pl.DataType], metrics: QueryMetrics | None = None
+    ) -> Iterator[pa.Table]:
+        """
+        Yields the result of a query batch by batch, without loading it entirely in memory.
+
+        Parameters
+        ----------
+        sql_string : str
+            The SQL query string.
+        schema : dict
+            Polars types of the result columns, used as schema overrides where the backend infers types.
+        metrics : QueryMetrics, optional
+            Metrics of the query, completed with the connection time. Batches are recorded by the caller.
+
+        Yields
+        ------
+        pa.Table
+            Consecutive batches of the result. Their types may differ from `schema` and must be cast by the caller.
+        """
+        raise NotImplementedError
+
+
+def _with_log_comment(sql_string: str, metrics: QueryMetrics) -> str:
+    # The query log entry of the query can then be found with its identifier (see `data.telemetry`)
+    return f"{sql_string}\nSETTINGS log_comment = '{metrics.query_id}'"
+
+
+class NativeBackend(WarehouseBackend):
+    """ClickHouse native protocol, through the pooled engine of the shared warehouse connection."""
+
+    def read(
+        self, sql_string: str, schema_overrides: dict | None = None, metrics: QueryMetrics | None = None
+    ) -> pl.DataFrame:
+        metrics = metrics or QueryMetrics()
+        with warehouse_connection() as connection:
+            with metrics.measure_connect():
+                engine = connection.get_engine()
+            return pl.read_database(
+                _with_log_comment(sql_string, metrics), connection=engine, schema_overrides=schema_overrides
+            )
+
+    def iter_batches(
+        self, sql_string: str, schema: dict[str, pl.DataType], metrics: QueryMetrics | None = None
+    ) -> Iterator[pa.Table]:
+        metrics = metrics or QueryMetrics()
+        with warehouse_connection() as connection:
+            with metrics.measure_connect():
+                engine = connection.get_engine()
+            # Without `stream_results`, clickhouse-driver receives the whole result as Python tuples before the
+            # first fetch. With it, blocks of `max_row_buffer` rows are received as they are fetched (`execute_iter`)
+            with engine.connect() as db_connection:
+                result = db_connection.execution_options(
+                    stream_results=True, max_row_buffer=STREAM_BATCH_SIZE
+                ).execute(text(_with_log_comment(sql_string, metrics)))
+                columns = list(result.keys())
+                schema_overrides = {column: schema[column] for column in columns if column in schema}
+                while rows := result.fetchmany(STREAM_BATCH_SIZE):
+                    with metrics.measure_decode():
+                        table = pl.DataFrame(
+                            rows, schema=columns, orient="row", schema_overrides=schema_overrides, strict=False
+                        ).to_arrow()
+                    yield table
+
+
+def _with_server_side_types(sql_string: str) -> str:
+    """
+    Wraps a query so that ClickHouse returns known columns with Arrow-friendly types.
+
+    ClickHouse exports `Date` columns as plain integers in Arrow format: they are cast on the server.
+    Dataset queries already project typed columns (see `data.manifests`). Non-strict `REPLACE` ignores
+    columns that are absent from the query result.
+    """
+    replacements = [f"toDate32({column}) AS {column}" for column in DATE_COLUMNS]
+    return f"SELECT * REPLACE ({', '.join(replacements)}) FROM ({sql_string})"
+
+
+@contextmanager
+def _open_arrow_stream(
+    sql_string: str, http_url: str, log_comment: str | None = None
+) -> Iterator[pa.ipc.RecordBatchStreamReader]:
+    """
+    Executes a SQL query through the ClickHouse HTTP interface and yields a reader of the ArrowStream response.
+
+    Record batches are decoded as they are read from the response, one ClickHouse block at a time.
+    `log_comment` identifies the query in the ClickHouse query log.
+    """
+    query_settings = {**ARROW_QUERY_SETTINGS, **({"log_comment": log_comment} if log_comment else {})}
+    request = urllib.request.Request(
+        f"{http_url}?{urlencode(query_settings)}",
+        data=_with_server_side_types(sql_string).encode(),
+        headers={"X-ClickHouse-User": settings.DWH_USERNAME, "X-ClickHouse-Key": settings.DWH_PASSWORD},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=ARROW_QUERY_TIMEOUT) as response:  # nosec B310
+            yield pa.ipc.open_stream(response)
+    except urllib.error.HTTPError as error:
+        message = error.read().decode(errors="replace")
+        # The error code is sent in a header, and at the start of the message
+        code = error.headers.get("X-ClickHouse-Exception-Code") if error.headers else None
+        if code is None and (match := CLICKHOUSE_CODE_PATTERN.search(message)):
+            code = match.group(1)
+        raise ClickHouseQueryError(
+            f"ClickHouse query failed: {message}", int(code) if code is not None else None
+        ) from error
+
+
+def _read_arrow(sql_string: str, http_url: str, metrics: QueryMetrics | None = None) -> pa.Table:
+    """
+    Executes a SQL query through the ClickHouse HTTP interface and returns the result as an Arrow table.
+
+    The result is transferred in the ArrowStream format and decoded column by column,
+    without building Python objects for each row.
+    """
+    metrics = metrics or QueryMetrics()
+    with _open_arrow_stream(sql_string, http_url, log_comment=metrics.query_id) as reader:
+        batches = []
+        for batch in reader:
+            metrics.mark_first_batch()
+            batches.append(batch)
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+
+    # Remaining decimal columns are converted in Arrow, before reaching Polars
+    for index, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(index, field.name, pc.cast(table.column(index), pa.float64()))
+
+    return table
+
+
+class ArrowBackend(WarehouseBackend):
+    """ClickHouse HTTP interface, forwarded by the SSH tunnel of the shared warehouse connection."""
+
+    def read(
+        self, sql_string: str, schema_overrides: dict | None = None, metrics: QueryMetrics | None = None
+    ) -> pl.DataFrame:
+        metrics = metrics or QueryMetrics()
+        with warehouse_connection() as connection:
+            with metrics.measure_connect():
+                http_url = connection.get_http_url()
+            table = _read_arrow(sql_string, http_url, metrics)
+        return pl.from_arrow(table, schema_overrides=schema_overrides)
+
+    def iter_batches(
+        self, sql_string: str, schema: dict[str, pl.DataType], metrics: QueryMetrics | None = None
+    ) -> Iterator[pa.Table]:
+        metrics = metrics or QueryMetrics()
+        with warehouse_connection() as connection:
+            with metrics.measure_connect():
+                http_url = connection.get_http_url()
+            with _open_arrow_stream(sql_string, http_url, log_comment=metrics.query_id) as reader:
+                for batch in reader:
+                    yield pa.Table.from_batches([batch])
+
+
+# ClickHouse functions used by the queries, defined for DuckDB with the same result types
+CLICKHOUSE_MACROS = {
+    "toDate32": "CAST(x AS DATE)",
+    "toInt64": "CAST(x AS BIGINT)",
+    "toFloat64": "CAST(x AS DOUBLE)",
+    "toString": "CAST(x AS VARCHAR)",
+    "toYear": "CAST(year(x) AS USMALLINT)",
+    "toUInt8": "CAST(x AS UTINYINT)",
+}
+
+DUCKDB_TYPES = {
+    "Date32": "DATE",
+    "Int64": "BIGINT",
+    "Float64": "DOUBLE",
+    "String": "VARCHAR",
+}
+
+# ClickHouse style cast of typed NULL values, as written by `data.manifests.get_aligned_projection`
+NULLABLE_CAST_PATTERN = re.compile(r"CAST\(NULL, 'Nullable\((\w+)\)'\)")
+
+
+class LocalBackend(WarehouseBackend):
+    """
+    DuckDB over local parquet files, answering the same queries as the warehouse.
+
+    Each table is read from `settings.DWH_LOCAL_DATA_DIR/<database>/<table>.parquet`
+    (e.g. `refined_zone_stats_publiques/bsdd_statistiques_hebdomadaires.parquet`), or from every parquet file
+    of a `<database>/<table>/` directory. Requires the `duckdb` package (dev dependencies).
+    """
+
+    def _connect(self):
+        try:
+            import duckdb
+        except ImportError as error:
+            raise ImproperlyConfigured("The `local` backend requires the duckdb package") from error
+
+        data_dir = Path(settings.DWH_LOCAL_DATA_DIR)
+        if not data_dir.is_dir():
+            raise ImproperlyConfigured(f"DWH_LOCAL_DATA_DIR {data_dir} is not a directory")
+
+        connection = duckdb.connect()
+        for name, expression in CLICKHOUSE_MACROS.items():
+            connection.execute(f"CREATE MACRO {name}(x) AS {expression}")
+
+        for database_dir in sorted(path for path in data_dir.iterdir() if path.is_dir()):
+            connection.execute(f'CREATE SCHEMA "{database_dir.name}"')
+            for table_path in sorted(database_dir.iterdir()):
+                if table_path.is_dir():
+                    files = f"{table_path}/*.parquet"
+                elif table_path.suffix == ".parquet":
+                    files = str(table_path)
+                else:
+                    continue
+                files = files.replace("'", "''")
+                connection.execute(
+                    f'CREATE VIEW "{database_dir.name}"."{table_path.stem}" AS SELECT * FROM read_parquet(\'{files}\')'
+                )
+
+        return connection
+
+    @staticmethod
+    def _to_duckdb_sql(sql_string: str) -> str:
+        return NULLABLE_CAST_PATTERN.sub(lambda match: f"CAST(NULL AS {DUCKDB_TYPES[match[1]]})", sql_string)
+
+    @staticmethod
+    def _to_clickhouse_types(table: pa.Table) -> pa.Table:
+        # DuckDB sums integers as 128 bits integers, exported as decimals: ClickHouse returns Int64
+        for index, field in enumerate(table.schema):
+            if pa.types.is_decimal(field.type) and field.type.scale == 0:
+                table = table.set_column(index, field.name, pc.cast(table.column(index), pa.int64()))
+        return table
+
+    def read(
+        self, sql_string: str, schema_overrides: dict | None = None, metrics: QueryMetrics | None = None
+    ) -> pl.DataFrame:
+        metrics = metrics or QueryMetrics()
+        with metrics.measure_connect():
+            connection = self._connect()
+        with connection:
+            table = connection.execute(self._to_duckdb_sql(sql_string)).to_arrow_table()
+        return pl.from_arrow(self._to_clickhouse_types(table), schema_overrides=schema_overrides)
+
+    def iter_batches(
+        self, sql_string: str, schema: dict[str, pl.DataType], metrics: QueryMetrics | None = None
+    ) -> Iterator[pa.Table]:
+        metrics = metrics or QueryMetrics()
+        with metrics.measure_connect():
+            connection = self._connect()
+        with connection:
+            reader = connection.execute(self._to_duckdb_sql(sql_string)).to_arrow_reader(STREAM_BATCH_SIZE)
+            for batch in reader:
+                yield self._to_clickhouse_types(pa.Table.from_batches([batch]))
+
+
+BACKENDS = {
+    "native": NativeBackend,
+    "arrow": ArrowBackend,
+    "local": LocalBackend,
+}
+
+
+def get_backend() -> WarehouseBackend:
+    """
+    Returns the backend selected by `settings.DWH_BACKEND`.
+
+    Raises
+    ------
+    ImproperlyConfigured
+        If the backend is unknown.
+    """
+    try:
+        return BACKENDS[settings.DWH_BACKEND]()
+    except KeyError as error:
+        raise ImproperlyConfigured(
+            f"Unknown DWH_BACKEND {settings.DWH_BACKEND!r}, expected one of {list(BACKENDS)}"
+        ) from error
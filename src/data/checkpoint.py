@@ -0,0 +1,99 @@
+"""
+Checkpoints of dataset extractions.
+
+A checkpoint file in the staging directory lists the datasets already written there, with the query used
+to extract them and their row count, and the extraction mode that wrote it. An interrupted extraction can then
+resume with the missing datasets only.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from data.query_cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILENAME = "_checkpoint.json"
+
+
+class ExtractionCheckpoint:
+    """
+    Datasets already extracted to a directory, recorded in its `_checkpoint.json` file.
+
+    A dataset is only considered extracted if its file is still present and it was extracted with the same query,
+    so that a change of parameters (e.g. another incremental watermark) extracts it again.
+
+    Parameters
+    ----------
+    directory : Path
+        Directory holding the parquet files of the datasets and the checkpoint file.
+    mode : str, optional
+        Extraction mode written in the checkpoint (e.g. "full" or "incremental"). Defaults to the mode
+        already stored in the checkpoint file.
+    """
+
+    def __init__(self, directory: Path, mode: str | None = None):
+        self.directory = Path(directory)
+        self.path = self.directory / CHECKPOINT_FILENAME
+        self._lock = threading.Lock()
+        stored_mode, self._datasets = self._load()
+        self.mode = mode or stored_mode
+
+    def _load(self) -> tuple[str | None, dict]:
+        try:
+            with self.path.open() as f:
+                content = json.load(f)
+            return content.get("mode"), content["datasets"]
+        except FileNotFoundError:
+            return None, {}
+        except (ValueError, KeyError, AttributeError):
+            logger.warning("Ignoring invalid extraction checkpoint %s", self.path)
+            return None, {}
+
+    def _write(self):
+        # Written to a temporary file first so that an interruption never leaves a partial checkpoint
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "w") as f:
+                json.dump({"mode": self.mode, "datasets": self._datasets}, f, indent=2)
+            os.replace(temp_path, self.path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    @property
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def is_completed(self, dataset_name: str, sql_string: str) -> bool:
+        """Returns True if the dataset was already extracted with this query."""
+        entry = self._datasets.get(dataset_name)
+        return (
+            entry is not None
+            and entry["query"] == make_cache_key(sql_string)
+            and (self.directory / f"{dataset_name}.parquet").exists()
+        )
+
+    def get_rows_count(self, dataset_name: str) -> int:
+        return self._datasets[dataset_name]["rows"]
+
+    def mark_completed(self, dataset_name: str, sql_string: str, rows_count: int):
+        """Records a dataset as extracted. Safe to call from concurrent extraction threads."""
+        with self._lock:
+            self._datasets[dataset_name] = {
+                "query": make_cache_key(sql_string),
+                "rows": rows_count,
+                "completed_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._write()
+
+    def clear(self):
+        """Deletes the checkpoint, once the extracted datasets have been used."""
+        with self._lock:
+            self._datasets = {}
+            self.path.unlink(missing_ok=True)
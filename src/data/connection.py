@@ -0,0 +1,166 @@
+"""
+Connection management for the ClickHouse data warehouse.
+
+A `WarehouseConnection` holds one SSH tunnel and one pooled SQLAlchemy engine, so that
+every query of an extraction run goes through the same tunnel instead of opening a new one.
+When the `arrow` backend is used, the ClickHouse HTTP port is forwarded through the same tunnel.
+The tunnel is opened by the transport selected by `settings.DWH_TRANSPORT` (see `data.transports`).
+"""
+
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from data.transports import get_http_url, is_secure, open_transport
+
+logger = logging.getLogger(__name__)
+
+_active_connection = None
+# Protects `_active_connection`, entered by the threads of an extraction run
+_active_connection_lock = threading.Lock()
+
+
+class WarehouseConnection:
+    """
+    Lazily opened SSH tunnel and pooled engine to the ClickHouse data warehouse.
+
+    The tunnel is only opened when the engine is first requested, and is re-opened
+    transparently if the underlying SSH transport went down between two queries.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Number of connections kept in the SQLAlchemy pool. Defaults to `settings.DWH_POOL_SIZE`.
+    """
+
+    def __init__(self, pool_size: int | None = None):
+        self.pool_size = pool_size or settings.DWH_POOL_SIZE
+        self._lock = threading.RLock()
+        self._exit_stack = None
+        self._tunnel = None
+        self._engine = None
+        self._http_url = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._tunnel is not None and self._tunnel.is_active
+
+    def _open(self):
+        self.close()
+
+        remote_ports = [settings.DWH_PORT]
+        if settings.DWH_BACKEND == "arrow":
+            remote_ports.append(settings.DWH_HTTP_PORT)
+
+        started_time = time.time()
+        exit_stack = ExitStack()
+        try:
+            tunnel = exit_stack.enter_context(open_transport(settings, remote_ports=remote_ports))
+        except Exception:
+            exit_stack.close()
+            raise
+
+        local_host = tunnel.local_bind_hosts[0]
+        local_ports = tunnel.local_bind_ports
+
+        self._exit_stack = exit_stack
+        self._tunnel = tunnel
+        if len(local_ports) > 1:
+            self._http_url = get_http_url(tunnel, 1)
+        self._engine = create_engine(
+            f"clickhouse+native://{settings.DWH_USERNAME}:{settings.DWH_PASSWORD}@{local_host}:{local_ports[0]}"
+            + ("?secure=True" if is_secure(tunnel) else ""),
+            pool_size=self.pool_size,
+            max_overflow=0,
+            pool_pre_ping=True,
+        )
+
+        logger.info("%s tunnel opened in %s", settings.DWH_TRANSPORT, time.time() - started_time)
+
+    def get_engine(self) -> Engine:
+        """
+        Returns the pooled engine, opening (or re-opening) the SSH tunnel if needed.
+
+        Returns
+        -------
+        Engine
+            SQLAlchemy engine bound to the local end of the SSH tunnel.
+        """
+        with self._lock:
+            if not self.is_open:
+                if self._tunnel is not None:
+                    logger.warning("SSH tunnel is down, reconnecting")
+                self._open()
+            return self._engine
+
+    def get_http_url(self) -> str:
+        """
+        Returns the URL of the ClickHouse HTTP interface, opening (or re-opening) the SSH tunnel if needed.
+
+        Returns
+        -------
+        str
+            URL of the local end of the tunnel forwarding `settings.DWH_HTTP_PORT`.
+        """
+        with self._lock:
+            self.get_engine()
+            if self._http_url is None:
+                raise ImproperlyConfigured("The ClickHouse HTTP port is only forwarded with the `arrow` backend")
+            return self._http_url
+
+    def close(self):
+        """Disposes the engine and stops the SSH tunnel."""
+        with self._lock:
+            if self._engine is not None:
+                self._engine.dispose()
+            if self._exit_stack is not None:
+                self._exit_stack.close()
+            self._engine = None
+            self._tunnel = None
+            self._exit_stack = None
+            self._http_url = None
+
+
+@contextmanager
+def warehouse_connection(**kwargs):
+    """
+    Provides the warehouse connection shared by every query run inside the context.
+
+    Nested calls reuse the outermost connection, so `run_query` can open a short-lived
+    connection on its own while still sharing the one opened by a whole extraction run.
+
+    Parameters
+    ----------
+    **kwargs
+        Passed to `WarehouseConnection` when a new connection is created.
+
+    Yields
+    ------
+    WarehouseConnection
+        The active warehouse connection. It is closed when the outermost context exits.
+    """
+    global _active_connection
+
+    with _active_connection_lock:
+        connection = _active_connection
+        is_outermost = connection is None
+        if is_outermost:
+            connection = WarehouseConnection(**kwargs)
+            _active_connection = connection
+
+    if not is_outermost:
+        yield connection
+        return
+
+    try:
+        yield connection
+    finally:
+        with _active_connection_lock:
+            _active_connection = None
+        connection.close()
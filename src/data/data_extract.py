@@ -1,13 +1,27 @@
+import http.client
 import json
 import logging
+import os
+import socket
 import time
+import urllib.error
+from pathlib import Path
 
+import paramiko
 import polars as pl
 import polars.selectors as cs
+import pyarrow as pa
+import pyarrow.parquet as pq
+import sqlalchemy.exc
+import sshtunnel
+from clickhouse_driver.errors import Error as ClickHouseDriverError
+from clickhouse_driver.errors import ErrorCodes
+from clickhouse_sqlalchemy.exceptions import DatabaseException
 from django.conf import settings
-from sqlalchemy import create_engine
 
-from data.ssh_utils import ssh_tunnel
+from data.backends import ClickHouseQueryError, get_backend
+from data.query_cache import get_query_cache, is_bypassed, make_cache_key
+from data.telemetry import get_query_label, measure_query
 from data.utils import format_waste_codes
 
 SQL_PATH = settings.BASE_DIR / "data" / "sql"
@@ -15,19 +29,10 @@ STATIC_DATA_PATH = settings.BASE_DIR / "data" / "static"
 
 logger = logging.getLogger(__name__)
 
-FLOAT_COLUMNS = [
-    "quantite_tracee",
-    "quantite_emise",
-    "quantite_envoyee",
-    "quantite_recue",
-    "quantite_traitee",
-    "quantite_traitee_operations_non_finales",
-    "quantite_traitee_operations_finales",
-    "quantite_produite",
-]
 
-
-def run_query(sql_string: str, schema_overrides: dict = None) -> pl.DataFrame:
+def run_query(
+    sql_string: str, schema_overrides: dict = None, cache_ttl: int | None = None, label: str | None = None
+) -> pl.DataFrame:
     """
     Executes a SQL query to fetch data from the database and returns it as a Polars DataFrame.
 
@@ -37,6 +42,10 @@ def run_query(sql_string: str, schema_overrides: dict = None) -> pl.DataFrame:
         The SQL query string used to fetch data from the database.
     schema_overrides : dict, optional
         A dictionary specifying any schema overrides (polars types) for the query result. Defaults to None.
+    cache_ttl : int, optional
+        If set, the result is cached on disk and reused for this number of seconds. Defaults to None (no cache).
+    label : str, optional
+        Name of the query in the metrics. Defaults to the tables it reads.
 
     Returns
     -------
@@ -45,64 +54,215 @@ def run_query(sql_string: str, schema_overrides: dict = None) -> pl.DataFrame:
 
     Notes
     -----
-    This function uses SSH tunneling to securely connect to the ClickHouse database.
-    It relies on the `ssh_tunnel` context manager to establish and close the SSH connection.
-    The function also logs the duration of the query execution using the `logger`.
+    The query is answered by the backend selected by `settings.DWH_BACKEND` (see `data.backends`).
+    Warehouse backends use SSH tunneling to securely connect to the ClickHouse database.
+    They rely on the `warehouse_connection` context manager, so that the SSH tunnel and the pooled engine
+    of an enclosing extraction run are reused. Outside of such a run, a connection is opened for this query only.
+    With the `arrow` backend, the result is transferred in a columnar Arrow format
+    through the ClickHouse HTTP interface instead of being fetched row by row.
+    The timings and size of the query are recorded as `QueryMetrics` (see `data.telemetry`).
+    Cached results are ignored inside a `bypass_query_cache` context.
     """
-    started_time = time.time()
-
-    # Create SSH KEY:
-    with ssh_tunnel(settings) as tunnel:
-        local_port = tunnel.local_bind_port
-        local_host = tunnel.local_bind_host
-
-        SQLALCHEMY_DATABASE_URL = (
-            f"clickhouse+native://{settings.DWH_USERNAME}:{settings.DWH_PASSWORD}@{local_host}:{local_port}"
-        )
+    with measure_query(label or get_query_label(sql_string), settings.DWH_BACKEND) as metrics:
+        use_cache = cache_ttl is not None
+        if use_cache:
+            query_cache = get_query_cache()
+            cache_key = make_cache_key(sql_string, schema_overrides)
+            if not is_bypassed() and (data_df := query_cache.get(cache_key, cache_ttl)) is not None:
+                metrics.cached = True
+                metrics.add_batch(len(data_df), data_df.width, data_df.estimated_size())
+                return data_df
 
-        engine = create_engine(SQLALCHEMY_DATABASE_URL)
-        data_df = pl.read_database(sql_string, connection=engine, schema_overrides=schema_overrides)
+        data_df = get_backend().read(sql_string, schema_overrides, metrics)
 
-    # Convert Decimal to Float64 to avoid compatibility issues
-    data_df = data_df.cast({cs.decimal(): pl.Float64})
+        # Convert Decimal to Float64 to avoid compatibility issues
+        data_df = data_df.cast({cs.decimal(): pl.Float64})
+        metrics.add_batch(len(data_df), data_df.width, data_df.estimated_size())
 
-    logger.info(
-        "Loading stats duration: %s (query : %s)",
-        time.time() - started_time,
-        sql_string,
-    )
+        if use_cache:
+            query_cache.set(cache_key, data_df)
 
     return data_df
 
 
-def extract_dataset(sql_string: str, schema_overrides: dict = None) -> pl.DataFrame:
+def extract_dataset(sql_string: str, schema_overrides: dict = None, label: str | None = None) -> pl.DataFrame:
     """
-    Extracts a dataset from the database using an SQL query and performs type casting on specified columns.
+    Extracts a dataset from the database using an SQL query.
 
     Parameters
     ----------
     sql_string : str
         The SQL query string used to fetch data from the database.
     schema_overrides : dict, optional
-        A dictionary specifying any schema overrides (polars types) for the query result. Defaults to None.
+        A dictionary specifying any schema overrides (polars types) for the query result, usually
+        the dataset schema from `data.manifests.get_schema`. Defaults to None.
+    label : str, optional
+        Name of the query in the metrics, usually the dataset name.
 
     Returns
     -------
     pl.DataFrame
-        A Polars DataFrame containing the extracted data with specified columns cast to Float64 if they are originally of type String and listed in FLOAT_COLUMNS.
+        A Polars DataFrame containing the extracted data, with the given types applied at read time.
 
     Notes
     -----
-    This function assumes that `FLOAT_COLUMNS` is a predefined list of column names that need to be cast to Float64.
-    It also relies on the `run_query` function to execute the SQL query and fetch the data.
+    It relies on the `run_query` function to execute the SQL query and fetch the data.
     """
+    return run_query(sql_string, schema_overrides, label=label)
 
-    data_df = run_query(sql_string, schema_overrides)
-    for colname, data_type in data_df.schema.items():
-        if (data_type == pl.String) and (colname in FLOAT_COLUMNS):
-            data_df = data_df.with_columns(pl.col(colname).cast(pl.Float64))
 
-    return data_df
+class QueryResultError(ValueError):
+    """The result of a query does not match the expected schema: running the query again would fail the same way."""
+
+
+def _check_result_columns(columns: list[str], schema: dict[str, pl.DataType]):
+    missing_columns = [column for column in schema if column not in columns]
+    if missing_columns:
+        raise QueryResultError(f"Query result is missing columns {missing_columns}")
+
+
+def stream_query_to_parquet(
+    sql_string: str, path: Path, schema: dict[str, pl.DataType], label: str | None = None
+) -> int:
+    """
+    Executes a SQL query and writes its result to a parquet file, batch by batch.
+
+    The full result is never held in memory: each batch fetched from the database is written
+    as a row group before the next one is read.
+
+    Parameters
+    ----------
+    sql_string : str
+        The SQL query string used to fetch data from the database.
+    path : Path
+        Path of the parquet file. It is replaced only once the whole result has been written.
+    schema : dict
+        Column names and polars types of the query result. Every batch is cast to this schema,
+        so that row groups stay consistent whatever the types inferred for each batch.
+    label : str, optional
+        Name of the query in the metrics. Defaults to the file name.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+
+    Raises
+    ------
+    QueryResultError
+        If a column of `schema` is missing from the query result.
+
+    Notes
+    -----
+    Batches are read from the backend selected by `settings.DWH_BACKEND` (see `WarehouseBackend.iter_batches`).
+    With the `arrow` backend, batches are the ClickHouse blocks of the ArrowStream response.
+    The timings and size of the query are recorded as `QueryMetrics` (see `data.telemetry`).
+    """
+    path = Path(path)
+    temp_path = path.with_name(f"{path.name}.tmp")
+    arrow_schema = pl.DataFrame(schema=schema).to_arrow().schema
+
+    with measure_query(label or path.stem, settings.DWH_BACKEND) as metrics:
+        try:
+            with pq.ParquetWriter(temp_path, arrow_schema, compression="zstd") as writer:
+                for table in get_backend().iter_batches(sql_string, schema, metrics):
+                    _check_result_columns(table.column_names, schema)
+                    table = table.select(arrow_schema.names).cast(arrow_schema)
+                    metrics.add_batch(table.num_rows, table.num_columns, table.nbytes)
+                    with metrics.measure_write():
+                        writer.write_table(table)
+            os.replace(temp_path, path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+    return metrics.rows
+
+
+# Errors of the connection to the warehouse (network, SSH tunnel, timeouts), which may succeed on a new attempt.
+# `pyarrow.ArrowInvalid` is raised when decoding a result truncated by a lost connection
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    socket.gaierror,
+    urllib.error.URLError,
+    http.client.HTTPException,
+    sqlalchemy.exc.OperationalError,
+    sqlalchemy.exc.DisconnectionError,
+    sshtunnel.BaseSSHTunnelForwarderError,
+    paramiko.SSHException,
+    pa.ArrowInvalid,
+)
+
+# ClickHouse errors caused by the connection or the load of the server rather than by the query
+TRANSIENT_CLICKHOUSE_CODES = {
+    ErrorCodes.UNEXPECTED_END_OF_FILE,
+    ErrorCodes.ATTEMPT_TO_READ_AFTER_EOF,
+    ErrorCodes.UNEXPECTED_PACKET_FROM_SERVER,
+    ErrorCodes.TIMEOUT_EXCEEDED,
+    ErrorCodes.TOO_MANY_SIMULTANEOUS_QUERIES,
+    ErrorCodes.NO_FREE_CONNECTION,
+    ErrorCodes.SOCKET_TIMEOUT,
+    ErrorCodes.NETWORK_ERROR,
+    ErrorCodes.ALL_CONNECTION_TRIES_FAILED,
+    ErrorCodes.QUERY_WAS_CANCELLED,
+}
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Returns True if a query failed because of the connection to the warehouse, and may succeed on a new attempt.
+
+    Errors of the ClickHouse server or client are transient only with a network or timeout code: an unknown
+    identifier or a syntax error, for instance, would fail the same way.
+    """
+    if isinstance(error, DatabaseException):
+        # Errors of clickhouse-driver, wrapped by clickhouse-sqlalchemy
+        error = error.orig
+    if isinstance(error, (ClickHouseDriverError, ClickHouseQueryError)):
+        return error.code in TRANSIENT_CLICKHOUSE_CODES
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def run_with_retries(function, *args, description: str = "query"):
+    """
+    Calls `function(*args)`, retrying with exponential backoff if it fails because of the connection.
+
+    Transient failures (see `is_transient_error`) are retried up to `settings.DWH_QUERY_MAX_ATTEMPTS` attempts,
+    waiting `settings.DWH_QUERY_RETRY_DELAY` seconds before the first retry and twice as long before each following
+    one. Other errors, e.g. an invalid query or result (`QueryResultError`), are raised immediately.
+
+    Parameters
+    ----------
+    function : callable
+        Function running one query, e.g. `stream_query_to_parquet`.
+    *args
+        Arguments of `function`.
+    description : str, optional
+        Name of the query in the logs.
+
+    Returns
+    -------
+    Any
+        The result of `function`.
+    """
+    delay = settings.DWH_QUERY_RETRY_DELAY
+    for attempt in range(1, settings.DWH_QUERY_MAX_ATTEMPTS + 1):
+        try:
+            return function(*args)
+        except Exception as error:
+            if attempt == settings.DWH_QUERY_MAX_ATTEMPTS or not is_transient_error(error):
+                raise
+            logger.warning(
+                "Attempt %s of %s failed (%s: %s), retrying in %s s",
+                attempt,
+                description,
+                type(error).__name__,
+                error,
+                delay,
+            )
+            time.sleep(delay)
+            delay *= 2
 
 
 def get_processing_operation_codes_data() -> pl.DataFrame:
@@ -114,7 +274,10 @@ def get_processing_operation_codes_data() -> pl.DataFrame:
     DataFrame
         DataFrame with processing operations codes and description.
     """
-    data = run_query("SELECT * FROM trusted_zone_referentials.codes_operations_traitements")
+    data = run_query(
+        "SELECT * FROM trusted_zone_referentials.codes_operations_traitements",
+        cache_ttl=settings.DWH_REFERENTIALS_CACHE_TTL,
+    )
     return data
 
 
@@ -127,7 +290,9 @@ def get_departement_geographical_data() -> pl.DataFrame:
     DataFrame
         DataFrame with INSEE department geographical data.
     """
-    data = run_query("SELECT * FROM trusted_zone_insee.code_geo_departements")
+    data = run_query(
+        "SELECT * FROM trusted_zone_insee.code_geo_departements", cache_ttl=settings.DWH_REFERENTIALS_CACHE_TTL
+    )
 
     return data
 
@@ -141,7 +306,9 @@ def get_waste_nomenclature_data() -> pl.DataFrame:
     DataFrame
         DataFrame with waste nomenclature data.
     """
-    data = run_query("SELECT * FROM trusted_zone_referentials.codes_dechets")
+    data = run_query(
+        "SELECT * FROM trusted_zone_referentials.codes_dechets", cache_ttl=settings.DWH_REFERENTIALS_CACHE_TTL
+    )
     return data
 
 
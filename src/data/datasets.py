@@ -2,23 +2,53 @@
 The datasets are loaded in memory to be reusable by other functions.
 """
 
-from dataclasses import dataclass
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from datetime import date
+from pathlib import Path
 
 import polars as pl
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
+from data.checkpoint import ExtractionCheckpoint
+from data.connection import warehouse_connection
+from data.manifests import (
+    BS_FACTS_RENAMES,
+    DATASET_MANIFESTS,
+    apply_dataset_schema,
+    get_aligned_projection,
+    get_projection,
+    get_schema,
+    get_storage_schema,
+    get_superset_manifest,
+)
 from data.queries import (
     accounts_by_naf_annual_stats_sql,
     accounts_weekly_stats_sql,
     bs_weekly_data_sql,
     waste_produced_by_naf_annual_stats_sql,
     weekly_waste_processed_stats_sql,
+    yearly_totals_sql,
 )
+from data.utils import get_data_date_interval_for_year
+
+from .data_extract import extract_dataset, run_query, run_with_retries, stream_query_to_parquet
 
-from .data_extract import extract_dataset
+logger = logging.getLogger(__name__)
 
 
-@dataclass
+@dataclass(frozen=True)
 class Computed:
+    """
+    The raw datasets, loaded once and shared read-only by the computations of every year.
+    Fields are named after the datasets of `DATASETS_QUERIES`, plus the `bs_facts` table derived from them.
+    """
+
     bsdd_weekly_data: pl.DataFrame
     bsda_weekly_data: pl.DataFrame
     bsff_weekly_data: pl.DataFrame
@@ -33,44 +63,644 @@ class Computed:
     accounts_by_naf_data: pl.DataFrame
     waste_produced_by_naf_annual_stats: pl.DataFrame
 
+    # Fact table of the BS weekly datasets, built at staging time (see `build_bs_facts`)
+    bs_facts: pl.DataFrame
+
+
+BS_WEEKLY_TABLES = {
+    "bsdd_weekly_data": "refined_zone_stats_publiques.bsdd_statistiques_hebdomadaires",
+    "bsda_weekly_data": "refined_zone_stats_publiques.bsda_statistiques_hebdomadaires",
+    "bsff_weekly_data": "refined_zone_stats_publiques.bsff_statistiques_hebdomadaires",
+    "bsdasri_weekly_data": "refined_zone_stats_publiques.bsdasri_statistiques_hebdomadaires",
+    "bsvhu_weekly_data": "refined_zone_stats_publiques.bsvhu_statistiques_hebdomadaires",
+    "bsd_non_dangerous_weekly_data": "refined_zone_stats_publiques.bsd_non_dangereux_statistiques_hebdomadaires",
+}
+
+# Name of the long table of the BS weekly datasets, and type of bordereau of each dataset in its `bs_type` column
+BS_WEEKLY_DATASET = "bs_weekly_data"
+BS_TYPES = {dataset_name: dataset_name.removesuffix("_weekly_data") for dataset_name in BS_WEEKLY_TABLES}
+
+# Long-format fact table of the BS weekly datasets, with the same statistics under the same names
+BS_FACTS_DATASET = "bs_facts"
+
+_QUERY_TEMPLATES = {
+    **{dataset_name: bs_weekly_data_sql.replace("{table}", table) for dataset_name, table in BS_WEEKLY_TABLES.items()},
+    "accounts_weekly_data": accounts_weekly_stats_sql,
+    "weekly_waste_processed_data": weekly_waste_processed_stats_sql,
+    "accounts_by_naf_data": accounts_by_naf_annual_stats_sql,
+    "waste_produced_by_naf_annual_stats": waste_produced_by_naf_annual_stats_sql,
+}
+
+# Query templates projecting the manifest columns, weekly ones being filtered on `semaine >= {date_start}`
+DATASETS_QUERIES = {
+    dataset_name: template.replace("{columns}", get_projection(dataset_name))
+    for dataset_name, template in _QUERY_TEMPLATES.items()
+}
+
+# Datasets that can be extracted incrementally, from a given week onwards
+WEEKLY_DATASETS = [*BS_WEEKLY_TABLES, "accounts_weekly_data", "weekly_waste_processed_data"]
+
+# Partitioned staging layout: Hive style partitions of each dataset in `<staging>/partitioned/<dataset_name>/`,
+# by calendar year of the weeks (`year=`) for weekly datasets and by `annee=` for the NAF ones
+PARTITIONED_DIRNAME = "partitioned"
+PARTITION_COLUMNS = {
+    **{dataset_name: "year" for dataset_name in [*WEEKLY_DATASETS, BS_FACTS_DATASET]},
+    "accounts_by_naf_data": "annee",
+    "waste_produced_by_naf_annual_stats": "annee",
+}
+
+# Staging formats read by the yearly builds. The extraction always writes parquet files; with "ipc", an uncompressed
+# Arrow IPC copy of each dataset is also written in `<staging>/<dataset_name>.arrow`, and memory-mapped when read
+STAGING_FORMATS = ["parquet", "ipc"]
+IPC_SUFFIX = ".arrow"
+
+DEFAULT_DATE_START = date(2020, 1, 1)
+
+
+def get_dataset_sql(dataset_name: str, date_start: date | None = None) -> str:
+    """
+    Returns the extraction query of a dataset.
+
+    Parameters
+    ----------
+    dataset_name : str
+        Name of the dataset, as in `DATASETS_QUERIES`.
+    date_start : date, optional
+        For weekly datasets, first week to extract. Defaults to `DEFAULT_DATE_START`.
+
+    Returns
+    -------
+    str
+        The SQL query string.
+    """
+    date_start = date_start or DEFAULT_DATE_START
+    return DATASETS_QUERIES[dataset_name].format(date_start=f"{date_start:%Y-%m-%d}")
+
+
+def get_bs_weekly_sql(date_starts: dict[str, date] | None = None) -> str:
+    """
+    Returns the query extracting the six BS weekly datasets at once, as the long table `BS_WEEKLY_DATASET`.
+
+    Each row is tagged with the type of bordereau of its dataset (`bs_type`, see `BS_TYPES`), and the columns
+    are aligned on the union of the datasets columns, those missing from a dataset being null.
+    `split_bs_weekly_data` splits the result back into the datasets.
+
+    Parameters
+    ----------
+    date_starts : dict, optional
+        First week to extract, by BS dataset name. Datasets not listed are extracted from `DEFAULT_DATE_START`.
+
+    Returns
+    -------
+    str
+        The SQL query string.
+    """
+    date_starts = date_starts or {}
+    columns = {column: dtype for column, dtype in DATASET_MANIFESTS[BS_WEEKLY_DATASET].items() if column != "bs_type"}
+
+    branches = [
+        _QUERY_TEMPLATES[dataset_name]
+        .replace(
+            "{columns}", f"'{BS_TYPES[dataset_name]}' as bs_type,\n    {get_aligned_projection(dataset_name, columns)}"
+        )
+        .format(date_start=f"{date_starts.get(dataset_name) or DEFAULT_DATE_START:%Y-%m-%d}")
+        for dataset_name in BS_WEEKLY_TABLES
+    ]
+    return "union all".join(branches)
+
+
+def split_bs_weekly_data(bs_weekly_data: pl.DataFrame | pl.LazyFrame) -> dict[str, pl.DataFrame | pl.LazyFrame]:
+    """
+    Splits the long table of the BS weekly datasets (see `get_bs_weekly_sql`) into the datasets.
+
+    Parameters
+    ----------
+    bs_weekly_data : pl.DataFrame or pl.LazyFrame
+        The long table, with its `bs_type` column.
+
+    Returns
+    -------
+    dict
+        Rows of each dataset, restricted to the columns of its manifest, by dataset name.
+        Frames are lazy if `bs_weekly_data` is.
+    """
+    return {
+        dataset_name: bs_weekly_data.filter(pl.col("bs_type") == bs_type).select(list(DATASET_MANIFESTS[dataset_name]))
+        for dataset_name, bs_type in BS_TYPES.items()
+    }
 
-def get_data_df():
-    bsdd_weekly_data = extract_dataset(
-        bs_weekly_data_sql.format("refined_zone_stats_publiques.bsdd_statistiques_hebdomadaires")
+
+def build_bs_facts(bs_weekly_datasets: dict[str, pl.DataFrame | pl.LazyFrame]) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Builds the fact table of the BS weekly datasets: one row per type of bordereau and week.
+
+    The BSFF columns counting bordereaux are renamed after the columns of the other datasets
+    (see `BS_FACTS_RENAMES`), so that every statistic is held by a single column whatever the type of bordereau.
+    Columns of a single dataset (e.g. the BSFF packagings) are null for the other types.
+
+    Parameters
+    ----------
+    bs_weekly_datasets : dict
+        Frames of the BS weekly datasets, by dataset name.
+
+    Returns
+    -------
+    pl.DataFrame or pl.LazyFrame
+        The fact table, with its `bs_type` column. Lazy if the datasets are.
+    """
+    bs_type_dtype = DATASET_MANIFESTS[BS_FACTS_DATASET]["bs_type"]
+    return pl.concat(
+        [
+            data.rename(BS_FACTS_RENAMES.get(dataset_name, {}), strict=False).select(
+                pl.lit(BS_TYPES[dataset_name], dtype=bs_type_dtype).alias("bs_type"), pl.all()
+            )
+            for dataset_name, data in bs_weekly_datasets.items()
+        ],
+        how="diagonal_relaxed",
     )
-    bsda_weekly_data = extract_dataset(
-        bs_weekly_data_sql.format("refined_zone_stats_publiques.bsda_statistiques_hebdomadaires")
+
+
+def write_bs_facts(directory: Path = Path("temp_data")):
+    """
+    Writes the fact table of the staged BS weekly datasets (see `build_bs_facts`) to `<directory>/bs_facts.parquet`.
+
+    Parameters
+    ----------
+    directory : Path, optional
+        Staging directory, holding the parquet files written by `extract_datasets_to_parquet`.
+    """
+    directory = Path(directory)
+    facts_lf = build_bs_facts(
+        {dataset_name: pl.scan_parquet(directory / f"{dataset_name}.parquet") for dataset_name in BS_WEEKLY_TABLES}
     )
-    bsff_weekly_data = extract_dataset(
-        bs_weekly_data_sql.format("refined_zone_stats_publiques.bsff_statistiques_hebdomadaires")
+    path = directory / f"{BS_FACTS_DATASET}.parquet"
+    temp_path = path.with_suffix(".parquet.tmp")
+    facts_lf.select(list(DATASET_MANIFESTS[BS_FACTS_DATASET])).cast(get_storage_schema(BS_FACTS_DATASET)).sink_parquet(
+        temp_path
     )
-    bsdasri_weekly_data = extract_dataset(
-        bs_weekly_data_sql.format("refined_zone_stats_publiques.bsdasri_statistiques_hebdomadaires")
+    os.replace(temp_path, path)
+
+
+# Datasets whose stat columns are summed by year on the warehouse side
+YEARLY_TOTALS_DATASETS = [*BS_WEEKLY_TABLES, "accounts_weekly_data"]
+
+
+def get_yearly_totals_sql(date_end: date) -> str:
+    """
+    Returns the query summing every stat column of the weekly datasets by dataset and year.
+    BS datasets are projected on the columns of the fact table (see `build_bs_facts`).
+
+    Parameters
+    ----------
+    date_end : date
+        First incomplete week of the current year. Rows from this week onwards are flagged with `semaine_incomplete`,
+        so that yearly statistics can leave them out while all-time totals keep them.
+
+    Returns
+    -------
+    str
+        The SQL query string. Its result has `dataset`, `annee` and `semaine_incomplete` columns,
+        plus one column per stat column of the datasets (null for datasets without this column).
+    """
+    columns = get_superset_manifest([BS_FACTS_DATASET, "accounts_weekly_data"])
+    del columns["bs_type"]
+    stat_columns = [column for column, dtype in columns.items() if dtype.is_numeric()]
+
+    branches = [
+        _QUERY_TEMPLATES[dataset_name]
+        .replace(
+            "{columns}",
+            f"'{dataset_name}' as dataset,\n    "
+            f"{get_aligned_projection(dataset_name, columns, BS_FACTS_RENAMES.get(dataset_name))}",
+        )
+        .format(date_start=f"{DEFAULT_DATE_START:%Y-%m-%d}")
+        for dataset_name in YEARLY_TOTALS_DATASETS
+    ]
+
+    return yearly_totals_sql.format(
+        date_end=f"{date_end:%Y-%m-%d}",
+        sums=",\n    ".join(f"sum({column}) as {column}" for column in stat_columns),
+        union="union all".join(branches),
     )
-    bsvhu_weekly_data = extract_dataset(
-        bs_weekly_data_sql.format("refined_zone_stats_publiques.bsvhu_statistiques_hebdomadaires")
+
+
+def get_yearly_totals(date_end: date) -> pl.DataFrame:
+    """
+    Returns the stat columns of the weekly datasets summed by dataset and year, computed by the warehouse.
+    See `get_yearly_totals_sql`.
+    """
+    return run_query(get_yearly_totals_sql(date_end), label="yearly_totals")
+
+
+def _extract_named_dataset(dataset_name: str, sql_string: str) -> pl.DataFrame:
+    started_time = time.time()
+    data_df = run_with_retries(
+        extract_dataset, sql_string, get_schema(dataset_name), dataset_name, description=dataset_name
+    )
+    data_df = apply_dataset_schema(dataset_name, data_df)
+    logger.info("Dataset %s extracted in %s (%s rows)", dataset_name, time.time() - started_time, len(data_df))
+    return data_df
+
+
+def _stream_bs_weekly_data(sql_string: str, directory: Path, checkpoint: ExtractionCheckpoint) -> dict[str, int]:
+    """
+    Streams the long table of the BS weekly datasets, then splits it into the files of the datasets.
+    The datasets are recorded in the checkpoint with the query of the long table, whose file is deleted.
+    """
+    if all(checkpoint.is_completed(dataset_name, sql_string) for dataset_name in BS_TYPES):
+        logger.info("Datasets %s already extracted, skipped", list(BS_TYPES))
+        return {dataset_name: checkpoint.get_rows_count(dataset_name) for dataset_name in BS_TYPES}
+
+    started_time = time.time()
+    path = directory / f"{BS_WEEKLY_DATASET}.parquet"
+    run_with_retries(
+        stream_query_to_parquet,
+        sql_string,
+        path,
+        get_storage_schema(BS_WEEKLY_DATASET),
+        description=BS_WEEKLY_DATASET,
+    )
+
+    rows_counts = {}
+    for dataset_name, data_lf in split_bs_weekly_data(pl.scan_parquet(path)).items():
+        dataset_path = directory / f"{dataset_name}.parquet"
+        temp_path = dataset_path.with_name(f"{dataset_path.name}.tmp")
+        data_lf.sink_parquet(temp_path, compression="zstd")
+        os.replace(temp_path, dataset_path)
+        rows_counts[dataset_name] = pl.scan_parquet(dataset_path).select(pl.len()).collect().item()
+        checkpoint.mark_completed(dataset_name, sql_string, rows_counts[dataset_name])
+    path.unlink()
+
+    logger.info("Datasets %s streamed in %s (%s rows)", list(BS_TYPES), time.time() - started_time, rows_counts)
+    return rows_counts
+
+
+def _stream_named_dataset(
+    dataset_name: str, sql_string: str, directory: Path, checkpoint: ExtractionCheckpoint
+) -> int | dict[str, int]:
+    if dataset_name == BS_WEEKLY_DATASET:
+        return _stream_bs_weekly_data(sql_string, directory, checkpoint)
+
+    if checkpoint.is_completed(dataset_name, sql_string):
+        rows_count = checkpoint.get_rows_count(dataset_name)
+        logger.info("Dataset %s already extracted (%s rows), skipped", dataset_name, rows_count)
+        return rows_count
+
+    started_time = time.time()
+    rows_count = run_with_retries(
+        stream_query_to_parquet,
+        sql_string,
+        directory / f"{dataset_name}.parquet",
+        get_storage_schema(dataset_name),
+        description=dataset_name,
     )
-    bsd_non_dangerous_weekly_data = extract_dataset(
-        bs_weekly_data_sql.format("refined_zone_stats_publiques.bsd_non_dangereux_statistiques_hebdomadaires")
+    checkpoint.mark_completed(dataset_name, sql_string, rows_count)
+    logger.info("Dataset %s streamed in %s (%s rows)", dataset_name, time.time() - started_time, rows_count)
+    return rows_count
+
+
+def _run_extractions(extract_function, queries: dict[str, str], max_workers: int, *args) -> dict:
+    """
+    Calls `extract_function(dataset_name, sql_string, *args)` for each query, at most `max_workers` at once.
+    Returns the results by dataset name.
+
+    Every query goes through the same warehouse connection, opened here unless the caller already holds one, with a
+    pool of at least `max_workers` connections.
+    """
+    started_time = time.time()
+    with warehouse_connection(pool_size=max(max_workers, settings.DWH_POOL_SIZE)):
+        if max_workers == 1:
+            results = {
+                dataset_name: extract_function(dataset_name, sql_string, *args)
+                for dataset_name, sql_string in queries.items()
+            }
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    dataset_name: executor.submit(extract_function, dataset_name, sql_string, *args)
+                    for dataset_name, sql_string in queries.items()
+                }
+                results = {dataset_name: future.result() for dataset_name, future in futures.items()}
+
+    logger.info("All datasets extracted in %s (%s concurrent queries)", time.time() - started_time, max_workers)
+    return results
+
+
+def _get_datasets_queries(date_starts: dict[str, date] | None, batch_bs: bool = False) -> dict[str, str]:
+    date_starts = date_starts or {}
+    queries = {
+        dataset_name: get_dataset_sql(dataset_name, date_starts.get(dataset_name))
+        for dataset_name in DATASETS_QUERIES
+        if not (batch_bs and dataset_name in BS_TYPES)
+    }
+    if batch_bs:
+        queries[BS_WEEKLY_DATASET] = get_bs_weekly_sql(date_starts)
+    return queries
+
+
+def get_data_df(
+    max_workers: int | None = None, date_starts: dict[str, date] | None = None, batch_bs: bool | None = None
+) -> Computed:
+    """
+    Extracts every raw dataset from the data warehouse.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Maximum number of queries run concurrently. Defaults to `settings.DWH_EXTRACTION_CONCURRENCY`.
+        With 1, the datasets are extracted one after another.
+    date_starts : dict, optional
+        First week to extract, by weekly dataset name. Datasets not listed are extracted from `DEFAULT_DATE_START`.
+    batch_bs : bool, optional
+        If True, the six BS weekly datasets are extracted in a single query (see `get_bs_weekly_sql`).
+        Defaults to `settings.DWH_BATCH_BS_EXTRACTION`.
+
+    Returns
+    -------
+    Computed
+        Dataclass holding one DataFrame per dataset, and the fact table of the BS weekly datasets.
+    """
+    max_workers = max_workers or settings.DWH_EXTRACTION_CONCURRENCY
+    batch_bs = settings.DWH_BATCH_BS_EXTRACTION if batch_bs is None else batch_bs
+    datasets = _run_extractions(_extract_named_dataset, _get_datasets_queries(date_starts, batch_bs), max_workers)
+    if batch_bs:
+        for dataset_name, data_df in split_bs_weekly_data(datasets.pop(BS_WEEKLY_DATASET)).items():
+            datasets[dataset_name] = apply_dataset_schema(dataset_name, data_df)
+    datasets[BS_FACTS_DATASET] = apply_dataset_schema(
+        BS_FACTS_DATASET, build_bs_facts({dataset_name: datasets[dataset_name] for dataset_name in BS_WEEKLY_TABLES})
     )
 
-    accounts_weekly_data = extract_dataset(accounts_weekly_stats_sql)
+    return Computed(**datasets)
+
 
-    weekly_waste_processed_data = extract_dataset(weekly_waste_processed_stats_sql)
+def extract_datasets_to_parquet(
+    directory: Path,
+    max_workers: int | None = None,
+    date_starts: dict[str, date] | None = None,
+    batch_bs: bool | None = None,
+    mode: str | None = None,
+) -> dict[str, int]:
+    """
+    Extracts every raw dataset from the data warehouse into `<directory>/<dataset_name>.parquet` files.
 
-    accounts_by_naf_data = extract_dataset(accounts_by_naf_annual_stats_sql)
-    waste_produced_by_naf_annual_stats = extract_dataset(waste_produced_by_naf_annual_stats_sql)
+    Unlike `get_data_df`, query results are streamed to the files batch by batch, so memory use
+    does not depend on the size of the datasets.
 
-    data = Computed(
-        bsdd_weekly_data=bsdd_weekly_data,
-        bsda_weekly_data=bsda_weekly_data,
-        bsff_weekly_data=bsff_weekly_data,
-        bsdasri_weekly_data=bsdasri_weekly_data,
-        bsvhu_weekly_data=bsvhu_weekly_data,
-        bsd_non_dangerous_weekly_data=bsd_non_dangerous_weekly_data,
-        accounts_weekly_data=accounts_weekly_data,
-        weekly_waste_processed_data=weekly_waste_processed_data,
-        accounts_by_naf_data=accounts_by_naf_data,
-        waste_produced_by_naf_annual_stats=waste_produced_by_naf_annual_stats,
+    Each file is written atomically and recorded in the checkpoint of the directory (see `ExtractionCheckpoint`)
+    as soon as its query completes. Datasets already recorded with the same query are not extracted again,
+    so that an interrupted extraction resumes with the missing datasets. Each query is retried on its own
+    (see `run_with_retries`).
+
+    Parameters
+    ----------
+    directory : Path
+        Directory of the parquet files. Existing files of the datasets are replaced, unless recorded in its checkpoint.
+    max_workers : int, optional
+        Maximum number of queries run concurrently. Defaults to `settings.DWH_EXTRACTION_CONCURRENCY`.
+    date_starts : dict, optional
+        First week to extract, by weekly dataset name. Datasets not listed are extracted from `DEFAULT_DATE_START`.
+    batch_bs : bool, optional
+        If True, the six BS weekly datasets are extracted in a single query, then split into their files
+        (see `get_bs_weekly_sql`). Defaults to `settings.DWH_BATCH_BS_EXTRACTION`.
+    mode : str, optional
+        Extraction mode recorded in the checkpoint, so that only an extraction of the same mode resumes it.
+
+    Returns
+    -------
+    dict
+        Number of rows of each dataset file, by dataset name.
+    """
+    max_workers = max_workers or settings.DWH_EXTRACTION_CONCURRENCY
+    batch_bs = settings.DWH_BATCH_BS_EXTRACTION if batch_bs is None else batch_bs
+    directory = Path(directory)
+    checkpoint = ExtractionCheckpoint(directory, mode)
+    rows_counts = _run_extractions(
+        _stream_named_dataset, _get_datasets_queries(date_starts, batch_bs), max_workers, directory, checkpoint
     )
+    if batch_bs:
+        rows_counts.update(rows_counts.pop(BS_WEEKLY_DATASET))
+    return rows_counts
+
+
+def _with_partition_column(data: pl.DataFrame | pl.LazyFrame, dataset_name: str) -> pl.DataFrame | pl.LazyFrame:
+    if PARTITION_COLUMNS[dataset_name] == "year":
+        return data.with_columns(pl.col("semaine").dt.year().alias("year"))
     return data
+
+
+def write_partitioned_datasets(directory: Path = Path("temp_data")):
+    """
+    Writes a copy of the staged datasets in the partitioned layout (see `PARTITION_COLUMNS`).
+
+    Rows are sorted by week (or year), so that the min/max statistics of the row groups, written in each file,
+    also let readers skip row groups on range filters. Previous partitions are replaced.
+
+    Parameters
+    ----------
+    directory : Path, optional
+        Staging directory, holding the parquet files written by `extract_datasets_to_parquet`.
+    """
+    directory = Path(directory)
+    partitioned_dir = directory / PARTITIONED_DIRNAME
+    for dataset_name, partition_column in PARTITION_COLUMNS.items():
+        data_df = _with_partition_column(pl.read_parquet(directory / f"{dataset_name}.parquet"), dataset_name)
+        sort_column = "semaine" if "semaine" in data_df.columns else partition_column
+
+        # Empty datasets have no partition: they are read from their staged file
+        dataset_dir = partitioned_dir / dataset_name
+        if data_df.is_empty():
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+            continue
+
+        # Written aside first, so that readers never see a partially written dataset
+        temp_dir = partitioned_dir / f"{dataset_name}.tmp"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        data_df.sort(sort_column).write_parquet(temp_dir, partition_by=partition_column, statistics=True)
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+        os.replace(temp_dir, dataset_dir)
+
+
+def get_staging_format(staging_format: str | None = None) -> str:
+    """
+    Returns the given staging format, or `settings.STATS_STAGING_FORMAT`.
+
+    Raises
+    ------
+    ImproperlyConfigured
+        If the format is not one of `STAGING_FORMATS`.
+    """
+    staging_format = staging_format or settings.STATS_STAGING_FORMAT
+    if staging_format not in STAGING_FORMATS:
+        raise ImproperlyConfigured(
+            f"Unknown STATS_STAGING_FORMAT {staging_format!r}, expected one of {STAGING_FORMATS}"
+        )
+    return staging_format
+
+
+def write_ipc_datasets(directory: Path = Path("temp_data")):
+    """
+    Writes an uncompressed Arrow IPC copy of the parquet file of each staged dataset, next to it
+    (see `STAGING_FORMATS`). Other parquet files of the directory are left aside.
+
+    Readers memory-map these copies: their buffers are the pages of the OS cache, shared by every process reading
+    the same file, instead of being decompressed and decoded into fresh memory. The processes of a parallel build
+    do not read them: they receive a copy of the rows of their year (see `build_stats_and_figs_for_years`).
+    Unlike the parquet files, the copies are written with the types of the dataset schemas: label columns are
+    dictionary-encoded (Categorical or Enum) in the files, and need no conversion when they are loaded.
+
+    Parameters
+    ----------
+    directory : Path, optional
+        Staging directory, holding the parquet files written by `extract_datasets_to_parquet`.
+    """
+    directory = Path(directory)
+    for dataset_name in [*DATASETS_QUERIES, BS_FACTS_DATASET]:
+        path = directory / f"{dataset_name}.parquet"
+        if not path.exists():
+            continue
+        ipc_path = path.with_suffix(IPC_SUFFIX)
+        temp_path = path.with_suffix(f"{IPC_SUFFIX}.tmp")
+        # A single record batch per file, so that columns are read as contiguous buffers
+        data_df = apply_dataset_schema(dataset_name, pl.read_parquet(path))
+        data_df.write_ipc(temp_path, compression="uncompressed")
+        os.replace(temp_path, ipc_path)
+
+
+def remove_ipc_datasets(directory: Path = Path("temp_data")):
+    """Deletes the Arrow IPC copies of the staged datasets (see `write_ipc_datasets`)."""
+    for path in Path(directory).glob(f"*{IPC_SUFFIX}"):
+        path.unlink()
+
+
+def _get_staged_path(dataset_name: str, directory: Path, staging_format: str) -> Path:
+    # Falls back on the parquet file when the IPC copy was not written (yet)
+    path = Path(directory) / f"{dataset_name}.parquet"
+    if staging_format == "ipc" and path.with_suffix(IPC_SUFFIX).exists():
+        return path.with_suffix(IPC_SUFFIX)
+    return path
+
+
+def _scan_staged(path: Path) -> pl.LazyFrame:
+    if path.suffix == IPC_SUFFIX:
+        return pl.scan_ipc(path, memory_map=True)
+    return pl.scan_parquet(path)
+
+
+def load_dataset(
+    dataset_name: str,
+    directory: Path = Path("temp_data"),
+    years: list[int] | None = None,
+    staging_format: str | None = None,
+) -> pl.DataFrame:
+    """
+    Loads a dataset extracted by `extract_datasets_to_parquet`, with the types of its schema.
+
+    Parameters
+    ----------
+    dataset_name : str
+        Name of the dataset, as in `DATASETS_QUERIES`.
+    directory : Path, optional
+        Directory of the parquet files. Defaults to the staging directory.
+    years : list of int, optional
+        If set, only the rows of these years (calendar year of the weeks, or `annee`) are loaded.
+        Only their partitions are read if the datasets were also written in the partitioned layout
+        (see `write_partitioned_datasets`).
+    staging_format : str, optional
+        With "ipc", the Arrow IPC copy of the dataset is memory-mapped instead of reading its parquet file
+        (see `write_ipc_datasets`). Defaults to `settings.STATS_STAGING_FORMAT`.
+
+    Returns
+    -------
+    pl.DataFrame
+        The dataset, validated and cast by `apply_dataset_schema`.
+    """
+    path = _get_staged_path(dataset_name, directory, get_staging_format(staging_format))
+    if years is None:
+        if path.suffix == IPC_SUFFIX:
+            return apply_dataset_schema(dataset_name, pl.read_ipc(path, memory_map=True, rechunk=False))
+        return apply_dataset_schema(dataset_name, pl.read_parquet(path))
+
+    partition_dir = Path(directory) / PARTITIONED_DIRNAME / dataset_name
+    if partition_dir.is_dir():
+        data_lf = pl.scan_parquet(partition_dir, hive_partitioning=True)
+    else:
+        data_lf = _with_partition_column(_scan_staged(path), dataset_name)
+
+    partition_column = PARTITION_COLUMNS[dataset_name]
+    data_df = data_lf.filter(pl.col(partition_column).is_in(years)).collect()
+    if partition_column == "year":
+        data_df = data_df.drop("year")
+    return apply_dataset_schema(dataset_name, data_df)
+
+
+def load_datasets(
+    directory: Path = Path("temp_data"), years: list[int] | None = None, staging_format: str | None = None
+) -> Computed:
+    """
+    Loads every dataset extracted by `extract_datasets_to_parquet`, each file being read once.
+
+    Parameters
+    ----------
+    directory : Path, optional
+        Directory of the parquet files. Defaults to the staging directory.
+    years : list of int, optional
+        If set, only the rows of these years are loaded (see `load_dataset`).
+    staging_format : str, optional
+        Format of the staged files to read (see `load_dataset`). Defaults to `settings.STATS_STAGING_FORMAT`.
+
+    Returns
+    -------
+    Computed
+        Dataclass holding one DataFrame per dataset, validated and cast by `apply_dataset_schema`.
+        The fact table of the BS weekly datasets is built from them if it was not staged (see `write_bs_facts`).
+    """
+    datasets = {
+        dataset_name: load_dataset(dataset_name, directory, years, staging_format) for dataset_name in DATASETS_QUERIES
+    }
+    if (Path(directory) / f"{BS_FACTS_DATASET}.parquet").exists():
+        datasets[BS_FACTS_DATASET] = load_dataset(BS_FACTS_DATASET, directory, years, staging_format)
+    else:
+        datasets[BS_FACTS_DATASET] = apply_dataset_schema(
+            BS_FACTS_DATASET,
+            build_bs_facts({dataset_name: datasets[dataset_name] for dataset_name in BS_WEEKLY_TABLES}),
+        )
+    return Computed(**datasets)
+
+
+def split_datasets_by_year(datasets: Computed, years: list[int]) -> dict[int, Computed]:
+    """
+    Splits the datasets into the rows of each year, in a single pass over each dataset.
+
+    Weekly datasets are cut on the date intervals of `get_data_date_interval_for_year` (the incomplete week of the
+    current year is left out) and sorted by week, the NAF datasets on their `annee` column. The computations of
+    a year can then be run on its slice, without filtering the whole datasets again.
+
+    Parameters
+    ----------
+    datasets : Computed
+        The datasets of every year.
+    years : list of int
+        Years to split.
+
+    Returns
+    -------
+    dict
+        Datasets restricted to the rows of each year, by year. Years without rows get empty frames.
+    """
+    week_ends = {year: get_data_date_interval_for_year(year)[1].date() for year in years}
+    slices = {year: {} for year in years}
+    for field in fields(datasets):
+        data_df = getattr(datasets, field.name)
+        if "semaine" in data_df.columns:
+            week_end = pl.col("semaine").dt.year().replace_strict(week_ends, default=None, return_dtype=pl.Date)
+            data_df = data_df.filter(pl.col("semaine") < week_end).sort("semaine")
+            partitions = data_df.with_columns(pl.col("semaine").dt.year().alias("year")).partition_by(
+                "year", as_dict=True, include_key=False
+            )
+        else:
+            partitions = data_df.filter(pl.col("annee").is_in(years)).partition_by("annee", as_dict=True)
+
+        for year in years:
+            slices[year][field.name] = partitions.get((year,), data_df.clear())
+
+    return {year: Computed(**year_datasets) for year, year_datasets in slices.items()}
@@ -400,7 +400,8 @@ def create_quantity_processed_sunburst_figure(
             pl.col("semaine").is_between(*date_interval, closed="left") & (pl.col("code_operation") != "")
         )
         .group_by(["code_operation"])
-        .agg(pl.col("type_operation").max(), pl.col("quantite_traitee").sum())
+        # Grouped `max` is not supported on Enum columns, the last sorted value is the same
+        .agg(pl.col("type_operation").sort().last(), pl.col("quantite_traitee").sum())
     )
     total_data = agg_data.group_by("type_operation").agg(pl.col("quantite_traitee").sum()).sort("type_operation")
 
@@ -633,8 +634,6 @@ def create_treemap_companies_figure(data_with_naf: pl.DataFrame, year: int, use_
 
     df = data_with_naf.filter(pl.col("annee") == year)
 
-    df = df.fill_null("NAF inconnu")
-
     # Init values
 
     stat_col = "nombre_etablissements"
@@ -660,14 +659,19 @@ def create_treemap_companies_figure(data_with_naf: pl.DataFrame, year: int, use_
 
     categories = ["sous_classe", "classe", "groupe", "division", "section"]
 
+    # NAF categories are nested: a code has a single label and a single parent at each upper level,
+    # but some rows may lack it. Unknown labels are filled before taking the max, so that the result does not
+    # depend on the order of the rows. Labels are Categorical columns, whose grouped max is not supported:
+    # they are compared as strings
+    def label_expr(col_name: str) -> pl.Expr:
+        return pl.col(col_name).cast(pl.String).fill_null("NAF inconnu").max()
+
     # build dfs at each granularity
     dfs = []
     for i, cat in enumerate(categories):
-        temp_df = df.drop_nulls(f"libelle_{cat}")
-
         agg_exprs = [
             value_expr,
-            pl.col(f"libelle_{cat}").max(),
+            label_expr(f"libelle_{cat}"),
         ]
 
         id_sep = "#"
@@ -678,11 +682,18 @@ def create_treemap_companies_figure(data_with_naf: pl.DataFrame, year: int, use_
             # (e.g for "code_sous_classe" it will take the max of "code_classe" and upper hierarchies)
             for tmp_cat in reversed(categories[i + 1 :]):
                 tmp_col_name = f"libelle_{tmp_cat}"
-                agg_exprs.append(pl.col(tmp_col_name).max())
+                agg_exprs.append(label_expr(tmp_col_name))
                 col_names_to_agg.append(tmp_col_name)
         col_names_to_agg.append(f"libelle_{cat}")
 
-        temp_df = temp_df.group_by(f"code_{cat}", maintain_order=True).agg(agg_exprs)
+        # Unknown NAF codes are grouped together. Aggregated codes are few: they are turned back
+        # into strings to be filled, without re-encoding the categories of every row
+        temp_df = (
+            df.group_by(f"code_{cat}", maintain_order=True)
+            .agg(agg_exprs)
+            .with_columns(pl.col(pl.Categorical).cast(pl.String))
+            .with_columns(pl.col(pl.String).fill_null("NAF inconnu"))
+        )
 
         id_expr = pl.concat_str(
             [pl.lit("Tous les établissements")] + [pl.col(e) for e in col_names_to_agg], separator=id_sep
@@ -0,0 +1,341 @@
+"""
+Column manifests of the extracted datasets.
+
+Each manifest lists the columns projected by the extraction query of a dataset, with their polars type.
+The ClickHouse types of the projections are derived from them.
+Manifests are checked against the columns actually read by the plot configs and the processing functions,
+so that a missing column makes the build fail before any data is extracted.
+"""
+
+import polars as pl
+from django.core.exceptions import ImproperlyConfigured
+
+from data.plot_configs import (
+    WEEKLY_BS_STATS_PLOT_CONFIGS,
+    WEEKLY_BSFF_PACKAGINGS_STATS_PLOT_CONFIGS,
+    WEEKLY_BSFF_STATS_PLOT_CONFIGS,
+)
+
+# ClickHouse type of each polars type. Columns are projected with the matching `to<Type>` conversion function,
+# which keeps Nullable columns nullable. Categorical and Enum columns are transferred as strings.
+CLICKHOUSE_TYPES = {
+    pl.Date: "Date32",
+    pl.Int64: "Int64",
+    pl.Float64: "Float64",
+    pl.String: "String",
+    pl.Categorical: "String",
+    pl.Enum: "String",
+}
+
+# Labels with few distinct values. The Enum categories are sorted so that ordering matches the one of strings.
+OPERATION_TYPES = pl.Enum(sorted(["Déchet valorisé", "Déchet éliminé"]))
+
+QUANTITY_COLUMNS = {
+    "quantite_tracee": pl.Float64,
+    "quantite_envoyee": pl.Float64,
+    "quantite_recue": pl.Float64,
+    "quantite_traitee": pl.Float64,
+    "quantite_traitee_operations_non_finales": pl.Float64,
+    "quantite_traitee_operations_finales": pl.Float64,
+}
+
+BS_WEEKLY_MANIFEST = {
+    "semaine": pl.Date,
+    "creations": pl.Int64,
+    "envois": pl.Int64,
+    "receptions": pl.Int64,
+    "traitements": pl.Int64,
+    "traitements_operations_non_finales": pl.Int64,
+    "traitements_operations_finales": pl.Int64,
+    **QUANTITY_COLUMNS,
+}
+
+BSFF_WEEKLY_MANIFEST = {
+    "semaine": pl.Date,
+    "creations_bordereaux": pl.Int64,
+    "envois_bordereaux": pl.Int64,
+    "receptions_bordereaux": pl.Int64,
+    "traitements_bordereaux": pl.Int64,
+    "creations_contenants": pl.Int64,
+    "envois_contenants": pl.Int64,
+    "receptions_contenants": pl.Int64,
+    "traitements_contenants": pl.Int64,
+    "traitements_contenants_operations_non_finales": pl.Int64,
+    "traitements_contenants_operations_finales": pl.Int64,
+    **QUANTITY_COLUMNS,
+}
+
+# Types of bordereaux of the six BS weekly datasets, tagging their rows when they are extracted in a single query
+BS_TYPES = pl.Enum(sorted(["bsdd", "bsda", "bsff", "bsdasri", "bsvhu", "bsd_non_dangerous"]))
+
+# Long table of the six BS weekly datasets, aligned on the union of their columns (see `data.datasets.get_bs_weekly_sql`)
+BS_WEEKLY_LONG_MANIFEST = {"bs_type": BS_TYPES, **BS_WEEKLY_MANIFEST, **BSFF_WEEKLY_MANIFEST}
+
+# BSFF columns holding the statistics of the other BS datasets, renamed to their names in the fact table
+BS_FACTS_RENAMES = {
+    "bsff_weekly_data": {
+        "creations_bordereaux": "creations",
+        "envois_bordereaux": "envois",
+        "receptions_bordereaux": "receptions",
+        "traitements_bordereaux": "traitements",
+    },
+}
+
+# Fact table of the six BS weekly datasets, with the same statistics under the same names (see `BS_FACTS_RENAMES`)
+BS_FACTS_MANIFEST = {
+    "bs_type": BS_TYPES,
+    **BS_WEEKLY_MANIFEST,
+    **{
+        column: dtype
+        for column, dtype in BSFF_WEEKLY_MANIFEST.items()
+        if column not in BS_FACTS_RENAMES["bsff_weekly_data"]
+    },
+}
+
+NAF_CATEGORIES = ["sous_classe", "classe", "groupe", "division", "section"]
+
+# NAF codes and labels are repeated on every row: dictionary-encoded, so that the treemap groups integer codes
+NAF_COLUMNS = {
+    **{f"code_{category}": pl.Categorical for category in NAF_CATEGORIES},
+    **{f"libelle_{category}": pl.Categorical for category in NAF_CATEGORIES},
+}
+
+# Schema registry: polars type of each column of the datasets, applied when they are extracted and loaded
+DATASET_MANIFESTS = {
+    "bsdd_weekly_data": BS_WEEKLY_MANIFEST,
+    "bsda_weekly_data": BS_WEEKLY_MANIFEST,
+    "bsff_weekly_data": BSFF_WEEKLY_MANIFEST,
+    "bsdasri_weekly_data": BS_WEEKLY_MANIFEST,
+    "bsvhu_weekly_data": BS_WEEKLY_MANIFEST,
+    "bsd_non_dangerous_weekly_data": BS_WEEKLY_MANIFEST,
+    "bs_weekly_data": BS_WEEKLY_LONG_MANIFEST,
+    "bs_facts": BS_FACTS_MANIFEST,
+    "accounts_weekly_data": {
+        "semaine": pl.Date,
+        "comptes_etablissements": pl.Int64,
+        "comptes_utilisateurs": pl.Int64,
+    },
+    "weekly_waste_processed_data": {
+        "semaine": pl.Date,
+        "code_operation": pl.Categorical,
+        "type_operation": OPERATION_TYPES,
+        "quantite_traitee": pl.Float64,
+    },
+    "accounts_by_naf_data": {
+        "annee": pl.Int64,
+        "nombre_etablissements": pl.Int64,
+        **NAF_COLUMNS,
+    },
+    "waste_produced_by_naf_annual_stats": {
+        "annee": pl.Int64,
+        "quantite_produite": pl.Float64,
+        **NAF_COLUMNS,
+    },
+}
+
+
+def get_clickhouse_type(dtype: pl.DataType) -> str | None:
+    """Returns the ClickHouse type a polars type is read from, or None if it is not supported."""
+    return CLICKHOUSE_TYPES.get(dtype.base_type())
+
+
+def _get_plot_configs_columns(plot_configs: list[dict]) -> list[str]:
+    return [config[key] for config in plot_configs for key in ["column_counts", "column_quantity"] if key in config]
+
+
+def get_required_columns() -> dict[str, list[str]]:
+    """
+    Returns the columns read by the plot configs and the processing functions, by dataset.
+
+    Returns
+    -------
+    dict
+        Dataset name as key, list of required column names as value.
+    """
+    bs_weekly_columns = ["semaine", *_get_plot_configs_columns(WEEKLY_BS_STATS_PLOT_CONFIGS)]
+    # BSFF statistics (mean packagings by BSFF...) only read columns of the BSFF plot configs
+    bsff_weekly_columns = [
+        "semaine",
+        *_get_plot_configs_columns(WEEKLY_BSFF_STATS_PLOT_CONFIGS),
+        *_get_plot_configs_columns(WEEKLY_BSFF_PACKAGINGS_STATS_PLOT_CONFIGS),
+    ]
+    naf_columns = ["annee", *NAF_COLUMNS]
+
+    return {
+        "bsdd_weekly_data": bs_weekly_columns,
+        "bsda_weekly_data": bs_weekly_columns,
+        "bsff_weekly_data": bsff_weekly_columns,
+        "bsdasri_weekly_data": bs_weekly_columns,
+        "bsvhu_weekly_data": bs_weekly_columns,
+        "bsd_non_dangerous_weekly_data": bs_weekly_columns,
+        "accounts_weekly_data": ["semaine", "comptes_etablissements", "comptes_utilisateurs"],
+        "weekly_waste_processed_data": ["semaine", "code_operation", "type_operation", "quantite_traitee"],
+        "accounts_by_naf_data": [*naf_columns, "nombre_etablissements"],
+        "waste_produced_by_naf_annual_stats": [*naf_columns, "quantite_produite"],
+    }
+
+
+def check_manifests():
+    """
+    Checks that every manifest projects the columns required by the plot configs and the processing functions.
+
+    Raises
+    ------
+    ImproperlyConfigured
+        If a required column is missing from a manifest, or has no known ClickHouse type.
+    """
+    errors = []
+    for dataset_name, required_columns in get_required_columns().items():
+        manifest = DATASET_MANIFESTS[dataset_name]
+        missing_columns = [column for column in required_columns if column not in manifest]
+        if missing_columns:
+            errors.append(f"{dataset_name}: missing columns {missing_columns}")
+        unknown_types = {column: dtype for column, dtype in manifest.items() if get_clickhouse_type(dtype) is None}
+        if unknown_types:
+            errors.append(f"{dataset_name}: unknown types {unknown_types}")
+
+    if errors:
+        raise ImproperlyConfigured("Invalid dataset manifests: " + "; ".join(errors))
+
+
+def check_dataset_columns(dataset_name: str, columns: list[str]):
+    """
+    Checks that an extracted dataset holds every column of its manifest.
+
+    Raises
+    ------
+    ValueError
+        If a column of the manifest is missing.
+    """
+    missing_columns = [column for column in DATASET_MANIFESTS[dataset_name] if column not in columns]
+    if missing_columns:
+        raise ValueError(f"Dataset {dataset_name} is missing columns {missing_columns}")
+
+
+def apply_dataset_schema(dataset_name: str, data_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Validates a dataset against its manifest and casts its columns to the registered types.
+
+    Columns already having their registered type are left untouched, so this is cheap on freshly extracted data.
+
+    Parameters
+    ----------
+    dataset_name : str
+        Name of the dataset, as in `DATASET_MANIFESTS`.
+    data_df : pl.DataFrame
+        The extracted or loaded dataset.
+
+    Returns
+    -------
+    pl.DataFrame
+        The dataset with the columns of its manifest cast to their types.
+
+    Raises
+    ------
+    ValueError
+        If a column is missing or holds values that cannot be cast to its type (e.g. an unknown Enum category).
+    """
+    check_dataset_columns(dataset_name, data_df.columns)
+    schema = get_schema(dataset_name)
+    try:
+        return data_df.cast(schema)
+    except pl.exceptions.InvalidOperationError as error:
+        raise ValueError(f"Dataset {dataset_name} does not match its schema: {error}") from error
+
+
+def get_projection(dataset_name: str) -> str:
+    """
+    Returns the typed SELECT list of a dataset extraction query.
+
+    Parameters
+    ----------
+    dataset_name : str
+        Name of the dataset, as in `DATASET_MANIFESTS`.
+
+    Returns
+    -------
+    str
+        Comma separated list of `conversion(column) as column` expressions.
+    """
+    return ",\n    ".join(
+        f"to{get_clickhouse_type(dtype)}({column}) as {column}"
+        for column, dtype in DATASET_MANIFESTS[dataset_name].items()
+    )
+
+
+def get_schema(dataset_name: str) -> dict[str, pl.DataType]:
+    """
+    Returns the polars schema of a dataset.
+
+    Parameters
+    ----------
+    dataset_name : str
+        Name of the dataset, as in `DATASET_MANIFESTS`.
+
+    Returns
+    -------
+    dict
+        Column names and polars types, in the order of the projection.
+    """
+    return dict(DATASET_MANIFESTS[dataset_name])
+
+
+def get_storage_schema(dataset_name: str) -> dict[str, pl.DataType]:
+    """
+    Returns the polars schema of a dataset as written to parquet files batch by batch.
+
+    Categorical and Enum columns are stored as strings, since the files do not keep the Enum categories.
+    `apply_dataset_schema` restores their types when the files are loaded.
+    """
+    return {
+        column: pl.String if get_clickhouse_type(dtype) == "String" else dtype
+        for column, dtype in DATASET_MANIFESTS[dataset_name].items()
+    }
+
+
+def get_superset_manifest(dataset_names: list[str]) -> dict[str, pl.DataType]:
+    """
+    Returns the union of the manifests of several datasets, in order of first appearance.
+
+    Raises
+    ------
+    ValueError
+        If a column has different types in two manifests.
+    """
+    superset_manifest = {}
+    for dataset_name in dataset_names:
+        for column, dtype in DATASET_MANIFESTS[dataset_name].items():
+            if superset_manifest.setdefault(column, dtype) != dtype:
+                raise ValueError(f"Column {column} has conflicting types in {dataset_names}")
+    return superset_manifest
+
+
+def get_aligned_projection(
+    dataset_name: str, columns: dict[str, pl.DataType], renames: dict[str, str] | None = None
+) -> str:
+    """
+    Returns a typed SELECT list of a dataset aligned on the given columns, e.g. for UNION ALL queries.
+    Columns missing from the dataset manifest are projected as typed NULL values.
+
+    Parameters
+    ----------
+    dataset_name : str
+        Name of the dataset, as in `DATASET_MANIFESTS`.
+    columns : dict
+        Column names and polars types of the aligned projection, usually from `get_superset_manifest`.
+    renames : dict, optional
+        Dataset columns projected under another name (e.g. `BS_FACTS_RENAMES`), as {column: projected name}.
+
+    Returns
+    -------
+    str
+        Comma separated list of expressions, in the order of `columns`.
+    """
+    sources = {column: column for column in DATASET_MANIFESTS[dataset_name]}
+    sources.update({projected_column: column for column, projected_column in (renames or {}).items()})
+    return ",\n    ".join(
+        f"to{get_clickhouse_type(dtype)}({sources[column]}) as {column}"
+        if column in sources
+        else f"CAST(NULL, 'Nullable({get_clickhouse_type(dtype)})') as {column}"
+        for column, dtype in columns.items()
+    )
@@ -1,41 +1,57 @@
 bs_weekly_data_sql = """
 select
-    *
+    {columns}
 from
-    {}
+    {table}
 where
-    semaine >= '2020-01-01'
+    semaine >= '{date_start}'
 """
 
 accounts_weekly_stats_sql = """
 select
-    *
+    {columns}
 from
     refined_zone_stats_publiques.accounts_created_by_week
 where
-    semaine >= '2020-01-01'
+    semaine >= '{date_start}'
 """
 
 weekly_waste_processed_stats_sql = """
 select
-    *
+    {columns}
 from
     refined_zone_stats_publiques.weekly_waste_processed_stats
 where
-    semaine >= '2020-01-01'
+    semaine >= '{date_start}'
 """
 
 
 accounts_by_naf_annual_stats_sql = """
 select
-    *
+    {columns}
 from
     refined_zone_stats_publiques.annual_company_accounts_created_by_naf
 """
 
 waste_produced_by_naf_annual_stats_sql = """
 select
-    *
+    {columns}
 from
     refined_zone_stats_publiques.annual_waste_produced_by_naf
 """
+
+yearly_totals_sql = """
+select
+    dataset,
+    toYear(semaine) as annee,
+    toUInt8(semaine >= '{date_end}') as semaine_incomplete,
+    {sums}
+from
+    (
+    {union}
+    )
+group by
+    dataset,
+    annee,
+    semaine_incomplete
+"""
@@ -0,0 +1,139 @@
+"""
+On-disk cache for query results.
+
+Results are stored as parquet files named after a hash of the normalized SQL text and schema overrides.
+Each lookup provides its own time-to-live, and the least recently used files are evicted
+once the cache grows over its maximum size.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import polars as pl
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_bypass = False
+
+
+def make_cache_key(sql_string: str, schema_overrides: dict | None = None) -> str:
+    """
+    Returns the cache key of a query.
+
+    Parameters
+    ----------
+    sql_string : str
+        The SQL query string. Whitespace differences do not change the key.
+    schema_overrides : dict, optional
+        Schema overrides (polars types) applied to the query result.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest identifying the query.
+    """
+    normalized_sql = re.sub(r"\s+", " ", sql_string).strip().rstrip(";")
+    overrides = sorted((column, str(dtype)) for column, dtype in (schema_overrides or {}).items())
+    return hashlib.sha256(f"{normalized_sql}\n{overrides}".encode()).hexdigest()
+
+
+class QueryCache:
+    """
+    Size-bounded, least recently used cache of query results stored as parquet files.
+
+    Parameters
+    ----------
+    cache_dir : Path
+        Directory holding the cached files. Created if needed.
+    max_size : int
+        Maximum total size of the cached files, in bytes.
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+
+    def _get_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.parquet"
+
+    def get(self, key: str, ttl: int) -> pl.DataFrame | None:
+        """
+        Returns the cached result of a query, or None if it is missing or older than `ttl` seconds.
+        """
+        path = self._get_path(key)
+        try:
+            written_at = path.stat().st_mtime
+            if time.time() - written_at > ttl:
+                return None
+            data_df = pl.read_parquet(path)
+        except FileNotFoundError:
+            return None
+
+        # Access time tracks recent use for eviction, modification time the age of the result
+        os.utime(path, (time.time(), written_at))
+        return data_df
+
+    def set(self, key: str, data_df: pl.DataFrame):
+        """Stores the result of a query, then evicts the least recently used results if needed."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Written to a temporary file first so that concurrent readers never see a partial file
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(file_descriptor)
+        try:
+            data_df.write_parquet(temp_path)
+            os.replace(temp_path, self._get_path(key))
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used results until the cache fits in `max_size`."""
+        entries = []
+        for path in self.cache_dir.glob("*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= size
+            logger.info("Evicted cached query result %s", path.name)
+
+
+def get_query_cache() -> QueryCache:
+    return QueryCache(settings.DWH_QUERY_CACHE_DIR, settings.DWH_QUERY_CACHE_MAX_SIZE)
+
+
+def is_bypassed() -> bool:
+    return _bypass
+
+
+@contextmanager
+def bypass_query_cache():
+    """
+    Ignores cached results for the queries run inside the context.
+    Queries are executed again and their cached results refreshed.
+    """
+    global _bypass
+
+    previous_bypass = _bypass
+    _bypass = True
+    try:
+        yield
+    finally:
+        _bypass = previous_bypass
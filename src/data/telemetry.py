@@ -0,0 +1,304 @@
+"""
+Per-query extraction metrics.
+
+Each query run by `run_query` or `stream_query_to_parquet` produces one `QueryMetrics` record, logged as a JSON line
+by the `data.telemetry` logger. Records can also be collected during an extraction run and summarized at its end,
+together with the server-side profile of the queries read from the ClickHouse query log.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+logger = logging.getLogger(__name__)
+
+_collected_metrics = None
+_collected_metrics_lock = threading.Lock()
+
+# Columns of `system.query_log` reported as the server-side profile of a query
+SERVER_PROFILE_COLUMNS = [
+    "query_duration_ms",
+    "read_rows",
+    "read_bytes",
+    "result_rows",
+    "result_bytes",
+    "memory_usage",
+]
+
+server_profiles_sql = """
+select
+    log_comment,
+    {columns}
+from
+    system.query_log
+where
+    type = 'QueryFinish'
+    and event_date >= yesterday()
+    and log_comment in ({query_ids})
+"""
+
+
+def get_query_label(sql_string: str) -> str:
+    """Returns a short label of a query for the logs: its first tables, or the beginning of its text."""
+    tables = re.findall(r"\b(?:from|join)\s+([\w.]+)", sql_string, flags=re.IGNORECASE)
+    if tables:
+        return ", ".join(dict.fromkeys(tables[:3]))
+    return " ".join(sql_string.split())[:80]
+
+
+@dataclass
+class QueryMetrics:
+    """
+    Timings and sizes of one query execution. Times are in seconds, sizes in bytes.
+
+    Attributes
+    ----------
+    label : str
+        Name of the query in the logs (dataset name or queried tables).
+    backend : str
+        Backend which answered the query.
+    query_id : str
+        Unique identifier of the execution, sent to ClickHouse as the `log_comment` setting.
+    connect_time : float
+        Time spent getting a connection, including the SSH tunnel setup when it had to be opened.
+    first_batch_time : float, optional
+        Time from the start of the query to the reception of the first result batch, i.e. mostly server time.
+    total_time : float
+        Time of the whole query, including the transfer and decoding of the result.
+    decode_time : float, optional
+        Time spent converting the fetched rows to columns, when the backend can tell it apart from the transfer
+        (native backend, whose rows are fetched as Python tuples). The arrow and local backends decode the result
+        while reading it: None.
+    write_time : float, optional
+        Time spent writing the result to a parquet file, for streamed queries.
+    rows, columns : int
+        Size of the result.
+    size : int
+        In-memory (Arrow) size of the result.
+    cached : bool
+        True if the result came from the query cache.
+    error : str, optional
+        Error which interrupted the query.
+    server : dict, optional
+        Server-side profile (`SERVER_PROFILE_COLUMNS`), when available.
+    """
+
+    label: str = ""
+    backend: str = ""
+    query_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    connect_time: float = 0.0
+    first_batch_time: float | None = None
+    total_time: float = 0.0
+    decode_time: float | None = None
+    write_time: float | None = None
+    rows: int = 0
+    columns: int = 0
+    size: int = 0
+    cached: bool = False
+    error: str | None = None
+    server: dict | None = None
+    started_time: float = field(default_factory=time.time, repr=False)
+
+    @contextmanager
+    def measure_connect(self):
+        """Adds the time spent in the context to `connect_time`."""
+        started_time = time.time()
+        try:
+            yield
+        finally:
+            self.connect_time += time.time() - started_time
+
+    @contextmanager
+    def measure_decode(self):
+        """Adds the time spent in the context to `decode_time`."""
+        started_time = time.time()
+        try:
+            yield
+        finally:
+            self.decode_time = (self.decode_time or 0.0) + time.time() - started_time
+
+    @contextmanager
+    def measure_write(self):
+        """Adds the time spent in the context to `write_time`."""
+        started_time = time.time()
+        try:
+            yield
+        finally:
+            self.write_time = (self.write_time or 0.0) + time.time() - started_time
+
+    def mark_first_batch(self):
+        """Sets `first_batch_time`, unless a batch was already received."""
+        if self.first_batch_time is None:
+            self.first_batch_time = time.time() - self.started_time
+
+    def add_batch(self, rows: int, columns: int, size: int):
+        """Records a result batch, or the whole result."""
+        self.mark_first_batch()
+        self.rows += rows
+        self.columns = columns
+        self.size += size
+
+    def to_record(self) -> dict:
+        record = asdict(self)
+        del record["started_time"]
+        return record
+
+
+def record_query_metrics(metrics: QueryMetrics):
+    """Logs a metrics record as a JSON line, and keeps it if metrics are being collected."""
+    logger.info("query_metrics %s", json.dumps(metrics.to_record(), default=str))
+    with _collected_metrics_lock:
+        if _collected_metrics is not None:
+            _collected_metrics.append(metrics)
+
+
+@contextmanager
+def measure_query(label: str, backend: str) -> Iterator[QueryMetrics]:
+    """
+    Yields the metrics of a query executed in the context, and records them when it exits, even on error.
+    """
+    metrics = QueryMetrics(label=label, backend=backend)
+    try:
+        yield metrics
+    except BaseException as error:
+        metrics.error = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        metrics.total_time = time.time() - metrics.started_time
+        record_query_metrics(metrics)
+
+
+@contextmanager
+def collect_query_metrics() -> Iterator[list[QueryMetrics]]:
+    """
+    Yields the list of the metrics recorded inside the context, by any thread.
+    """
+    global _collected_metrics
+
+    previous_metrics = _collected_metrics
+    collected_metrics = []
+    _collected_metrics = collected_metrics
+    try:
+        yield collected_metrics
+    finally:
+        _collected_metrics = previous_metrics
+
+
+def add_server_profiles(metrics_list: list[QueryMetrics], read_function):
+    """
+    Adds the server-side profile of the queries, read from `system.query_log` with `read_function`.
+
+    The query log is flushed asynchronously by ClickHouse, so the profile of the last queries may be missing.
+    Failures (e.g. no access to the query log, or a backend without one) are logged and ignored.
+
+    Parameters
+    ----------
+    metrics_list : list of QueryMetrics
+        Metrics of the queries to complete.
+    read_function : callable
+        Function running a query and returning a polars DataFrame, e.g. `WarehouseBackend.read`.
+    """
+    query_ids = [metrics.query_id for metrics in metrics_list if not metrics.cached]
+    if not query_ids:
+        return
+
+    sql_string = server_profiles_sql.format(
+        columns=",\n    ".join(SERVER_PROFILE_COLUMNS),
+        query_ids=", ".join(f"'{query_id}'" for query_id in query_ids),
+    )
+    try:
+        profiles_df = read_function(sql_string)
+    except Exception as error:  # noqa: BLE001 - the profiles are optional
+        logger.warning("Server-side query profiles unavailable (%s: %s)", type(error).__name__, error)
+        return
+
+    profiles = {row.pop("log_comment"): row for row in profiles_df.to_dicts()}
+    for metrics in metrics_list:
+        metrics.server = profiles.get(metrics.query_id, metrics.server)
+
+
+def _format_seconds(value: float | None) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+def _format_megabytes(value: int | None) -> str:
+    return "-" if value is None else f"{value / 1024**2:.1f}"
+
+
+def _sum_measured(values) -> float | None:
+    measured = [value for value in values if value is not None]
+    return sum(measured) if measured else None
+
+
+def format_summary(metrics_list: list[QueryMetrics]) -> str:
+    """
+    Returns a text table summarizing the metrics of a run, one line per query plus a total line.
+
+    Columns are the client-side times (connection, first batch, decoding and parquet writing when measured, total),
+    the result size, and the server-side duration, bytes read and peak memory when available. Decoding is "-" for the
+    backends which decode the result while reading it: their decoding time is part of the total only.
+    """
+    headers = [
+        "query",
+        "conn s",
+        "1st batch s",
+        "decode s",
+        "write s",
+        "total s",
+        "rows",
+        "cols",
+        "MB",
+        "server s",
+        "read MB",
+        "peak MB",
+    ]
+    lines = []
+    for metrics in metrics_list:
+        server = metrics.server or {}
+        lines.append(
+            [
+                metrics.label + (" (cached)" if metrics.cached else "") + (" (failed)" if metrics.error else ""),
+                _format_seconds(metrics.connect_time),
+                _format_seconds(metrics.first_batch_time),
+                _format_seconds(metrics.decode_time),
+                _format_seconds(metrics.write_time),
+                _format_seconds(metrics.total_time),
+                str(metrics.rows),
+                str(metrics.columns),
+                _format_megabytes(metrics.size),
+                _format_seconds(server["query_duration_ms"] / 1000 if server else None),
+                _format_megabytes(server.get("read_bytes")),
+                _format_megabytes(server.get("memory_usage")),
+            ]
+        )
+    lines.append(
+        [
+            f"total ({len(metrics_list)} queries)",
+            _format_seconds(sum(metrics.connect_time for metrics in metrics_list)),
+            "",
+            _format_seconds(_sum_measured(metrics.decode_time for metrics in metrics_list)),
+            _format_seconds(_sum_measured(metrics.write_time for metrics in metrics_list)),
+            _format_seconds(sum(metrics.total_time for metrics in metrics_list)),
+            str(sum(metrics.rows for metrics in metrics_list)),
+            "",
+            _format_megabytes(sum(metrics.size for metrics in metrics_list)),
+            "",
+            "",
+            "",
+        ]
+    )
+
+    widths = [max(len(line[index]) for line in [headers, *lines]) for index in range(len(headers))]
+    return "\n".join(
+        "  ".join(
+            value.ljust(width) if index == 0 else value.rjust(width)
+            for index, (value, width) in enumerate(zip(line, widths))
+        )
+        for line in [headers, *lines]
+    )
@@ -0,0 +1,146 @@
+from datetime import date, timedelta
+
+import polars as pl
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+from polars.testing import assert_frame_equal
+
+from data.backends import LocalBackend, get_backend
+from data.checkpoint import ExtractionCheckpoint
+from data.data_extract import run_query, stream_query_to_parquet
+from data.data_processing import compute_yearly_totals
+from data.datasets import (
+    BS_WEEKLY_DATASET,
+    BS_WEEKLY_TABLES,
+    YEARLY_TOTALS_DATASETS,
+    _stream_named_dataset,
+    build_bs_facts,
+    get_bs_weekly_sql,
+    get_dataset_sql,
+    get_yearly_totals,
+    load_dataset,
+    split_bs_weekly_data,
+)
+from data.manifests import DATASET_MANIFESTS, apply_dataset_schema, get_storage_schema
+
+pytest.importorskip("duckdb")
+
+WEEKS = [date(2025, 12, 1) + timedelta(weeks=index) for index in range(10)]
+
+
+def weekly_table(dataset_name: str) -> pl.DataFrame:
+    # Quantities are stored as strings in some warehouse tables
+    return pl.DataFrame(
+        {
+            column: WEEKS if column == "semaine" else [str(index) for index in range(len(WEEKS))]
+            for column in DATASET_MANIFESTS[dataset_name]
+        }
+    )
+
+
+@pytest.fixture
+def local_warehouse(settings, tmp_path):
+    database_dir = tmp_path / "refined_zone_stats_publiques"
+    database_dir.mkdir()
+    for dataset_name, table in BS_WEEKLY_TABLES.items():
+        weekly_table(dataset_name).write_parquet(tmp_path / f"{table.replace('.', '/')}.parquet")
+    weekly_table("accounts_weekly_data").write_parquet(database_dir / "accounts_created_by_week.parquet")
+
+    settings.DWH_BACKEND = "local"
+    settings.DWH_LOCAL_DATA_DIR = tmp_path
+    return tmp_path
+
+
+def test_local_backend_run_query(local_warehouse):
+    data_df = run_query(get_dataset_sql("bsdd_weekly_data", date(2026, 1, 1)))
+
+    assert len(data_df) == 5
+    assert data_df.schema["semaine"] == pl.Date
+    assert data_df.schema["creations"] == pl.Int64
+    assert data_df["quantite_traitee"].to_list() == [5.0, 6.0, 7.0, 8.0, 9.0]
+
+
+def test_local_backend_stream_query_to_parquet(local_warehouse, tmp_path):
+    rows_count = stream_query_to_parquet(
+        get_dataset_sql("bsff_weekly_data"),
+        tmp_path / "bsff_weekly_data.parquet",
+        get_storage_schema("bsff_weekly_data"),
+    )
+
+    assert rows_count == 10
+    assert load_dataset("bsff_weekly_data", tmp_path)["creations_bordereaux"].sum() == 45
+
+
+def test_local_backend_yearly_totals(local_warehouse):
+    yearly_totals_df = get_yearly_totals(date(2026, 1, 26)).sort("dataset", "annee", "semaine_incomplete")
+
+    bsdd_totals = yearly_totals_df.filter(pl.col("dataset") == "bsdd_weekly_data")
+    assert bsdd_totals["annee"].to_list() == [2025, 2026, 2026]
+    assert bsdd_totals["semaine_incomplete"].to_list() == [0, 0, 1]
+    # Integer sums stay integers, as with ClickHouse
+    assert bsdd_totals["creations"].to_list() == [0 + 1 + 2 + 3 + 4, 5 + 6 + 7, 8 + 9]
+    assert yearly_totals_df.schema["creations"] == pl.Int64
+    # Columns of other datasets are null
+    assert yearly_totals_df.filter(pl.col("dataset") == "accounts_weekly_data")["creations"].null_count() == 3
+    # BSFF bordereaux are counted in the columns of the fact table
+    assert yearly_totals_df.filter(pl.col("dataset") == "bsff_weekly_data")["creations"].sum() == 45
+
+    # Same totals from the fact table of the datasets
+    datasets = {
+        dataset_name: apply_dataset_schema(dataset_name, run_query(get_dataset_sql(dataset_name)))
+        for dataset_name in YEARLY_TOTALS_DATASETS
+    }
+    bs_facts_df = build_bs_facts({dataset_name: datasets[dataset_name] for dataset_name in BS_WEEKLY_TABLES})
+    computed_totals_df = compute_yearly_totals(bs_facts_df, datasets["accounts_weekly_data"], date(2026, 1, 26))
+    assert_frame_equal(
+        computed_totals_df.select(yearly_totals_df.columns).sort("dataset", "annee", "semaine_incomplete"),
+        yearly_totals_df,
+        check_dtypes=False,
+    )
+
+
+def test_local_backend_batch_bs_extraction(local_warehouse, tmp_path):
+    date_starts = {"bsda_weekly_data": date(2026, 1, 1)}
+    sql_string = get_bs_weekly_sql(date_starts)
+
+    bs_weekly_df = apply_dataset_schema(BS_WEEKLY_DATASET, run_query(sql_string))
+    assert dict(bs_weekly_df["bs_type"].value_counts().iter_rows()) == {
+        "bsdd": 10,
+        "bsda": 5,
+        "bsff": 10,
+        "bsdasri": 10,
+        "bsvhu": 10,
+        "bsd_non_dangerous": 10,
+    }
+    # Columns of the BSFF dataset only are null for the other datasets
+    assert bs_weekly_df.filter(pl.col("bs_type") == "bsdd")["creations_contenants"].null_count() == 10
+
+    for dataset_name, data_df in split_bs_weekly_data(bs_weekly_df).items():
+        expected_df = apply_dataset_schema(
+            dataset_name, run_query(get_dataset_sql(dataset_name, date_starts.get(dataset_name)))
+        )
+        assert_frame_equal(data_df.sort("semaine"), expected_df.sort("semaine"))
+
+    staging_dir = tmp_path / "staging"
+    staging_dir.mkdir()
+    rows_counts = _stream_named_dataset(BS_WEEKLY_DATASET, sql_string, staging_dir, ExtractionCheckpoint(staging_dir))
+
+    assert rows_counts == {dataset_name: 5 if dataset_name in date_starts else 10 for dataset_name in BS_WEEKLY_TABLES}
+    assert sorted(path.name for path in staging_dir.iterdir()) == sorted(
+        ["_checkpoint.json", *(f"{dataset_name}.parquet" for dataset_name in BS_WEEKLY_TABLES)]
+    )
+    assert load_dataset("bsff_weekly_data", staging_dir)["creations_bordereaux"].sum() == 45
+
+
+def test_unknown_backend(settings):
+    settings.DWH_BACKEND = "postgres"
+
+    with pytest.raises(ImproperlyConfigured, match="Unknown DWH_BACKEND"):
+        get_backend()
+
+
+def test_local_backend_missing_directory(settings, tmp_path):
+    settings.DWH_LOCAL_DATA_DIR = tmp_path / "missing"
+
+    with pytest.raises(ImproperlyConfigured, match="is not a directory"):
+        LocalBackend().read("SELECT 1")
@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+
+import pytest
+
+from data import connection as connection_module
+from data.connection import warehouse_connection
+from data.datasets import _run_extractions
+
+
+class FakeTunnel:
+    def __init__(self):
+        self.local_bind_hosts = ["127.0.0.1"]
+        self.local_bind_ports = [12345]
+        self.is_active = True
+
+
+class FakeEngine:
+    def __init__(self):
+        self.disposed = False
+
+    def dispose(self):
+        self.disposed = True
+
+
+@pytest.fixture
+def opened_tunnels(monkeypatch):
+    tunnels = []
+
+    @contextmanager
+    def fake_open_transport(settings, remote_ports=None):
+        tunnel = FakeTunnel()
+        tunnels.append(tunnel)
+        yield tunnel
+        tunnel.is_active = False
+
+    monkeypatch.setattr(connection_module, "open_transport", fake_open_transport)
+    monkeypatch.setattr(connection_module, "create_engine", lambda *args, **kwargs: FakeEngine())
+    return tunnels
+
+
+def test_tunnel_is_opened_lazily_and_once(opened_tunnels):
+    with warehouse_connection() as connection:
+        assert opened_tunnels == []
+
+        engine = connection.get_engine()
+        with warehouse_connection() as nested_connection:
+            assert nested_connection is connection
+            assert nested_connection.get_engine() is engine
+
+    assert len(opened_tunnels) == 1
+    assert not opened_tunnels[0].is_active
+    assert engine.disposed
+
+
+def test_tunnel_is_reopened_when_down(opened_tunnels):
+    with warehouse_connection() as connection:
+        first_engine = connection.get_engine()
+        opened_tunnels[0].is_active = False
+
+        second_engine = connection.get_engine()
+
+    assert len(opened_tunnels) == 2
+    assert first_engine.disposed
+    assert second_engine is not first_engine
+
+
+def test_extraction_threads_share_one_connection(opened_tunnels):
+    def extract(dataset_name, sql_string):
+        with warehouse_connection() as connection:
+            return connection, connection.get_engine()
+
+    results = _run_extractions(extract, {f"dataset_{index}": "SELECT 1" for index in range(8)}, 4)
+
+    assert len({id(connection) for connection, _ in results.values()}) == 1
+    assert len(opened_tunnels) == 1
+    # Closed once the extractions are done
+    assert not opened_tunnels[0].is_active
+    assert connection_module._active_connection is None
@@ -0,0 +1,237 @@
+import threading
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from clickhouse_driver.errors import ErrorCodes, NetworkError, ServerException
+from clickhouse_sqlalchemy.exceptions import DatabaseException
+from sqlalchemy import create_engine, event, text
+
+from data import backends
+from data.backends import ClickHouseQueryError, _read_arrow
+from data.data_extract import QueryResultError, run_query, run_with_retries, stream_query_to_parquet
+from data.telemetry import QueryMetrics, collect_query_metrics
+
+
+@pytest.fixture
+def clickhouse_http_server():
+    received = {}
+    table = pa.table(
+        {
+            "semaine": pa.array([19723, 19730], type=pa.date32()),
+            "quantite_traitee": pa.array([Decimal("1.50"), Decimal("2.25")], type=pa.decimal128(10, 2)),
+        }
+    )
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received["query"] = self.rfile.read(int(self.headers["Content-Length"])).decode()
+            received["path"] = self.path
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=1)
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(sink.getvalue().to_pybytes())
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/", received
+    server.shutdown()
+
+
+def test_read_arrow(clickhouse_http_server):
+    http_url, received = clickhouse_http_server
+
+    data_df = pl.from_arrow(_read_arrow("SELECT * FROM weekly_waste_processed_stats", http_url))
+
+    assert "default_format=ArrowStream" in received["path"]
+    assert received["query"].startswith("SELECT * REPLACE (toDate32(semaine) AS semaine")
+    assert received["query"].endswith("FROM (SELECT * FROM weekly_waste_processed_stats)")
+    assert data_df.schema == {"semaine": pl.Date, "quantite_traitee": pl.Float64}
+    assert data_df["quantite_traitee"].to_list() == [1.5, 2.25]
+
+
+@pytest.fixture
+def arrow_backend(monkeypatch, settings, clickhouse_http_server):
+    http_url, _ = clickhouse_http_server
+
+    class FakeConnection:
+        def get_http_url(self):
+            return http_url
+
+    @contextmanager
+    def fake_warehouse_connection():
+        yield FakeConnection()
+
+    settings.DWH_BACKEND = "arrow"
+    monkeypatch.setattr(backends, "warehouse_connection", fake_warehouse_connection)
+
+
+def test_stream_query_to_parquet(arrow_backend, tmp_path):
+    path = tmp_path / "weekly_waste_processed_data.parquet"
+
+    with collect_query_metrics() as query_metrics:
+        rows_count = stream_query_to_parquet(
+            "SELECT * FROM weekly_waste_processed_stats", path, {"semaine": pl.Date, "quantite_traitee": pl.Float64}
+        )
+
+    assert rows_count == 2
+    assert query_metrics[0].write_time > 0
+    # One row group per ClickHouse block
+    assert pq.ParquetFile(path).num_row_groups == 2
+    data_df = pl.read_parquet(path)
+    assert data_df.schema == {"semaine": pl.Date, "quantite_traitee": pl.Float64}
+    assert data_df["quantite_traitee"].to_list() == [1.5, 2.25]
+
+
+def test_stream_query_to_parquet_missing_column(arrow_backend, tmp_path):
+    path = tmp_path / "weekly_waste_processed_data.parquet"
+
+    with pytest.raises(QueryResultError, match="code_operation"):
+        stream_query_to_parquet(
+            "SELECT * FROM weekly_waste_processed_stats", path, {"semaine": pl.Date, "code_operation": pl.String}
+        )
+
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    ("error", "expected_calls"),
+    [
+        # Connection lost or server busy: retried
+        (pa.ArrowInvalid("truncated stream"), 2),
+        (ConnectionResetError("Connection reset by peer"), 2),
+        (DatabaseException(NetworkError("Connection refused")), 2),
+        (DatabaseException(ServerException("Timeout exceeded", code=ErrorCodes.TIMEOUT_EXCEEDED)), 2),
+        (ClickHouseQueryError("Too many simultaneous queries", code=ErrorCodes.TOO_MANY_SIMULTANEOUS_QUERIES), 2),
+        # Invalid query or result: fails at once
+        (QueryResultError("missing columns"), 1),
+        (DatabaseException(ServerException("Unknown identifier", code=ErrorCodes.UNKNOWN_IDENTIFIER)), 1),
+        (ClickHouseQueryError("Syntax error", code=ErrorCodes.SYNTAX_ERROR), 1),
+        (KeyError("semaine"), 1),
+    ],
+)
+def test_run_with_retries(settings, error, expected_calls):
+    settings.DWH_QUERY_MAX_ATTEMPTS = 2
+    settings.DWH_QUERY_RETRY_DELAY = 0
+    calls = []
+
+    def failing_query():
+        calls.append(error)
+        raise error
+
+    with pytest.raises(type(error)):
+        run_with_retries(failing_query)
+
+    assert len(calls) == expected_calls
+
+
+def test_read_arrow_error_code(monkeypatch):
+    def failing_urlopen(request, timeout):
+        raise urllib.error.HTTPError(
+            request.full_url,
+            404,
+            "Not Found",
+            {"X-ClickHouse-Exception-Code": "47"},
+            BytesIO(b"Code: 47. DB::Exception: Unknown expression identifier `quantite`"),
+        )
+
+    monkeypatch.setattr(urllib.request, "urlopen", failing_urlopen)
+
+    with pytest.raises(ClickHouseQueryError, match="Unknown expression identifier") as error_info:
+        _read_arrow("SELECT quantite FROM weekly_waste_processed_stats", "http://127.0.0.1/")
+
+    assert error_info.value.code == ErrorCodes.UNKNOWN_IDENTIFIER
+
+
+def test_run_query_metrics(arrow_backend, clickhouse_http_server, tmp_path):
+    _, received = clickhouse_http_server
+
+    with collect_query_metrics() as query_metrics:
+        run_query("SELECT * FROM weekly_waste_processed_stats")
+        read_path = received["path"]
+        with pytest.raises(ValueError):
+            stream_query_to_parquet(
+                "SELECT * FROM weekly_waste_processed_stats",
+                tmp_path / "processed.parquet",
+                {"semaine": pl.Date, "code_operation": pl.String},
+                "processed",
+            )
+
+    read_metrics, stream_metrics = query_metrics
+    assert read_metrics.label == "weekly_waste_processed_stats"
+    assert read_metrics.backend == "arrow"
+    # The query can be found in the ClickHouse query log
+    assert f"log_comment={read_metrics.query_id}" in read_path
+    assert (read_metrics.rows, read_metrics.columns) == (2, 2)
+    assert read_metrics.size > 0
+    assert read_metrics.connect_time <= read_metrics.first_batch_time <= read_metrics.total_time
+    assert read_metrics.error is None
+    # Decoded while read by the arrow backend
+    assert read_metrics.decode_time is None
+    assert stream_metrics.label == "processed"
+    assert stream_metrics.error.startswith("QueryResultError")
+
+
+@pytest.fixture
+def native_backend(monkeypatch, settings, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'warehouse.db'}")
+    with engine.begin() as db_connection:
+        db_connection.execute(text("CREATE TABLE weekly (semaine DATE, quantite_traitee REAL)"))
+        db_connection.execute(
+            text("INSERT INTO weekly VALUES (:semaine, :quantite)"),
+            [{"semaine": "2024-01-01", "quantite": index / 2} for index in range(250)],
+        )
+
+    execution_options = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, parameters, context, executemany: execution_options.append(
+            context.execution_options
+        ),
+    )
+
+    class FakeConnection:
+        def get_engine(self):
+            return engine
+
+    @contextmanager
+    def fake_warehouse_connection():
+        yield FakeConnection()
+
+    settings.DWH_BACKEND = "native"
+    monkeypatch.setattr(backends, "warehouse_connection", fake_warehouse_connection)
+    # SQLite (which returns dates as strings) does not know the ClickHouse SETTINGS clause
+    monkeypatch.setattr(backends, "_with_log_comment", lambda sql_string, metrics: sql_string)
+    monkeypatch.setattr(backends, "STREAM_BATCH_SIZE", 100)
+    return execution_options
+
+
+def test_native_backend_streams_batches(native_backend):
+    metrics = QueryMetrics()
+    batches = list(
+        backends.NativeBackend().iter_batches(
+            "SELECT * FROM weekly", {"semaine": pl.String, "quantite_traitee": pl.Float64}, metrics
+        )
+    )
+
+    # Rows are fetched block by block, with a cursor streaming the result
+    assert [batch.num_rows for batch in batches] == [100, 100, 50]
+    assert native_backend[-1]["stream_results"]
+    assert native_backend[-1]["max_row_buffer"] == 100
+    assert pl.from_arrow(batches[0]).schema == {"semaine": pl.String, "quantite_traitee": pl.Float64}
+    # The conversion of the fetched rows is timed apart from the transfer
+    assert metrics.decode_time > 0
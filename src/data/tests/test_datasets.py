@@ -0,0 +1,216 @@
+import dataclasses
+import threading
+import time
+from datetime import date
+
+import polars as pl
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+from polars.testing import assert_frame_equal
+
+from data import datasets as datasets_module
+from data.datasets import (
+    DATASETS_QUERIES,
+    extract_datasets_to_parquet,
+    get_data_df,
+    get_dataset_sql,
+    load_dataset,
+    load_datasets,
+    remove_ipc_datasets,
+    split_datasets_by_year,
+    write_bs_facts,
+    write_ipc_datasets,
+    write_partitioned_datasets,
+)
+from data.manifests import BS_TYPES, DATASET_MANIFESTS, NAF_COLUMNS, OPERATION_TYPES, get_storage_schema
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_get_data_df_bounded_concurrency(monkeypatch, max_workers):
+    lock = threading.Lock()
+    running = {"current": 0, "max": 0}
+    queries_by_sql = {get_dataset_sql(dataset_name): dataset_name for dataset_name in DATASETS_QUERIES}
+
+    def fake_extract_dataset(sql_string, schema_overrides=None, label=None):
+        with lock:
+            running["current"] += 1
+            running["max"] = max(running["max"], running["current"])
+        time.sleep(0.01)
+        with lock:
+            running["current"] -= 1
+        dataset_name = queries_by_sql[sql_string]
+        return pl.DataFrame(
+            {"dataset": [dataset_name], **{column: [None] for column in DATASET_MANIFESTS[dataset_name]}}
+        )
+
+    monkeypatch.setattr(datasets_module, "extract_dataset", fake_extract_dataset)
+
+    data = get_data_df(max_workers=max_workers)
+
+    assert running["max"] <= max_workers
+    for dataset_name in DATASETS_QUERIES:
+        assert getattr(data, dataset_name)["dataset"].item() == dataset_name
+
+
+def test_get_dataset_sql():
+    assert "semaine >= '2020-01-01'" in get_dataset_sql("bsdd_weekly_data")
+    assert "semaine >= '2026-08-03'" in get_dataset_sql("accounts_weekly_data", date(2026, 8, 3))
+    assert "{" not in get_dataset_sql("accounts_by_naf_data", date(2026, 8, 3))
+
+
+def test_get_data_df_missing_column(monkeypatch):
+    monkeypatch.setattr(
+        datasets_module,
+        "extract_dataset",
+        lambda sql_string, schema_overrides=None, label=None: pl.DataFrame({"semaine": [None]}),
+    )
+
+    with pytest.raises(ValueError, match="is missing columns"):
+        get_data_df(max_workers=1)
+
+
+def test_extract_datasets_to_parquet_resume(monkeypatch, settings, tmp_path):
+    settings.DWH_QUERY_MAX_ATTEMPTS = 2
+    settings.DWH_QUERY_RETRY_DELAY = 0
+    attempts = []
+    failing = {"accounts_weekly_data"}
+
+    def fake_stream_query_to_parquet(sql_string, path, schema):
+        attempts.append(path.stem)
+        if path.stem in failing:
+            raise ConnectionError("Tunnel closed")
+        pl.DataFrame(schema=schema).write_parquet(path)
+        return 3
+
+    monkeypatch.setattr(datasets_module, "stream_query_to_parquet", fake_stream_query_to_parquet)
+
+    with pytest.raises(ConnectionError):
+        extract_datasets_to_parquet(tmp_path, max_workers=1)
+    assert attempts.count("accounts_weekly_data") == 2
+
+    failing.clear()
+    attempts.clear()
+    rows_counts = extract_datasets_to_parquet(tmp_path, max_workers=1)
+
+    # Resumed from the first missing dataset
+    dataset_names = list(DATASETS_QUERIES)
+    assert attempts == dataset_names[dataset_names.index("accounts_weekly_data") :]
+    assert rows_counts == {dataset_name: 3 for dataset_name in DATASETS_QUERIES}
+
+    # Another query (e.g. another incremental watermark) extracts the dataset again
+    attempts.clear()
+    extract_datasets_to_parquet(tmp_path, max_workers=1, date_starts={"bsdd_weekly_data": date(2026, 1, 5)})
+    assert attempts == ["bsdd_weekly_data"]
+
+
+def test_load_datasets(tmp_path):
+    for dataset_name in DATASETS_QUERIES:
+        pl.DataFrame(schema=get_storage_schema(dataset_name)).write_parquet(tmp_path / f"{dataset_name}.parquet")
+
+    datasets = load_datasets(tmp_path)
+
+    assert datasets.weekly_waste_processed_data.schema["type_operation"] == OPERATION_TYPES
+    # Without staged fact table, it is built from the BS weekly datasets
+    assert datasets.bs_facts.schema["bs_type"] == BS_TYPES
+    # Shared by the builds of every year: the datasets cannot be replaced
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        datasets.bsdd_weekly_data = pl.DataFrame()
+
+
+def test_load_dataset_years(tmp_path):
+    weeks = [date(2023, 12, 25), date(2024, 1, 1), date(2025, 1, 6)]
+    pl.DataFrame(
+        {"semaine": weeks, "comptes_etablissements": [1, 2, 3], "comptes_utilisateurs": [4, 5, 6]}
+    ).write_parquet(tmp_path / "accounts_weekly_data.parquet")
+    pl.DataFrame(
+        {"annee": [2024, 2025], "nombre_etablissements": [10, 20], **{column: ["A", "B"] for column in NAF_COLUMNS}}
+    ).write_parquet(tmp_path / "accounts_by_naf_data.parquet")
+    for dataset_name in DATASETS_QUERIES:
+        if not (tmp_path / f"{dataset_name}.parquet").exists():
+            pl.DataFrame(schema=get_storage_schema(dataset_name)).write_parquet(tmp_path / f"{dataset_name}.parquet")
+
+    # Without partitions, the staged files are filtered
+    flat_df = load_dataset("accounts_weekly_data", tmp_path, years=[2024, 2025])
+    assert flat_df["semaine"].to_list() == weeks[1:]
+
+    write_bs_facts(tmp_path)
+    write_partitioned_datasets(tmp_path)
+
+    partitions_dir = tmp_path / "partitioned" / "accounts_weekly_data"
+    assert sorted(path.name for path in partitions_dir.iterdir()) == ["year=2023", "year=2024", "year=2025"]
+    assert not (tmp_path / "partitioned" / "bsdd_weekly_data").exists()
+    datasets = load_datasets(tmp_path, years=[2024, 2025])
+    assert_frame_equal(datasets.accounts_weekly_data, flat_df)
+    assert datasets.accounts_by_naf_data["nombre_etablissements"].to_list() == [10, 20]
+    assert load_dataset("accounts_by_naf_data", tmp_path, years=[2025])["annee"].to_list() == [2025]
+    assert datasets.bsdd_weekly_data.is_empty()
+    assert datasets.bs_facts.is_empty()
+
+
+@pytest.fixture
+def staged_accounts(tmp_path):
+    pl.DataFrame(
+        {
+            "semaine": [date(2024, 1, 1), date(2025, 1, 6)],
+            "comptes_etablissements": [1, 2],
+            "comptes_utilisateurs": [3, 4],
+        }
+    ).write_parquet(tmp_path / "accounts_weekly_data.parquet")
+    return tmp_path
+
+
+def test_load_dataset_ipc(staged_accounts):
+    parquet_df = load_dataset("accounts_weekly_data", staged_accounts, staging_format="ipc")
+
+    write_ipc_datasets(staged_accounts)
+
+    assert (staged_accounts / "accounts_weekly_data.arrow").exists()
+    assert_frame_equal(load_dataset("accounts_weekly_data", staged_accounts, staging_format="ipc"), parquet_df)
+    assert load_dataset("accounts_weekly_data", staged_accounts, [2025], "ipc")["comptes_utilisateurs"].to_list() == [
+        4
+    ]
+
+    # Label columns are dictionary-encoded in the IPC copies
+    pl.DataFrame(
+        {"annee": [2025], "nombre_etablissements": [1], **{column: ["A"] for column in NAF_COLUMNS}}
+    ).write_parquet(staged_accounts / "accounts_by_naf_data.parquet")
+    write_ipc_datasets(staged_accounts)
+    assert pl.read_ipc_schema(staged_accounts / "accounts_by_naf_data.arrow")["libelle_section"] == pl.Categorical
+
+    # Parquet files of other datasets are not copied
+    pl.DataFrame({"semaine": [date(2024, 1, 1)]}).write_parquet(staged_accounts / "export.parquet")
+    write_ipc_datasets(staged_accounts)
+    assert not (staged_accounts / "export.arrow").exists()
+
+    remove_ipc_datasets(staged_accounts)
+    assert not (staged_accounts / "accounts_weekly_data.arrow").exists()
+
+
+def test_unknown_staging_format(staged_accounts):
+    with pytest.raises(ImproperlyConfigured, match="Unknown STATS_STAGING_FORMAT"):
+        load_dataset("accounts_weekly_data", staged_accounts, staging_format="csv")
+
+
+def test_split_datasets_by_year(staged_accounts):
+    pl.DataFrame(
+        {
+            "annee": [2024, 2025, 2025],
+            "nombre_etablissements": [1, 2, 3],
+            **{column: ["A"] * 3 for column in NAF_COLUMNS},
+        }
+    ).write_parquet(staged_accounts / "accounts_by_naf_data.parquet")
+    for dataset_name in DATASETS_QUERIES:
+        if not (staged_accounts / f"{dataset_name}.parquet").exists():
+            pl.DataFrame(schema=get_storage_schema(dataset_name)).write_parquet(
+                staged_accounts / f"{dataset_name}.parquet"
+            )
+    datasets = load_datasets(staged_accounts)
+
+    yearly_datasets = split_datasets_by_year(datasets, [2023, 2025])
+
+    assert list(yearly_datasets) == [2023, 2025]
+    assert yearly_datasets[2023].accounts_weekly_data.is_empty()
+    assert yearly_datasets[2025].accounts_weekly_data["comptes_utilisateurs"].to_list() == [4]
+    assert yearly_datasets[2025].accounts_weekly_data.columns == datasets.accounts_weekly_data.columns
+    assert yearly_datasets[2025].accounts_by_naf_data["nombre_etablissements"].to_list() == [2, 3]
+    assert yearly_datasets[2025].bs_facts.schema == datasets.bs_facts.schema
@@ -0,0 +1,60 @@
+import polars as pl
+
+from data.figures_factory import create_treemap_companies_figure
+from data.manifests import NAF_CATEGORIES, apply_dataset_schema
+
+
+def test_treemap_companies_figure_categorical_naf():
+    naf_df = pl.DataFrame(
+        {
+            "annee": [2025, 2025, 2025, 2024],
+            "nombre_etablissements": [10, 5, 3, 100],
+            **{f"code_{category}": ["01.11Z", "01.11Z", None, "01.11Z"] for category in NAF_CATEGORIES},
+            **{
+                f"libelle_{category}": ["Agriculture, sylviculture et pêche"] * 2 + [None] + ["Agriculture"]
+                for category in NAF_CATEGORIES
+            },
+        }
+    )
+    categorical_df = apply_dataset_schema("accounts_by_naf_data", naf_df)
+    assert categorical_df.schema["libelle_section"] == pl.Categorical
+
+    figure = create_treemap_companies_figure(categorical_df, 2025)
+
+    # Same figure as with string columns
+    assert figure.to_dict() == create_treemap_companies_figure(naf_df, 2025).to_dict()
+    treemap = figure.data[0]
+    assert list(treemap.values) == [18, *[15, 3] * len(NAF_CATEGORIES)]
+    assert treemap.ids[1:3] == (
+        "Tous les établissements#Agriculture, sylviculture et pêche",
+        "Tous les établissements#NAF inconnu",
+    )
+    assert treemap.marker.colors[1:3] == ("rgba(77, 52, 42, 1)", "rgba(183, 21, 64, 1)")
+
+
+def test_treemap_companies_figure_partially_unknown_labels():
+    naf_df = pl.DataFrame(
+        {
+            "annee": [2025] * 4,
+            "nombre_etablissements": [10, 5, 3, 1],
+            **{f"code_{category}": ["01.11Z", "01.11Z", "49.10Z", "49.10Z"] for category in NAF_CATEGORIES},
+            **{
+                f"libelle_{category}": ["Agriculture, sylviculture et pêche", None, None, "Transports et entreposage"]
+                for category in NAF_CATEGORIES
+            },
+        }
+    )
+    categorical_df = apply_dataset_schema("accounts_by_naf_data", naf_df)
+
+    treemap = create_treemap_companies_figure(categorical_df, 2025).data[0]
+    reversed_treemap = create_treemap_companies_figure(categorical_df.reverse(), 2025).data[0]
+
+    # Same nodes whatever the order of the rows (only the order of the nodes follows the rows)
+    assert sorted(zip(treemap.ids, treemap.parents, treemap.values)) == sorted(
+        zip(reversed_treemap.ids, reversed_treemap.parents, reversed_treemap.values)
+    )
+    # As before the categorical encoding, labels filled with "NAF inconnu" are compared as strings
+    assert treemap.ids[1:3] == (
+        "Tous les établissements#NAF inconnu",
+        "Tous les établissements#Transports et entreposage",
+    )
@@ -0,0 +1,66 @@
+from datetime import date
+
+import polars as pl
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from data import manifests
+from data.manifests import OPERATION_TYPES, apply_dataset_schema, check_manifests, get_projection, get_storage_schema
+
+
+def test_check_manifests():
+    check_manifests()
+
+
+def test_check_manifests_missing_column(monkeypatch):
+    bsda_manifest = {**manifests.BS_WEEKLY_MANIFEST}
+    del bsda_manifest["quantite_recue"]
+    monkeypatch.setitem(manifests.DATASET_MANIFESTS, "bsda_weekly_data", bsda_manifest)
+
+    with pytest.raises(ImproperlyConfigured, match="bsda_weekly_data: missing columns \\['quantite_recue'\\]"):
+        check_manifests()
+
+
+def test_get_projection():
+    assert get_projection("accounts_weekly_data") == (
+        "toDate32(semaine) as semaine,\n"
+        "    toInt64(comptes_etablissements) as comptes_etablissements,\n"
+        "    toInt64(comptes_utilisateurs) as comptes_utilisateurs"
+    )
+
+
+def test_get_projection_categorical():
+    assert "toString(type_operation) as type_operation" in get_projection("weekly_waste_processed_data")
+    assert get_storage_schema("weekly_waste_processed_data")["type_operation"] == pl.String
+
+
+def test_apply_dataset_schema():
+    data_df = pl.DataFrame(
+        {
+            "semaine": [date(2026, 1, 5), date(2026, 1, 5)],
+            "code_operation": ["R1", "D10"],
+            "type_operation": ["Déchet valorisé", "Déchet éliminé"],
+            "quantite_traitee": [1, 2],
+        }
+    )
+
+    data_df = apply_dataset_schema("weekly_waste_processed_data", data_df)
+
+    assert data_df.schema["semaine"] == pl.Date
+    assert data_df.schema["code_operation"] == pl.Categorical
+    assert data_df.schema["type_operation"] == OPERATION_TYPES
+    assert data_df.schema["quantite_traitee"] == pl.Float64
+
+
+def test_apply_dataset_schema_unknown_category():
+    data_df = pl.DataFrame(
+        {
+            "semaine": [date(2026, 1, 5)],
+            "code_operation": ["R1"],
+            "type_operation": ["Autre"],
+            "quantite_traitee": [1.0],
+        }
+    )
+
+    with pytest.raises(ValueError, match="weekly_waste_processed_data does not match its schema"):
+        apply_dataset_schema("weekly_waste_processed_data", data_df)
@@ -0,0 +1,43 @@
+import os
+import time
+
+import polars as pl
+
+from data.query_cache import QueryCache, make_cache_key
+
+
+def test_make_cache_key():
+    key = make_cache_key("SELECT *\n    FROM codes_dechets;")
+
+    assert key == make_cache_key("SELECT * FROM codes_dechets")
+    assert key != make_cache_key("SELECT * FROM codes_dechets", {"code": pl.String})
+    assert key != make_cache_key("SELECT * FROM codes_operations_traitements")
+
+
+def test_query_cache_ttl(tmp_path):
+    cache = QueryCache(tmp_path, max_size=10_000_000)
+    data_df = pl.DataFrame({"code": ["R1", "D10"]})
+
+    assert cache.get("key", ttl=60) is None
+
+    cache.set("key", data_df)
+    assert cache.get("key", ttl=60).equals(data_df)
+
+    written_at = time.time() - 120
+    os.utime(tmp_path / "key.parquet", (written_at, written_at))
+    assert cache.get("key", ttl=60) is None
+
+
+def test_query_cache_lru_eviction(tmp_path):
+    data_df = pl.DataFrame({"value": range(1000)})
+    cache = QueryCache(tmp_path, max_size=10_000_000)
+    for index, key in enumerate(["first", "second", "third"]):
+        cache.set(key, data_df)
+        used_at = time.time() - 100 + index
+        os.utime(tmp_path / f"{key}.parquet", (used_at, used_at))
+    cache.get("first", ttl=3600)
+
+    cache.max_size = 2 * (tmp_path / "first.parquet").stat().st_size
+    cache.evict()
+
+    assert sorted(path.stem for path in tmp_path.glob("*.parquet")) == ["first", "third"]
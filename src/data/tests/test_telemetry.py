@@ -0,0 +1,80 @@
+import polars as pl
+import pytest
+
+from data.telemetry import (
+    QueryMetrics,
+    add_server_profiles,
+    collect_query_metrics,
+    format_summary,
+    get_query_label,
+    measure_query,
+)
+
+
+def test_get_query_label():
+    assert get_query_label("SELECT * FROM db.a JOIN db.b USING (id) WHERE x IN (SELECT x FROM db.a)") == "db.a, db.b"
+    assert get_query_label("SELECT\n    1") == "SELECT 1"
+
+
+def test_collect_query_metrics():
+    with collect_query_metrics() as query_metrics:
+        with measure_query("bsdd_weekly_data", "native") as metrics:
+            metrics.add_batch(10, 3, 1000)
+            metrics.add_batch(5, 3, 500)
+        with pytest.raises(RuntimeError), measure_query("bsda_weekly_data", "native"):
+            raise RuntimeError("connection lost")
+
+    # Queries run outside of the context are not collected
+    with measure_query("other", "native"):
+        pass
+
+    assert [metrics.label for metrics in query_metrics] == ["bsdd_weekly_data", "bsda_weekly_data"]
+    assert (query_metrics[0].rows, query_metrics[0].columns, query_metrics[0].size) == (15, 3, 1500)
+    assert query_metrics[1].error == "RuntimeError: connection lost"
+
+
+def test_add_server_profiles():
+    metrics_list = [QueryMetrics(label="bsdd_weekly_data"), QueryMetrics(label="bsda_weekly_data")]
+    queries = []
+
+    def fake_read(sql_string):
+        queries.append(sql_string)
+        return pl.DataFrame(
+            {
+                "log_comment": [metrics_list[0].query_id],
+                "query_duration_ms": [1500],
+                "read_rows": [1000],
+                "read_bytes": [2 * 1024**2],
+                "result_rows": [10],
+                "result_bytes": [1024],
+                "memory_usage": [3 * 1024**2],
+            }
+        )
+
+    add_server_profiles(metrics_list, fake_read)
+
+    assert metrics_list[0].query_id in queries[0]
+    assert metrics_list[0].server["read_bytes"] == 2 * 1024**2
+    # The query log may not have been flushed yet
+    assert metrics_list[1].server is None
+
+    summary = format_summary(metrics_list).splitlines()
+    assert summary[0].split() == [
+        "query", "conn", "s", "1st", "batch", "s", "decode", "s", "write", "s", "total", "s", "rows", "cols", "MB",
+        "server", "s", "read", "MB", "peak", "MB",
+    ]  # fmt: skip
+    assert summary[1].split()[-3:] == ["1.50", "2.0", "3.0"]
+    assert summary[2].split()[-3:] == ["-", "-", "-"]
+    assert summary[3].startswith("total (2 queries)")
+
+
+def test_add_server_profiles_unavailable(caplog):
+    metrics = QueryMetrics(label="bsdd_weekly_data")
+
+    def failing_read(sql_string):
+        raise RuntimeError("Not enough privileges")
+
+    add_server_profiles([metrics], failing_read)
+
+    assert metrics.server is None
+    assert "Not enough privileges" in caplog.text
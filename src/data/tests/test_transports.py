@@ -0,0 +1,117 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+
+from data.transports import get_http_url, open_transport
+
+# Stands for the OpenSSH client: listens on the local end of each `-L` forward, or fails if FAKE_SSH_ERROR is set.
+# FAKE_SSH_WARNINGS bytes of warnings are written to stderr first.
+FAKE_SSH = f"""#!{sys.executable}
+import json, os, socket, sys, time
+
+arguments = sys.argv[1:]
+sys.stderr.write("w" * int(os.environ.get("FAKE_SSH_WARNINGS", 0)))
+sys.stderr.flush()
+if os.environ.get("FAKE_SSH_ERROR"):
+    sys.stderr.write(os.environ["FAKE_SSH_ERROR"])
+    sys.exit(255)
+
+listeners = []
+for index, argument in enumerate(arguments):
+    if argument == "-L":
+        host, port = arguments[index + 1].split(":")[:2]
+        listener = socket.socket()
+        listener.bind((host, int(port)))
+        listener.listen()
+        listeners.append(listener)
+with open(os.environ["FAKE_SSH_LOG"], "w") as f:
+    json.dump(arguments, f)
+time.sleep(60)
+"""
+
+
+@pytest.fixture
+def fake_ssh(monkeypatch, tmp_path):
+    ssh_path = tmp_path / "ssh"
+    ssh_path.write_text(FAKE_SSH)
+    ssh_path.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=":")
+    monkeypatch.setenv("FAKE_SSH_LOG", str(tmp_path / "arguments.json"))
+    return tmp_path / "arguments.json"
+
+
+def test_openssh_transport(settings, fake_ssh):
+    settings.DWH_TRANSPORT = "openssh"
+
+    with open_transport(settings, remote_ports=["9000", "8123"]) as tunnel:
+        assert tunnel.is_active
+        local_ports = tunnel.local_bind_ports
+        arguments = json.loads(fake_ssh.read_text())
+        assert get_http_url(tunnel, 1) == f"http://127.0.0.1:{local_ports[1]}/"
+
+    assert not tunnel.is_active
+    assert arguments[-1] == "u@h"
+    assert f"127.0.0.1:{local_ports[0]}:localhost:9000" in arguments
+    assert f"127.0.0.1:{local_ports[1]}:localhost:8123" in arguments
+    assert "BatchMode=yes" in arguments
+
+
+def test_openssh_transport_failure(settings, fake_ssh, monkeypatch):
+    monkeypatch.setenv("FAKE_SSH_ERROR", "Permission denied (publickey).")
+
+    with pytest.raises(RuntimeError, match="Permission denied"), open_transport(settings, transport="openssh"):
+        pass
+
+
+def test_openssh_transport_verbose_client(settings, fake_ssh, monkeypatch):
+    # More than a pipe buffer: the client would block on its stderr if it was not read
+    monkeypatch.setenv("FAKE_SSH_WARNINGS", str(1024**2))
+
+    with open_transport(settings, transport="openssh") as tunnel:
+        assert tunnel.is_active
+
+
+def test_openssh_transport_passphrase(settings, fake_ssh):
+    settings.DWH_SSH_KEY_PASSPHRASE = "secret"
+
+    with pytest.raises(ImproperlyConfigured, match="passphrase"), open_transport(settings, transport="openssh"):
+        pass
+
+
+def test_unknown_transport(settings):
+    settings.DWH_TRANSPORT = "telnet"
+
+    with pytest.raises(ImproperlyConfigured, match="Unknown DWH_TRANSPORT"):
+        open_transport(settings)
+
+
+def test_benchmark_transports(settings):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"0" * 1024**2)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings.DWH_HOST = "127.0.0.1"
+    settings.DWH_HTTP_PORT = str(server.server_port)
+    settings.DWH_SECURE = False
+
+    stdout = StringIO()
+    call_command("benchmark_transports", transports=["direct"], rows=10, repeat=2, stdout=stdout)
+    server.shutdown()
+
+    header, direct_line = stdout.getvalue().splitlines()
+    assert header.split() == ["transport", "conn", "s", "MB", "best", "s", "median", "s", "MB/s"]
+    assert direct_line.split()[:3] == ["direct", "0.00", "1.0"]
@@ -0,0 +1,85 @@
+"""
+Transports carrying the connections to the ClickHouse data warehouse.
+
+The transport is selected by `settings.DWH_TRANSPORT`:
+
+- `paramiko`: SSH tunnel opened by `sshtunnel` (default). Every byte is forwarded by a Python thread,
+  which caps the throughput on large results;
+- `openssh`: SSH tunnel opened by a system OpenSSH client subprocess, forwarding bytes outside of Python;
+- `direct`: no tunnel, connections go straight to `settings.DWH_HOST`, over TLS if `settings.DWH_SECURE`,
+  when the network allows it.
+
+Each transport is a context manager called with the settings and the remote ports to reach, yielding an object
+with `local_bind_hosts`, `local_bind_ports` and `is_active` attributes, like `sshtunnel.SSHTunnelForwarder`.
+The `manage.py benchmark_transports` command compares their throughput.
+"""
+
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+
+from data.ssh_utils import openssh_tunnel, ssh_tunnel
+
+
+class DirectConnection:
+    """Remote ports reached without tunnel."""
+
+    is_active = True
+
+    def __init__(self, host: str, ports: list[int], secure: bool):
+        self.local_bind_hosts = [host] * len(ports)
+        self.local_bind_ports = [int(port) for port in ports]
+        self.secure = secure
+
+
+@contextmanager
+def direct_connection(settings, remote_ports: list[int] | None = None):
+    """Yields a `DirectConnection` to the remote ports of `settings.DWH_HOST`."""
+    if remote_ports is None:
+        remote_ports = [settings.DWH_PORT]
+    yield DirectConnection(settings.DWH_HOST, remote_ports, settings.DWH_SECURE)
+
+
+TRANSPORTS = {
+    "paramiko": ssh_tunnel,
+    "openssh": openssh_tunnel,
+    "direct": direct_connection,
+}
+
+
+def open_transport(settings, remote_ports: list[int] | None = None, transport: str | None = None):
+    """
+    Returns the context manager of a transport to the given remote ports.
+
+    Parameters
+    ----------
+    settings : Settings
+        Configuration object holding the connection details.
+    remote_ports : list of int, optional
+        Remote ports to reach. Defaults to `settings.DWH_PORT` only.
+    transport : str, optional
+        Name of the transport. Defaults to `settings.DWH_TRANSPORT`.
+
+    Raises
+    ------
+    ImproperlyConfigured
+        If the transport is unknown.
+    """
+    transport = transport or settings.DWH_TRANSPORT
+    try:
+        return TRANSPORTS[transport](settings, remote_ports=remote_ports)
+    except KeyError as error:
+        raise ImproperlyConfigured(
+            f"Unknown DWH_TRANSPORT {transport!r}, expected one of {list(TRANSPORTS)}"
+        ) from error
+
+
+def is_secure(tunnel) -> bool:
+    """Returns True if the connections must use TLS (SSH tunnels forward plain connections)."""
+    return getattr(tunnel, "secure", False)
+
+
+def get_http_url(tunnel, index: int = 0) -> str:
+    """Returns the URL of the ClickHouse HTTP interface reached through the `index`-th port of a transport."""
+    scheme = "https" if is_secure(tunnel) else "http"
+    return f"{scheme}://{tunnel.local_bind_hosts[index]}:{tunnel.local_bind_ports[index]}/"
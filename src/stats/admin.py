@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Computation
+from .models import Computation, GlobalComputation
 
 
 @admin.register(Computation)
@@ -10,3 +10,13 @@ class ComputationAdmin(admin.ModelAdmin):
         "year",
         "created",
     ]
+
+
+@admin.register(GlobalComputation)
+class GlobalComputationAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "created",
+        "total_bs_created",
+        "total_companies_created",
+    ]
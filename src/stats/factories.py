@@ -1,6 +1,6 @@
 import factory
 
-from .models import Computation
+from .models import Computation, GlobalComputation
 
 
 class ComputationFactory(factory.django.DjangoModelFactory):
@@ -8,3 +8,8 @@ class ComputationFactory(factory.django.DjangoModelFactory):
         model = Computation
 
     year = 2023
+
+
+class GlobalComputationFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = GlobalComputation
@@ -0,0 +1,101 @@
+import multiprocessing
+import statistics
+import time
+from pathlib import Path
+
+import django
+import polars as pl
+from django.core.management.base import BaseCommand, CommandError
+
+from data.datasets import IPC_SUFFIX, STAGING_FORMATS, load_datasets, remove_ipc_datasets, write_ipc_datasets
+
+# Resident memory of the process, from /proc (Linux): private pages (anonymous) and pages of mapped files
+RSS_FIELDS = ["RssAnon", "RssFile"]
+
+
+def _get_rss() -> dict[str, int] | None:
+    """Returns the resident memory of the current process by kind (`RSS_FIELDS`), in bytes, if available."""
+    try:
+        with open("/proc/self/status") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    fields = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in lines if line.startswith("Rss")}
+    return {field: fields.get(field, 0) for field in RSS_FIELDS}
+
+
+def _read_datasets(directory: Path, staging_format: str, repeat: int, connection):
+    """
+    Loads every staged dataset `repeat` times in a fresh process, and sends back the durations and the memory
+    kept resident by the last load.
+
+    Each load is followed by a pass over every column, so that memory-mapped pages are actually read.
+    """
+    django.setup()
+    rss_before = _get_rss()
+    durations = []
+    for _ in range(repeat):
+        started_time = time.time()
+        datasets = load_datasets(directory, staging_format=staging_format)
+        for data_df in vars(datasets).values():
+            data_df.select(pl.all().max())
+        durations.append(time.time() - started_time)
+    rss_after = _get_rss()
+
+    rss = {field: rss_after[field] - rss_before[field] for field in RSS_FIELDS} if rss_before else None
+    connection.send((durations, rss))
+    connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the staging formats (STATS_STAGING_FORMAT) by loading the datasets staged in temp_data "
+        "with each of them, in a fresh process: read time and resident memory (private and file-backed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--formats",
+            nargs="+",
+            choices=STAGING_FORMATS,
+            default=STAGING_FORMATS,
+            help="Staging formats to compare.",
+        )
+        parser.add_argument("--directory", type=Path, default=Path("temp_data"), help="Staging directory.")
+        parser.add_argument("--repeat", type=int, default=3, help="Number of loads per format.")
+
+    def handle(self, verbosity=0, **options):
+        directory = options["directory"]
+        if not any(directory.glob("*.parquet")):
+            raise CommandError(f"No staged datasets in {directory}, run build_stats first")
+
+        # Copies written for the benchmark only are deleted afterwards
+        ipc_written = "ipc" in options["formats"] and not any(directory.glob(f"*{IPC_SUFFIX}"))
+        if ipc_written:
+            write_ipc_datasets(directory)
+
+        context = multiprocessing.get_context("spawn")
+        self.stdout.write(f"{'format':<8} {'best s':>8} {'median s':>8} {'anon MB':>8} {'file MB':>8}")
+        try:
+            for staging_format in options["formats"]:
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=_read_datasets, args=(directory, staging_format, options["repeat"], sender)
+                )
+                process.start()
+                sender.close()
+                try:
+                    durations, rss = receiver.recv()
+                except EOFError as error:
+                    raise CommandError(f"Loading the {staging_format} datasets failed, see the logs above") from error
+                finally:
+                    process.join()
+
+                anon, file = (f"{rss[field] / 1024**2:>8.1f}" for field in RSS_FIELDS) if rss else ("-", "-")
+                self.stdout.write(
+                    f"{staging_format:<8} {min(durations):>8.2f} {statistics.median(durations):>8.2f} "
+                    f"{anon:>8} {file:>8}"
+                )
+        finally:
+            if ipc_written:
+                remove_ipc_datasets(directory)
@@ -0,0 +1,81 @@
+import statistics
+import time
+import urllib.request
+from urllib.parse import urlencode
+
+import sshtunnel
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+
+from data.backends import ARROW_QUERY_TIMEOUT
+from data.transports import TRANSPORTS, get_http_url, open_transport
+
+# Same payload for every transport: the shape of the weekly datasets (dates, integers, strings), generated by ClickHouse
+BENCHMARK_SQL = """
+SELECT
+    toDate32('2020-01-06') + toIntervalWeek(number % 400) AS semaine,
+    number AS quantite,
+    toString(number % 1000) AS code_dechet
+FROM numbers({rows})
+"""
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _download(http_url: str, sql_string: str) -> int:
+    """Runs a query through the ClickHouse HTTP interface and returns the size of its ArrowStream response."""
+    request = urllib.request.Request(
+        f"{http_url}?{urlencode({'default_format': 'ArrowStream'})}",
+        data=sql_string.encode(),
+        headers={"X-ClickHouse-User": settings.DWH_USERNAME, "X-ClickHouse-Key": settings.DWH_PASSWORD},
+    )
+    size = 0
+    with urllib.request.urlopen(request, timeout=ARROW_QUERY_TIMEOUT) as response:  # nosec B310
+        while chunk := response.read(CHUNK_SIZE):
+            size += len(chunk)
+    return size
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the throughput of the warehouse transports (DWH_TRANSPORT) by downloading the same result "
+        "through the ClickHouse HTTP interface (DWH_HTTP_PORT) with each of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--transports",
+            nargs="+",
+            choices=list(TRANSPORTS),
+            default=list(TRANSPORTS),
+            help="Transports to compare.",
+        )
+        parser.add_argument("--rows", type=int, default=10_000_000, help="Number of rows of the downloaded result.")
+        parser.add_argument("--repeat", type=int, default=3, help="Number of downloads per transport.")
+
+    def handle(self, verbosity=0, **options):
+        sql_string = BENCHMARK_SQL.format(rows=options["rows"])
+
+        self.stdout.write(f"{'transport':<10} {'conn s':>8} {'MB':>8} {'best s':>8} {'median s':>8} {'MB/s':>8}")
+        for transport in options["transports"]:
+            durations = []
+            started_time = time.time()
+            try:
+                with open_transport(settings, remote_ports=[settings.DWH_HTTP_PORT], transport=transport) as tunnel:
+                    connect_time = time.time() - started_time
+                    http_url = get_http_url(tunnel)
+                    for _ in range(options["repeat"]):
+                        started_time = time.time()
+                        size = _download(http_url, sql_string)
+                        durations.append(time.time() - started_time)
+            except (ImproperlyConfigured, OSError, RuntimeError, sshtunnel.BaseSSHTunnelForwarderError) as error:
+                self.stderr.write(f"{transport:<10} failed ({type(error).__name__}: {error})")
+                continue
+
+            megabytes = size / 1024**2
+            best_duration = min(durations)
+            self.stdout.write(
+                f"{transport:<10} {connect_time:>8.2f} {megabytes:>8.1f} {best_duration:>8.2f} "
+                f"{statistics.median(durations):>8.2f} {megabytes / best_duration:>8.1f}"
+            )
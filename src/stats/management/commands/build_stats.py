@@ -1,15 +1,158 @@
+import datetime as dt
+from contextlib import ExitStack
+from dataclasses import replace
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from data.connection import warehouse_connection
+from data.datasets import STAGING_FORMATS, load_dataset, load_datasets
+from data.query_cache import bypass_query_cache
+
 from ...processors.clear import clear_figs
-from ...processors.create_df import build_dataframes
-from ...processors.stats_processor import build_stats_and_figs
+from ...processors.create_df import build_dataframes, build_yearly_totals, extract_dataframes
+from ...processors.stats_processor import build_global_computation, build_stats_and_figs_for_years
+
+YEARS = [2022, 2023, 2024, 2025, 2026]
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--extraction-concurrency",
+            type=int,
+            default=settings.DWH_EXTRACTION_CONCURRENCY,
+            help="Maximum number of warehouse queries run concurrently (1 to extract sequentially).",
+        )
+        parser.add_argument(
+            "--full-refresh",
+            action="store_true",
+            help="Extract every dataset from scratch instead of updating the staged snapshots.",
+        )
+        parser.add_argument(
+            "--reread-weeks",
+            type=int,
+            default=settings.STATS_INCREMENTAL_REREAD_WEEKS,
+            help="Number of already staged weeks extracted again in incremental mode.",
+        )
+        parser.add_argument(
+            "--since",
+            type=dt.date.fromisoformat,
+            help="In incremental mode, extract weekly data again from this date (YYYY-MM-DD) at least.",
+        )
+        parser.add_argument(
+            "--no-resume",
+            action="store_true",
+            help="Extract every dataset again instead of resuming an interrupted extraction.",
+        )
+        parser.add_argument(
+            "--batch-bs-extraction",
+            action="store_true",
+            default=settings.DWH_BATCH_BS_EXTRACTION,
+            help="Extract the six BS weekly tables in a single query instead of one query per table.",
+        )
+        parser.add_argument(
+            "--in-memory",
+            action="store_true",
+            help="Keep the extracted datasets in memory instead of staging them in temp_data (full extraction).",
+        )
+        parser.add_argument(
+            "--bypass-query-cache",
+            action="store_true",
+            help="Run cached queries (referentials) again and refresh their cached results.",
+        )
+        parser.add_argument(
+            "--aggregation-pushdown",
+            action="store_true",
+            default=settings.STATS_AGGREGATION_PUSHDOWN,
+            help="Compute the yearly and all-time totals on the warehouse instead of from the weekly rows.",
+        )
+        parser.add_argument(
+            "--partitioned-staging",
+            action="store_true",
+            default=settings.STATS_PARTITIONED_STAGING,
+            help=(
+                "Also stage the datasets partitioned by year, so that only the built years are read "
+                "(with --aggregation-pushdown)."
+            ),
+        )
+
+        parser.add_argument(
+            "--staging-format",
+            choices=STAGING_FORMATS,
+            default=settings.STATS_STAGING_FORMAT,
+            help="Format of the staged datasets read by the yearly builds (ipc: memory-mapped Arrow IPC copies).",
+        )
+
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=settings.STATS_BUILD_JOBS,
+            help="Number of processes computing the years in parallel (0: one per available CPU).",
+        )
+        parser.add_argument(
+            "--lazy-build",
+            action="store_true",
+            default=settings.STATS_LAZY_BUILD,
+            help="Plan the statistics and figures of the years as lazy queries, executed together.",
+        )
+        parser.add_argument(
+            "--force-rebuild",
+            action="store_true",
+            help="Compute every year again, even those whose inputs are unchanged since their last computation.",
+        )
+
     def handle(self, verbosity=0, **options):
-        build_dataframes()
+        concurrency = options["extraction_concurrency"]
+
+        with ExitStack() as stack:
+            if options["bypass_query_cache"]:
+                stack.enter_context(bypass_query_cache())
+            # A single SSH tunnel is shared by the extraction and the referential queries of the yearly builds
+            stack.enter_context(warehouse_connection(pool_size=max(concurrency, settings.DWH_POOL_SIZE)))
+
+            if options["in_memory"]:
+                datasets = extract_dataframes(max_workers=concurrency, batch_bs=options["batch_bs_extraction"])
+            else:
+                build_dataframes(
+                    max_workers=concurrency,
+                    full_refresh=options["full_refresh"],
+                    reread_weeks=options["reread_weeks"],
+                    since=options["since"],
+                    resume=not options["no_resume"],
+                    batch_bs=options["batch_bs_extraction"],
+                    partitioned=options["partitioned_staging"],
+                    staging_format=options["staging_format"],
+                )
+
+            pushdown = options["aggregation_pushdown"]
+
+            # The datasets are loaded once and shared by the builds of every year. Rows of other years are only read
+            # by the all-time totals, computed by the warehouse with pushdown, and by the scale of the weekly quantity
+            # figure, set by every week of weekly_waste_processed_data
+            if not options["in_memory"]:
+                datasets = load_datasets(years=YEARS if pushdown else None, staging_format=options["staging_format"])
+                if pushdown:
+                    datasets = replace(
+                        datasets,
+                        weekly_waste_processed_data=load_dataset(
+                            "weekly_waste_processed_data", staging_format=options["staging_format"]
+                        ),
+                    )
+
+            # Totals of every year, computed once: by the warehouse, or from the fact table in a single group-by
+            yearly_totals_df = build_yearly_totals() if pushdown else build_yearly_totals(datasets)
+
+            clear_figs()
 
-        clear_figs()
+            build_global_computation(yearly_totals_df)
 
-        for year in [2022, 2023, 2024, 2025, 2026]:
-            build_stats_and_figs(year, clear_year=True)
+            build_stats_and_figs_for_years(
+                YEARS,
+                clear_years=True,
+                yearly_totals_df=yearly_totals_df,
+                datasets=datasets,
+                jobs=options["jobs"],
+                force=options["force_rebuild"],
+                lazy=options["lazy_build"],
+            )
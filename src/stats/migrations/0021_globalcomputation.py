@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:14
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+TOTALS_FIELDS = [
+    'total_bs_created',
+    'total_quantity_processed',
+    'total_quantity_processed_non_dangerous',
+    'total_companies_created',
+]
+
+
+def copy_totals(apps, schema_editor):
+    # The totals shown until the next build are those of the last year, as before
+    Computation = apps.get_model('stats', 'Computation')
+    GlobalComputation = apps.get_model('stats', 'GlobalComputation')
+    last_computation = Computation.objects.order_by('year', 'created').last()
+    if last_computation:
+        GlobalComputation.objects.create(
+            created=last_computation.created,
+            **{field: getattr(last_computation, field) for field in TOTALS_FIELDS},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0020_computation_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlobalComputation',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created')),
+                ('total_bs_created', models.PositiveBigIntegerField(default=0)),
+                ('total_quantity_processed', models.PositiveBigIntegerField(default=0)),
+                ('total_quantity_processed_non_dangerous', models.PositiveBigIntegerField(default=0)),
+                ('total_companies_created', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Global computation',
+                'verbose_name_plural': 'Global computations',
+                'ordering': ('-created',),
+            },
+        ),
+        migrations.RunPython(copy_totals, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='computation',
+            name='total_bs_created',
+        ),
+        migrations.RemoveField(
+            model_name='computation',
+            name='total_companies_created',
+        ),
+        migrations.RemoveField(
+            model_name='computation',
+            name='total_quantity_processed',
+        ),
+        migrations.RemoveField(
+            model_name='computation',
+            name='total_quantity_processed_non_dangerous',
+        ),
+    ]
@@ -9,11 +9,8 @@ class Computation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     year = models.PositiveSmallIntegerField(default=2023)
     created = models.DateTimeField(_("Created"), default=timezone.now)
-
-    total_bs_created = models.PositiveBigIntegerField(default=0)
-    total_quantity_processed = models.PositiveBigIntegerField(default=0)
-    total_quantity_processed_non_dangerous = models.PositiveBigIntegerField(default=0)
-    total_companies_created = models.PositiveBigIntegerField(default=0)
+    # Fingerprint of the inputs of the computation, to skip the years whose inputs are unchanged
+    fingerprint = models.CharField(max_length=64, blank=True, default="")
 
     quantity_processed_total = models.JSONField(default=dict)
 
@@ -71,3 +68,22 @@ class Computation(models.Model):
         verbose_name_plural = _("Computations")
         ordering = ("-created",)
         app_label = "stats"
+
+
+class GlobalComputation(models.Model):
+    """All-time totals, which do not depend on the year: computed once per build, apart from the yearly
+    Computations."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created = models.DateTimeField(_("Created"), default=timezone.now)
+
+    total_bs_created = models.PositiveBigIntegerField(default=0)
+    total_quantity_processed = models.PositiveBigIntegerField(default=0)
+    total_quantity_processed_non_dangerous = models.PositiveBigIntegerField(default=0)
+    total_companies_created = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Global computation")
+        verbose_name_plural = _("Global computations")
+        ordering = ("-created",)
+        app_label = "stats"
@@ -1,30 +1,196 @@
+import logging
 import os
 import shutil
+from contextlib import contextmanager
+from datetime import UTC, date, datetime, timedelta
 
-from data.datasets import get_data_df
+import polars as pl
+from django.conf import settings
 
+from data.backends import get_backend
+from data.checkpoint import ExtractionCheckpoint
+from data.data_processing import compute_yearly_totals
+from data.datasets import (
+    DATASETS_QUERIES,
+    PARTITIONED_DIRNAME,
+    WEEKLY_DATASETS,
+    Computed,
+    extract_datasets_to_parquet,
+    get_data_df,
+    get_staging_format,
+    get_yearly_totals,
+    remove_ipc_datasets,
+    write_bs_facts,
+    write_ipc_datasets,
+    write_partitioned_datasets,
+)
+from data.manifests import check_manifests
+from data.telemetry import add_server_profiles, collect_query_metrics, format_summary
+from data.utils import get_data_date_interval_for_year
+
+logger = logging.getLogger(__name__)
+
+
+def get_watermark(snapshot_path: str, reread_weeks: int) -> date | None:
+    """Returns the first week to extract again for an existing snapshot,
+    i.e. its last week minus the re-read window.
+    Returns None if there is no usable snapshot.
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+
+    last_week = pl.scan_parquet(snapshot_path).select(pl.col("semaine").max()).collect().item()
+    if last_week is None:
+        return None
+    if isinstance(last_week, datetime):
+        last_week = last_week.date()
+
+    return last_week - timedelta(weeks=reread_weeks)
+
+
+@contextmanager
+def summarize_query_metrics():
+    """Logs the metrics of the queries run in the context, with their server-side profile when available."""
+    with collect_query_metrics() as query_metrics:
+        try:
+            yield
+        finally:
+            if settings.DWH_BACKEND != "local":
+                add_server_profiles(query_metrics, get_backend().read)
+            logger.info("Extraction queries:\n%s", format_summary(query_metrics))
+
+
+def build_dataframes(
+    max_workers: int | None = None,
+    full_refresh: bool = True,
+    reread_weeks: int | None = None,
+    since: date | None = None,
+    resume: bool = True,
+    batch_bs: bool | None = None,
+    partitioned: bool | None = None,
+    staging_format: str | None = None,
+):
+    """Extracts the datasets and stores them as parquet files in the staging directory.
+
+    In incremental mode (`full_refresh=False`), weekly datasets keep their previous snapshot:
+    only weeks from the watermark onwards are extracted and they replace the snapshot rows of the same weeks.
+    The watermark is the last week of the snapshot minus `reread_weeks` (to catch late corrections),
+    or `since` when it is earlier. Non weekly datasets, and weekly ones without snapshot, are fully extracted.
+
+    Query results are streamed to the parquet files without being loaded in memory.
+    In incremental mode, they are first streamed to an `increment` sub-directory, then merged lazily with the snapshots.
+
+    Extracted datasets are checkpointed: if a previous run of the same mode (full or incremental) was interrupted,
+    datasets it already extracted with the same query are kept, unless `resume` is False. A full refresh always
+    deletes the increments and checkpoints of an interrupted incremental run, and an incremental run those
+    of an interrupted full refresh (the datasets it completed are then used as snapshots).
+    The checkpoints are deleted once every dataset is in the staging directory.
+
+    With `batch_bs`, the six BS weekly datasets are extracted in a single query (see `get_bs_weekly_sql`).
+    Once staged, they are also stacked in their fact table (see `write_bs_facts`).
+
+    With `partitioned` (defaults to `settings.STATS_PARTITIONED_STAGING`), a copy of the datasets is also written
+    in the year-partitioned layout (see `write_partitioned_datasets`), so that `load_dataset` reads only
+    the partitions of the requested years. Otherwise, previous partitions are deleted.
+
+    With the "ipc" `staging_format` (defaults to `settings.STATS_STAGING_FORMAT`), an Arrow IPC copy of the datasets
+    is also written, memory-mapped by `load_dataset` (see `write_ipc_datasets`). Otherwise, previous copies are deleted.
+
+    The metrics of the extraction queries are summarized in the logs at the end of the extraction,
+    with their server-side profile when the warehouse query log is readable.
+    """
+    reread_weeks = settings.STATS_INCREMENTAL_REREAD_WEEKS if reread_weeks is None else reread_weeks
+    staging_format = get_staging_format(staging_format)
+
+    # Fail before extracting anything if a column read by the stats is not projected
+    check_manifests()
 
-def build_dataframes():
     # store dataframes as parquet in temp files
     root = r"temp_data"  # unversionned dir
-    try:
-        shutil.rmtree(root)
-    except FileNotFoundError:
-        pass
-    os.mkdir(root)
-
-    bsd_data = get_data_df()
-
-    for dataset_name in [
-        "bsdd_weekly_data",
-        "bsda_weekly_data",
-        "bsff_weekly_data",
-        "bsdasri_weekly_data",
-        "bsvhu_weekly_data",
-        "bsd_non_dangerous_weekly_data",
-        "accounts_weekly_data",
-        "weekly_waste_processed_data",
-        "accounts_by_naf_data",
-        "waste_produced_by_naf_annual_stats",
-    ]:
-        getattr(bsd_data, dataset_name).write_parquet(f"temp_data/{dataset_name}.parquet")
+    increment_dir = os.path.join(root, "increment")
+    mode = "full" if full_refresh else "incremental"
+    if full_refresh:
+        # A full refresh extracts directly in the staging directory
+        shutil.rmtree(increment_dir, ignore_errors=True)
+
+    if resume and any(ExtractionCheckpoint(directory).mode == mode for directory in (root, increment_dir)):
+        logger.info("Resuming the interrupted %s extraction", mode)
+    elif full_refresh:
+        shutil.rmtree(root, ignore_errors=True)
+    else:
+        shutil.rmtree(increment_dir, ignore_errors=True)
+        ExtractionCheckpoint(root).clear()
+    os.makedirs(root, exist_ok=True)
+
+    watermarks = {}
+    if not full_refresh:
+        for dataset_name in WEEKLY_DATASETS:
+            watermark = get_watermark(f"{root}/{dataset_name}.parquet", reread_weeks)
+            if watermark is not None:
+                watermarks[dataset_name] = min(watermark, since) if since else watermark
+        logger.info("Incremental extraction from %s", watermarks)
+
+    # Snapshots are still read during the merge: increments are streamed aside
+    extraction_dir = increment_dir if watermarks else root
+    os.makedirs(extraction_dir, exist_ok=True)
+    with summarize_query_metrics():
+        extract_datasets_to_parquet(
+            extraction_dir, max_workers=max_workers, date_starts=watermarks, batch_bs=batch_bs, mode=mode
+        )
+
+    if watermarks:
+        for dataset_name in DATASETS_QUERIES:
+            increment_path = f"{extraction_dir}/{dataset_name}.parquet"
+            snapshot_path = f"{root}/{dataset_name}.parquet"
+
+            if dataset_name in watermarks:
+                merged_path = f"{extraction_dir}/{dataset_name}.merged.parquet"
+                pl.concat(
+                    [
+                        pl.scan_parquet(snapshot_path).filter(pl.col("semaine") < watermarks[dataset_name]),
+                        pl.scan_parquet(increment_path),
+                    ],
+                    how="diagonal_relaxed",
+                ).sink_parquet(merged_path)
+                increment_path = merged_path
+
+            # A merged snapshot changes the watermark: an interrupted merge extracts this dataset again
+            os.replace(increment_path, snapshot_path)
+
+        shutil.rmtree(extraction_dir)
+
+    ExtractionCheckpoint(root).clear()
+    write_bs_facts(root)
+
+    partitioned = settings.STATS_PARTITIONED_STAGING if partitioned is None else partitioned
+    if partitioned:
+        write_partitioned_datasets(root)
+    else:
+        shutil.rmtree(os.path.join(root, PARTITIONED_DIRNAME), ignore_errors=True)
+
+    if staging_format == "ipc":
+        write_ipc_datasets(root)
+    else:
+        remove_ipc_datasets(root)
+
+
+def extract_dataframes(max_workers: int | None = None, batch_bs: bool | None = None) -> Computed:
+    """Extracts every dataset in memory, to be handed to the builds of the same process without staging files.
+
+    Unlike `build_dataframes`, the datasets are always fully extracted and temp_data is left untouched.
+    """
+    check_manifests()
+    with summarize_query_metrics():
+        return get_data_df(max_workers=max_workers, batch_bs=batch_bs)
+
+
+def build_yearly_totals(datasets: Computed | None = None) -> pl.DataFrame:
+    """Computes the yearly and all-time sums of the weekly datasets, used for the headline numbers.
+
+    Without `datasets`, the sums are computed on the warehouse (aggregation pushdown). Otherwise, they are computed
+    from the fact table of the given datasets, in a single group-by (see `compute_yearly_totals`).
+    """
+    _, current_year_date_end = get_data_date_interval_for_year(datetime.now(UTC).year)
+    if datasets is not None:
+        return compute_yearly_totals(datasets.bs_facts, datasets.accounts_weekly_data, current_year_date_end)
+    return get_yearly_totals(current_year_date_end.date())
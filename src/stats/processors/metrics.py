@@ -0,0 +1,352 @@
+"""
+Registry of the statistics and figures of a year, and the engine evaluating it.
+
+Each Computation field is declared by a spec: a headline total (`TotalSpec`), a scalar statistic (`MetricSpec`) or a
+figure (`FigureSpec`). Adding a statistic or a figure is adding a spec to `TOTALS`, `METRICS` or `FIGURES`. The
+all-time totals of the GlobalComputation are declared in `GLOBAL_TOTALS`.
+
+The engine plans the specs of a year as lazy queries (`YearPlan`) and controls how the data is read: every total is
+summed in a single select over the yearly totals, the statistics of a dataset in a single select over its rows, and the
+rows of each dataset within the date interval of the year are planned once and shared by every spec reading them.
+The plans of every year can be executed together (`execute_plans`).
+"""
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime
+
+import plotly.graph_objects as go
+import polars as pl
+
+from data.data_processing import get_weekly_preprocessed_lf
+from data.datasets import BS_WEEKLY_TABLES, Computed
+from data.figures_factory import (
+    create_quantity_processed_sunburst_figure,
+    create_treemap_companies_figure,
+    create_weekly_created_figure,
+    create_weekly_quantity_processed_figure,
+    create_weekly_scatter_figure,
+)
+from data.utils import get_data_date_interval_for_year
+
+# Windows of the specs. Totals: complete weeks of the year, or every week. Statistics and figures: rows within the date
+# interval of the year (sorted by week), or every row of the dataset (the figure filters them itself)
+YEAR_WINDOW = "year"
+ALL_WINDOW = "all"
+
+
+@dataclass(frozen=True)
+class YearInputs:
+    """Inputs of the computation of a year, other than the datasets (see `compute_stats_and_figs`)."""
+
+    # None for the all-time totals only (see `evaluate_totals`)
+    year: int | None
+    date_interval: tuple[datetime, datetime] | None
+    waste_codes_data: pl.DataFrame
+    quantity_processed_series: list[pl.DataFrame]
+
+
+@dataclass(frozen=True)
+class TotalSpec:
+    """Headline number: sum of a column of the yearly totals (see `build_yearly_totals`) over some datasets."""
+
+    field: str
+    # Dataset names as keys, column to sum for this dataset as values
+    datasets_columns: dict[str, str]
+    window: str
+    cast: Callable | None = None
+
+
+@dataclass(frozen=True)
+class MetricSpec:
+    """Scalar statistic: an aggregation of the rows of a dataset, rounded to `digits` (None without rows)."""
+
+    field: str
+    dataset: str
+    expr: pl.Expr
+    window: str = YEAR_WINDOW
+    digits: int = 2
+
+
+@dataclass(frozen=True)
+class FigureSpec:
+    """Figure built from the rows of a dataset (None: from the other inputs only), stored as JSON."""
+
+    field: str
+    dataset: str | None
+    build: Callable[[pl.DataFrame | None, YearInputs], go.Figure]
+    window: str = YEAR_WINDOW
+
+
+def _bs_prefix(dataset_name: str) -> str:
+    return dataset_name.removesuffix("_weekly_data")
+
+
+_CREATIONS_COLUMNS = {dataset_name: "creations" for dataset_name in BS_WEEKLY_TABLES}
+_QUANTITY_COLUMNS = {
+    dataset_name: "quantite_traitee_operations_finales"
+    for dataset_name in BS_WEEKLY_TABLES
+    if dataset_name != "bsd_non_dangerous_weekly_data"
+}
+_NON_DANGEROUS_QUANTITY_COLUMNS = {"bsd_non_dangerous_weekly_data": "quantite_traitee_operations_finales"}
+
+# Fields of the GlobalComputation, computed once per build
+GLOBAL_TOTALS = [
+    TotalSpec("total_bs_created", _CREATIONS_COLUMNS, ALL_WINDOW),
+    TotalSpec("total_quantity_processed", _QUANTITY_COLUMNS, ALL_WINDOW, cast=int),
+    TotalSpec("total_quantity_processed_non_dangerous", _NON_DANGEROUS_QUANTITY_COLUMNS, ALL_WINDOW),
+    TotalSpec("total_companies_created", {"accounts_weekly_data": "comptes_etablissements"}, ALL_WINDOW),
+]
+
+TOTALS = [
+    TotalSpec("quantity_processed_yearly", _QUANTITY_COLUMNS, YEAR_WINDOW, cast=int),
+    TotalSpec("quantity_processed_non_dangerous_yearly", _NON_DANGEROUS_QUANTITY_COLUMNS, YEAR_WINDOW),
+    TotalSpec("bs_created_yearly", _CREATIONS_COLUMNS, YEAR_WINDOW),
+    TotalSpec("company_created_total_life", {"accounts_weekly_data": "comptes_etablissements"}, YEAR_WINDOW),
+    TotalSpec("user_created_total_life", {"accounts_weekly_data": "comptes_utilisateurs"}, YEAR_WINDOW),
+    *(
+        TotalSpec(f"{_bs_prefix(dataset_name)}_bordereaux_created", {dataset_name: "creations"}, YEAR_WINDOW)
+        for dataset_name in BS_WEEKLY_TABLES
+    ),
+    *(
+        TotalSpec(
+            f"{_bs_prefix(dataset_name)}_quantity_processed",
+            {dataset_name: "quantite_traitee_operations_finales"},
+            YEAR_WINDOW,
+        )
+        for dataset_name in BS_WEEKLY_TABLES
+    ),
+]
+
+METRICS = [
+    MetricSpec(
+        "mean_quantity_by_bsff_packagings",
+        "bsff_weekly_data",
+        # Tonnes by packaging, converted into kilograms
+        pl.col("quantite_traitee_operations_finales").sum()
+        / pl.col("traitements_contenants_operations_finales").sum()
+        * 1000,
+    ),
+    MetricSpec(
+        "mean_packagings_by_bsff",
+        "bsff_weekly_data",
+        (pl.col("traitements_contenants") / pl.col("traitements_bordereaux")).mean(),
+    ),
+]
+
+# Labels of the BS types in the weekly figures
+_BS_TYPES_LABELS = {
+    "bsdd_weekly_data": "BSDD",
+    "bsda_weekly_data": "BSDA",
+    "bsff_weekly_data": "BSFF",
+    "bsdasri_weekly_data": "BSDASRI",
+    "bsvhu_weekly_data": "BSVHU",
+    "bsd_non_dangerous_weekly_data": "BS de déchets non dangereux",
+}
+
+
+def _weekly_scatter(metric_type: str, bs_type: str) -> Callable[[pl.DataFrame, YearInputs], go.Figure]:
+    return lambda data_df, _: create_weekly_scatter_figure(data_df, metric_type=metric_type, bs_type=bs_type)
+
+
+FIGURES = [
+    *(
+        FigureSpec(f"{_bs_prefix(dataset_name)}_counts_weekly", dataset_name, _weekly_scatter("counts", label))
+        for dataset_name, label in _BS_TYPES_LABELS.items()
+    ),
+    FigureSpec("bsff_packagings_counts_weekly", "bsff_weekly_data", _weekly_scatter("counts", "BSFF PACKAGINGS")),
+    *(
+        FigureSpec(f"{_bs_prefix(dataset_name)}_quantities_weekly", dataset_name, _weekly_scatter("quantity", label))
+        for dataset_name, label in _BS_TYPES_LABELS.items()
+    ),
+    FigureSpec(
+        "quantity_processed_weekly",
+        None,
+        # The scale of the figure depends on the weeks of every year
+        lambda _, inputs: create_weekly_quantity_processed_figure(
+            *inputs.quantity_processed_series, inputs.date_interval
+        ),
+    ),
+    FigureSpec(
+        "quantity_processed_sunburst",
+        "weekly_waste_processed_data",
+        lambda data_df, inputs: create_quantity_processed_sunburst_figure(
+            data_df, inputs.waste_codes_data, inputs.date_interval
+        ),
+        window=ALL_WINDOW,
+    ),
+    FigureSpec(
+        "company_created_weekly",
+        "accounts_weekly_data",
+        lambda data_df, _: create_weekly_created_figure(data_df, "comptes_etablissements"),
+    ),
+    FigureSpec(
+        "user_created_weekly",
+        "accounts_weekly_data",
+        lambda data_df, _: create_weekly_created_figure(data_df, "comptes_utilisateurs"),
+    ),
+    FigureSpec(
+        "company_counts_by_category",
+        "accounts_by_naf_data",
+        lambda data_df, inputs: create_treemap_companies_figure(data_df, year=inputs.year),
+        window=ALL_WINDOW,
+    ),
+    FigureSpec(
+        "produced_quantity_by_category",
+        "waste_produced_by_naf_annual_stats",
+        lambda data_df, inputs: create_treemap_companies_figure(data_df, use_quantity=True, year=inputs.year),
+        window=ALL_WINDOW,
+    ),
+]
+
+
+# Number of rows of the frame of the statistics, in the result of their select
+_ROWS_COLUMN = "_rows"
+
+
+class YearPlan:
+    """
+    Queries computing the fields of a year from specs, as LazyFrames, and the fields computed from their results.
+
+    The rows of a dataset and window are planned once, and the same plan is read by every spec. Every total is summed
+    in a single select over the yearly totals (each column of a dataset once per window), and the statistics of a
+    dataset and window in a single select. The plans of several years are executed by `execute_plans`.
+    """
+
+    def __init__(
+        self,
+        inputs: YearInputs,
+        datasets: Computed | None,
+        yearly_totals_df: pl.DataFrame | None = None,
+        totals: list[TotalSpec] | None = None,
+        metrics: list[MetricSpec] | None = None,
+        figures: list[FigureSpec] | None = None,
+    ):
+        self.inputs = inputs
+        self.datasets = datasets
+        self.yearly_totals_df = yearly_totals_df
+        self.totals = totals or []
+        self.figures = figures or []
+        self.metrics_by_frame = {}
+        for spec in metrics or []:
+            self.metrics_by_frame.setdefault((spec.dataset, spec.window), []).append(spec)
+        # Frames collected for the figures
+        self.frames_keys = list(dict.fromkeys((spec.dataset, spec.window) for spec in self.figures if spec.dataset))
+        self.totals_keys = list(
+            dict.fromkeys(
+                (dataset_name, column, spec.window)
+                for spec in self.totals
+                for dataset_name, column in spec.datasets_columns.items()
+            )
+        )
+        self._frames = {}
+
+    def _get_frame(self, key: tuple[str, str]) -> pl.LazyFrame:
+        if key not in self._frames:
+            dataset_name, window = key
+            data_lf = getattr(self.datasets, dataset_name).lazy()
+            if window == YEAR_WINDOW:
+                data_lf = get_weekly_preprocessed_lf(data_lf, self.inputs.date_interval)
+            self._frames[key] = data_lf
+        return self._frames[key]
+
+    def frame_queries(self) -> list[pl.LazyFrame]:
+        """Queries of the rows read by the figures, one per dataset and window (`frames_keys`)."""
+        return [self._get_frame(key) for key in self.frames_keys]
+
+    def aggregation_queries(self, frames: dict[tuple[str, str], pl.DataFrame] | None = None) -> list[pl.LazyFrame]:
+        """Queries of the totals (if any) and of the statistics of each dataset and window, reading the already
+        collected `frames` when given."""
+        queries = []
+        if self.totals:
+            exprs = []
+            for index, (dataset_name, column, window) in enumerate(self.totals_keys):
+                mask = pl.col("dataset") == dataset_name
+                if window == YEAR_WINDOW:
+                    # Complete weeks of the year. Not built for the all-time totals, whose year is None
+                    mask = (
+                        mask
+                        & (pl.col("annee") == self.inputs.year)
+                        & pl.col("semaine_incomplete").cast(pl.Boolean).not_()
+                    )
+                exprs.append(pl.col(column).filter(mask).sum().alias(str(index)))
+            queries.append(self.yearly_totals_df.lazy().select(exprs))
+
+        for key, specs in self.metrics_by_frame.items():
+            data_lf = frames[key].lazy() if frames and key in frames else self._get_frame(key)
+            queries.append(
+                data_lf.select(pl.len().alias(_ROWS_COLUMN), *(spec.expr.alias(spec.field) for spec in specs))
+            )
+        return queries
+
+    def get_fields(self, frames: list[pl.DataFrame], aggregations: list[pl.DataFrame]) -> dict:
+        """Computes the fields from the results of `frame_queries` and `aggregation_queries`."""
+        fields = {}
+        aggregations = iter(aggregations)
+
+        if self.totals:
+            # The sums of the datasets of a spec are added in their order
+            sums = dict(zip(self.totals_keys, next(aggregations).row(0)))
+            for spec in self.totals:
+                total = 0
+                for dataset_name, column in spec.datasets_columns.items():
+                    total += sums[(dataset_name, column, spec.window)]
+                fields[spec.field] = spec.cast(total) if spec.cast else total
+
+        for specs in self.metrics_by_frame.values():
+            values = next(aggregations).row(0, named=True)
+            for spec in specs:
+                value = values[spec.field] if values[_ROWS_COLUMN] else None
+                fields[spec.field] = round(value, spec.digits) if value is not None else None
+
+        frames = dict(zip(self.frames_keys, frames))
+        for spec in self.figures:
+            data_df = frames[(spec.dataset, spec.window)] if spec.dataset else None
+            fields[spec.field] = spec.build(data_df, self.inputs).to_json()
+
+        return fields
+
+
+def execute_plans(plans: list[YearPlan], lazy: bool = False) -> list[dict]:
+    """
+    Executes the queries of `plans` and returns the fields of each plan.
+
+    With `lazy`, the queries of every plan are executed together (`pl.collect_all`): polars runs them in parallel,
+    computes their common subplans once (the rows of a dataset within the date interval of a year) and only reads the
+    columns they use; the rows only read by statistics are never materialized. Otherwise, each plan collects the rows
+    read by its figures first, and its aggregations read them.
+    """
+    if not lazy:
+        fields = []
+        for plan in plans:
+            frames = [query.collect() for query in plan.frame_queries()]
+            aggregations = [query.collect() for query in plan.aggregation_queries(dict(zip(plan.frames_keys, frames)))]
+            fields.append(plan.get_fields(frames, aggregations))
+        return fields
+
+    plans_queries = [(plan.frame_queries(), plan.aggregation_queries()) for plan in plans]
+    results = iter(
+        pl.collect_all(
+            [
+                query
+                for frame_queries, aggregation_queries in plans_queries
+                for query in frame_queries + aggregation_queries
+            ]
+        )
+    )
+    return [
+        plan.get_fields(
+            [next(results) for _ in frame_queries],
+            [next(results) for _ in aggregation_queries],
+        )
+        for plan, (frame_queries, aggregation_queries) in zip(plans, plans_queries)
+    ]
+
+
+def evaluate_totals(specs: list[TotalSpec], yearly_totals_df: pl.DataFrame, year: int | None = None) -> dict:
+    """Computes the totals of `specs` in a single select over the yearly totals of every year: those of a year, or the
+    all-time totals only if `year` is None."""
+    date_interval = get_data_date_interval_for_year(year) if year is not None else None
+    inputs = YearInputs(year, date_interval, pl.DataFrame(), [])
+    (fields,) = execute_plans([YearPlan(inputs, None, yearly_totals_df, totals=specs)])
+    return fields
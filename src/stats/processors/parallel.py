@@ -0,0 +1,77 @@
+import logging
+import math
+import multiprocessing
+import os
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import django
+
+logger = logging.getLogger(__name__)
+
+CGROUP_DIR = Path("/sys/fs/cgroup")
+
+
+def _get_cgroup_cpu_limit(cgroup_dir: Path = CGROUP_DIR) -> float | None:
+    """Returns the CPU quota of the container (cgroup v2 `cpu.max`, or v1 CFS quota) in CPUs, if it is limited."""
+    try:
+        quota, period = (cgroup_dir / "cpu.max").read_text().split()
+    except (OSError, ValueError):
+        try:
+            quota = (cgroup_dir / "cpu" / "cpu.cfs_quota_us").read_text().strip()
+            period = (cgroup_dir / "cpu" / "cpu.cfs_period_us").read_text().strip()
+        except OSError:
+            return None
+    if quota in ("max", "-1"):
+        return None
+    return int(quota) / int(period)
+
+
+def get_available_cpus(cgroup_dir: Path = CGROUP_DIR) -> int:
+    """Returns the number of CPUs the process can use: its CPU affinity, capped by the CPU quota of the container."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    cpu_limit = _get_cgroup_cpu_limit(cgroup_dir)
+    if cpu_limit is not None:
+        cpus = min(cpus, max(1, math.floor(cpu_limit)))
+    return cpus
+
+
+def get_jobs_count(jobs: int, tasks_count: int) -> int:
+    """Returns the number of processes to run `tasks_count` tasks with: `jobs` (0 for one per available CPU),
+    capped by the available CPUs and the number of tasks."""
+    available_cpus = get_available_cpus()
+    jobs = jobs or available_cpus
+    return max(1, min(jobs, available_cpus, tasks_count))
+
+
+def _init_worker():
+    # Tasks are functions of the Django apps, which can only be imported once the apps are loaded
+    django.setup()
+
+
+@contextmanager
+def process_pool(jobs: int) -> Iterator[ProcessPoolExecutor]:
+    """
+    Yields a pool of `jobs` processes, started with a fresh interpreter (spawn) and Django set up.
+
+    The available CPUs are shared between the processes: the thread pool of polars is limited in each of them
+    (`POLARS_MAX_THREADS`), so that the processes do not run more threads than there are CPUs.
+    """
+    polars_threads = max(1, get_available_cpus() // jobs)
+    logger.info("Starting %s processes with %s polars threads each", jobs, polars_threads)
+
+    previous_polars_threads = os.environ.get("POLARS_MAX_THREADS")
+    # Read by the processes when they start
+    os.environ["POLARS_MAX_THREADS"] = str(polars_threads)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+        ) as executor:
+            yield executor
+    finally:
+        if previous_polars_threads is None:
+            del os.environ["POLARS_MAX_THREADS"]
+        else:
+            os.environ["POLARS_MAX_THREADS"] = previous_polars_threads
@@ -1,243 +1,226 @@
+import hashlib
+import logging
+from concurrent.futures import as_completed
+from dataclasses import fields as dataclass_fields
+
+import plotly
 import polars as pl
+from django.db import transaction
 
 from data.data_extract import get_processing_operation_codes_data
-from data.data_processing import (
-    get_mean_packagings_by_bsff,
-    get_mean_quantity_by_bsff_packagings,
-    get_recovered_and_eliminated_quantity_processed_by_week_series,
-    get_summed_statistics,
-    get_total_bs_created,
-    get_total_number_of_accounts_created,
-    get_total_quantity_processed,
-    get_weekly_preprocessed_dfs,
-)
-from data.figures_factory import (
-    create_quantity_processed_sunburst_figure,
-    create_treemap_companies_figure,
-    create_weekly_created_figure,
-    create_weekly_quantity_processed_figure,
-    create_weekly_scatter_figure,
-)
+from data.data_processing import get_recovered_and_eliminated_quantity_processed_by_week_series
+from data.datasets import Computed, load_datasets, split_datasets_by_year
 from data.utils import get_data_date_interval_for_year
 
-from ..models import Computation
-
-
-def build_stats_and_figs(year: int, clear_year: bool = False):
+from ..models import Computation, GlobalComputation
+from .create_df import build_yearly_totals
+from .metrics import FIGURES, GLOBAL_TOTALS, METRICS, TOTALS, YearInputs, YearPlan, evaluate_totals, execute_plans
+from .parallel import get_jobs_count, process_pool
+
+logger = logging.getLogger(__name__)
+
+# To be increased when a change of the code changes the statistics or figures computed from the same inputs:
+# the fingerprints of every year then change, and they are all computed again (see `get_year_fingerprint`)
+COMPUTATION_VERSION = 1
+
+
+def get_headline_statistics_from_yearly_totals(yearly_totals_df: pl.DataFrame, year: int) -> dict:
+    """Computes the headline numbers of a year (see `metrics.TOTALS`) from the yearly totals of the weekly datasets."""
+    return evaluate_totals(TOTALS, yearly_totals_df, year)
+
+
+def get_global_statistics_from_yearly_totals(yearly_totals_df: pl.DataFrame) -> dict:
+    """Computes the all-time totals (see `metrics.GLOBAL_TOTALS`) from the yearly totals of the weekly datasets."""
+    return evaluate_totals(GLOBAL_TOTALS, yearly_totals_df)
+
+
+def build_global_computation(yearly_totals_df: pl.DataFrame):
+    """Computes the all-time totals and stores them as the GlobalComputation, replacing the previous one."""
+    fields = get_global_statistics_from_yearly_totals(yearly_totals_df)
+    with transaction.atomic():
+        GlobalComputation.objects.all().delete()
+        GlobalComputation.objects.create(**fields)
+
+
+def plan_stats_and_figs(
+    year: int,
+    yearly_totals_df: pl.DataFrame,
+    datasets: Computed,
+    waste_codes_data: pl.DataFrame,
+    quantity_processed_series: list[pl.DataFrame] | None = None,
+) -> YearPlan:
+    """Plans the statistics and figures of a year declared in the registry of `metrics` (see `compute_stats_and_figs`
+    for the arguments)."""
+    if quantity_processed_series is None:
+        quantity_processed_series = get_recovered_and_eliminated_quantity_processed_by_week_series(
+            datasets.weekly_waste_processed_data
+        )
+    inputs = YearInputs(year, get_data_date_interval_for_year(year), waste_codes_data, quantity_processed_series)
+    return YearPlan(inputs, datasets, yearly_totals_df, TOTALS, METRICS, FIGURES)
+
+
+def compute_stats_and_figs(
+    year: int,
+    yearly_totals_df: pl.DataFrame,
+    datasets: Computed,
+    waste_codes_data: pl.DataFrame,
+    quantity_processed_series: list[pl.DataFrame] | None = None,
+    lazy: bool = False,
+) -> dict:
+    """Computes the statistics and figures of a year, as the fields of its Computation (figures as JSON).
+
+    Nothing is read from the database or the warehouse, so that years can be computed in worker processes
+    (see `build_stats_and_figs_for_years`).
+
+    `datasets` are the raw datasets shared by the builds of every year, or only the rows of the year
+    (see `split_datasets_by_year`). `yearly_totals_df` holds the totals of every year (see `build_yearly_totals`)
+    and `waste_codes_data` the processing operation codes (see `get_processing_operation_codes_data`).
+    `quantity_processed_series` are the weekly recovered and eliminated quantities of every year
+    (see `get_recovered_and_eliminated_quantity_processed_by_week_series`), computed from `datasets` when not given:
+    the scale of the weekly figure depends on the weeks of every year.
+
+    The fields are declared in the registry of `metrics` and evaluated by its engine, with their queries executed
+    together if `lazy` (see `execute_plans`).
+    """
+    plan = plan_stats_and_figs(year, yearly_totals_df, datasets, waste_codes_data, quantity_processed_series)
+    (fields,) = execute_plans([plan], lazy)
+    return fields
+
+
+def get_year_fingerprint(
+    year_datasets: Computed, waste_codes_data: pl.DataFrame, quantity_processed_series: list[pl.DataFrame]
+) -> str:
+    """Returns a fingerprint of the inputs of the computation of a year (see `compute_stats_and_figs`).
+
+    It covers the rows of the year of every dataset (see `split_datasets_by_year`), the processing operation codes,
+    the scale of the weekly quantity figure (the maximum of each series of every year) and the version of the code
+    and of the libraries the figures are serialized with. The headline statistics are not covered: they are
+    computed from the yearly totals, whatever the fingerprint.
+    """
+    digest = hashlib.sha256(f"{COMPUTATION_VERSION} {pl.__version__} {plotly.__version__}".encode())
+
+    frames = {field.name: getattr(year_datasets, field.name) for field in dataclass_fields(year_datasets)}
+    frames["waste_codes_data"] = waste_codes_data
+    frames["quantity_processed_scale"] = pl.DataFrame(
+        {"quantite_traitee": [series["quantite_traitee"].max() for series in quantity_processed_series]}
+    )
+    for name, data_df in frames.items():
+        # Row hashes depend on the physical type of the columns: categories are hashed as their values
+        data_df = data_df.with_columns(pl.col(pl.Categorical, pl.Enum).cast(pl.String))
+        # Summed, so that the order of the rows does not matter
+        rows_hash = data_df.hash_rows(seed=0).sum() if len(data_df) else 0
+        digest.update(f"{name} {data_df.schema} {len(data_df)} {rows_hash}".encode())
+
+    return digest.hexdigest()
+
+
+def get_stored_fingerprints(years: list[int]) -> dict[int, str]:
+    """Returns the fingerprint of the latest Computation of each year, if any."""
+    fingerprints = {}
+    for year, fingerprint in (
+        Computation.objects.filter(year__in=years).order_by("created").values_list("year", "fingerprint")
+    ):
+        fingerprints[year] = fingerprint
+    return fingerprints
+
+
+def store_computation(year: int, fields: dict, clear_year: bool = False):
+    """Stores the statistics and figures of a year, replacing its previous Computations if `clear_year`."""
     if clear_year:
         Computation.objects.filter(year=year).delete()
-
-    date_interval = get_data_date_interval_for_year(year)
-
-    bsdd_weekly_data_df = pl.read_parquet("temp_data/bsdd_weekly_data.parquet")
-    bsda_weekly_data_df = pl.read_parquet("temp_data/bsda_weekly_data.parquet")
-    bsff_weekly_data_df = pl.read_parquet("temp_data/bsff_weekly_data.parquet")
-    bsdasri_weekly_data_df = pl.read_parquet("temp_data/bsdasri_weekly_data.parquet")
-    bsvhu_weekly_data_df = pl.read_parquet("temp_data/bsvhu_weekly_data.parquet")
-    bsd_non_dangerous_weekly_data_df = pl.read_parquet("temp_data/bsd_non_dangerous_weekly_data.parquet")
-    accounts_weekly_data_df = pl.read_parquet("temp_data/accounts_weekly_data.parquet")
-    weekly_waste_processed_data_df = pl.read_parquet("temp_data/weekly_waste_processed_data.parquet")
-    accounts_by_naf_data_df = pl.read_parquet("temp_data/accounts_by_naf_data.parquet")
-    waste_produced_by_naf_annual_stats_df = pl.read_parquet("temp_data/waste_produced_by_naf_annual_stats.parquet")
-
-    bs_weekly_datasets = {
-        "BSDD": bsdd_weekly_data_df,
-        "BSDA": bsda_weekly_data_df,
-        "BSFF": bsff_weekly_data_df,
-        "BSDASRI": bsdasri_weekly_data_df,
-        "BSVHU": bsvhu_weekly_data_df,
-    }
-
-    total_bs_created = get_total_bs_created(
-        {**bs_weekly_datasets, "BS de déchets non dangereux": bsd_non_dangerous_weekly_data_df}
-    )
-    total_quantity_processed = get_total_quantity_processed(bs_weekly_datasets)
-    total_quantity_processed_non_dangerous = get_summed_statistics(
-        bsd_non_dangerous_weekly_data_df, "quantite_traitee_operations_finales"
-    )
-    total_companies_created = get_total_number_of_accounts_created(accounts_weekly_data_df, "comptes_etablissements")
-
-    # BSx weekly figures
-    bsdd_weekly_filtered_df = get_weekly_preprocessed_dfs(bsdd_weekly_data_df, date_interval)
-    bsda_weekly_filtered_df = get_weekly_preprocessed_dfs(bsda_weekly_data_df, date_interval)
-    bsff_weekly_filtered_df = get_weekly_preprocessed_dfs(bsff_weekly_data_df, date_interval)
-    bsdasri_weekly_filtered_df = get_weekly_preprocessed_dfs(bsdasri_weekly_data_df, date_interval)
-    bsvhu_weekly_filtered_df = get_weekly_preprocessed_dfs(bsvhu_weekly_data_df, date_interval)
-    bsd_non_dangerous_weekly_filtered_df = get_weekly_preprocessed_dfs(bsd_non_dangerous_weekly_data_df, date_interval)
-
-    bsdd_counts_weekly_fig = create_weekly_scatter_figure(
-        bsdd_weekly_filtered_df,
-        metric_type="counts",
-        bs_type="BSDD",
-    )
-    bsda_counts_weekly_fig = create_weekly_scatter_figure(
-        bsda_weekly_filtered_df,
-        metric_type="counts",
-        bs_type="BSDA",
-    )
-    bsff_counts_weekly_fig = create_weekly_scatter_figure(
-        bsff_weekly_filtered_df,
-        metric_type="counts",
-        bs_type="BSFF",
-    )
-    bsff_packagings_counts_weekly_fig = create_weekly_scatter_figure(
-        bsff_weekly_filtered_df,
-        metric_type="counts",
-        bs_type="BSFF PACKAGINGS",
-    )
-    bsdasri_counts_weekly_fig = create_weekly_scatter_figure(
-        bsdasri_weekly_filtered_df,
-        metric_type="counts",
-        bs_type="BSDASRI",
-    )
-    bsvhu_counts_weekly_fig = create_weekly_scatter_figure(
-        bsvhu_weekly_filtered_df,
-        metric_type="counts",
-        bs_type="BSVHU",
-    )
-    bsd_non_dangerous_counts_weekly_fig = create_weekly_scatter_figure(
-        bsd_non_dangerous_weekly_filtered_df, metric_type="counts", bs_type="BS de déchets non dangereux"
-    )
-
-    bsdd_quantities_weekly_fig = create_weekly_scatter_figure(
-        bsdd_weekly_filtered_df,
-        metric_type="quantity",
-        bs_type="BSDD",
-    )
-    bsda_quantities_weekly_fig = create_weekly_scatter_figure(
-        bsda_weekly_filtered_df,
-        metric_type="quantity",
-        bs_type="BSDA",
-    )
-    bsff_quantities_weekly_fig = create_weekly_scatter_figure(
-        bsff_weekly_filtered_df,
-        metric_type="quantity",
-        bs_type="BSFF",
-    )
-    bsdasri_quantities_weekly_fig = create_weekly_scatter_figure(
-        bsdasri_weekly_filtered_df,
-        metric_type="quantity",
-        bs_type="BSDASRI",
-    )
-    bsvhu_quantities_weekly_fig = create_weekly_scatter_figure(
-        bsvhu_weekly_filtered_df,
-        metric_type="quantity",
-        bs_type="BSDASRI",
-    )
-    bsd_non_dangerous_quantities_weekly_fig = create_weekly_scatter_figure(
-        bsd_non_dangerous_weekly_filtered_df, metric_type="quantity", bs_type="BS de déchets non dangereux"
-    )
-
-    # BSx weekly stats
-    bsdd_bordereaux_created = get_summed_statistics(bsdd_weekly_filtered_df, "creations")
-    bsda_bordereaux_created = get_summed_statistics(bsda_weekly_filtered_df, "creations")
-    bsff_bordereaux_created = get_summed_statistics(bsff_weekly_filtered_df, "creations_bordereaux")
-    bsdasri_bordereaux_created = get_summed_statistics(bsdasri_weekly_filtered_df, "creations")
-    bsvhu_bordereaux_created = get_summed_statistics(bsvhu_weekly_filtered_df, "creations")
-    bsd_non_dangerous_bordereaux_created = get_summed_statistics(bsd_non_dangerous_weekly_filtered_df, "creations")
-
-    bsdd_quantity_processed = get_summed_statistics(bsdd_weekly_filtered_df, "quantite_traitee_operations_finales")
-    bsda_quantity_processed = get_summed_statistics(bsda_weekly_filtered_df, "quantite_traitee_operations_finales")
-    bsff_quantity_processed = get_summed_statistics(bsff_weekly_filtered_df, "quantite_traitee_operations_finales")
-    bsdasri_quantity_processed = get_summed_statistics(
-        bsdasri_weekly_filtered_df, "quantite_traitee_operations_finales"
-    )
-    bsvhu_quantity_processed = get_summed_statistics(bsvhu_weekly_filtered_df, "quantite_traitee_operations_finales")
-    bsd_non_dangerous_quantity_processed = get_summed_statistics(
-        bsd_non_dangerous_weekly_filtered_df, "quantite_traitee_operations_finales"
-    )
-
-    # BSFF specific stats
-    mean_quantity_by_bsff_packagings = get_mean_quantity_by_bsff_packagings(bsff_weekly_filtered_df)
-    mean_packagings_by_bsff = get_mean_packagings_by_bsff(bsff_weekly_filtered_df)
-
-    # Waste weight processed weekly
-    (
-        recovered_quantity_series,
-        eliminated_quantity_series,
-    ) = get_recovered_and_eliminated_quantity_processed_by_week_series(weekly_waste_processed_data_df)
-
-    quantity_processed_weekly_fig = create_weekly_quantity_processed_figure(
-        recovered_quantity_series, eliminated_quantity_series, date_interval
-    )
-
+    Computation.objects.create(year=year, **fields)
+
+
+def refresh_headline_statistics(year: int, yearly_totals_df: pl.DataFrame):
+    """Updates the headline statistics of the Computations of a year whose other fields are kept: the yearly totals
+    they are computed from are not covered by the fingerprint (they may be computed by the warehouse)."""
+    Computation.objects.filter(year=year).update(**get_headline_statistics_from_yearly_totals(yearly_totals_df, year))
+
+
+def build_stats_and_figs_for_years(
+    years: list[int],
+    clear_years: bool = False,
+    yearly_totals_df: pl.DataFrame | None = None,
+    datasets: Computed | None = None,
+    jobs: int = 1,
+    force: bool = False,
+    lazy: bool = False,
+    quantity_processed_series: list[pl.DataFrame] | None = None,
+):
+    """Computes the statistics and figures of several years and stores them as Computations.
+
+    The totals of every year are computed once (see `build_yearly_totals`), and the datasets are split by year in a
+    single pass (see `split_datasets_by_year`): the build of each year only reads its own rows.
+    `datasets` are loaded from the staging directory when not given.
+
+    The scale of the weekly quantity figure depends on the weeks of every year: `quantity_processed_series`
+    (see `compute_stats_and_figs`) must be computed from the whole history of `weekly_waste_processed_data`.
+    It is computed once from `datasets` when not given, which must then hold the rows of every year.
+
+    The years whose inputs have the fingerprint of their latest Computation (see `get_year_fingerprint`) are
+    skipped, unless `force`: their Computation is kept, with its headline statistics updated.
+
+    With several `jobs` (0 for one per available CPU), the years are computed in a pool of processes, each receiving
+    the rows of its year (see `process_pool`). Their results are stored by the calling process.
+
+    With `lazy`, the queries of the years are executed together (see `execute_plans`): those of every year in a
+    single process, those of its year in each process of the pool.
+    """
+    datasets = datasets or load_datasets()
+    if yearly_totals_df is None:
+        yearly_totals_df = build_yearly_totals(datasets)
     waste_codes_data = get_processing_operation_codes_data()
-    quantity_processed_sunburst_fig = create_quantity_processed_sunburst_figure(
-        weekly_waste_processed_data_df, waste_codes_data, date_interval
-    )
-
-    quantity_processed_yearly = get_total_quantity_processed(
-        bs_weekly_datasets,
-        date_interval,
-    )
-    quantity_processed_non_dangerous_yearly = get_summed_statistics(
-        bsd_non_dangerous_weekly_data_df, "quantite_traitee_operations_finales", date_interval
-    )
-    bs_created_yearly = get_total_bs_created(
-        {**bs_weekly_datasets, "BS de déchets non dangereux": bsd_non_dangerous_weekly_data_df},
-        date_interval,
-    )
-
-    company_created_total_life = get_total_number_of_accounts_created(
-        accounts_weekly_data_df, "comptes_etablissements", date_interval=date_interval
-    )
-    user_created_total_life = get_total_number_of_accounts_created(
-        accounts_weekly_data_df, "comptes_utilisateurs", date_interval=date_interval
-    )
-
-    accounts_created_weekly_df = get_weekly_preprocessed_dfs(accounts_weekly_data_df, date_interval=date_interval)
-
-    company_created_weekly_fig = create_weekly_created_figure(accounts_created_weekly_df, "comptes_etablissements")
-    user_created_weekly_fig = create_weekly_created_figure(accounts_created_weekly_df, "comptes_utilisateurs")
-
-    treemap_companies_figure = create_treemap_companies_figure(accounts_by_naf_data_df, year=year)
-
-    produced_quantity_by_category_fig = create_treemap_companies_figure(
-        waste_produced_by_naf_annual_stats_df, use_quantity=True, year=year
-    )
-
-    Computation.objects.create(
-        year=year,
-        total_bs_created=total_bs_created,
-        total_quantity_processed=total_quantity_processed,
-        total_quantity_processed_non_dangerous=total_quantity_processed_non_dangerous,
-        total_companies_created=total_companies_created,
-        quantity_processed_yearly=quantity_processed_yearly,
-        quantity_processed_non_dangerous_yearly=quantity_processed_non_dangerous_yearly,
-        bs_created_yearly=bs_created_yearly,
-        quantity_processed_weekly=quantity_processed_weekly_fig.to_json(),
-        quantity_processed_sunburst=quantity_processed_sunburst_fig.to_json(),
-        bsdd_counts_weekly=bsdd_counts_weekly_fig.to_json(),
-        bsda_counts_weekly=bsda_counts_weekly_fig.to_json(),
-        bsff_counts_weekly=bsff_counts_weekly_fig.to_json(),
-        bsff_packagings_counts_weekly=bsff_packagings_counts_weekly_fig.to_json(),
-        bsdasri_counts_weekly=bsdasri_counts_weekly_fig.to_json(),
-        bsvhu_counts_weekly=bsvhu_counts_weekly_fig.to_json(),
-        bsd_non_dangerous_counts_weekly=bsd_non_dangerous_counts_weekly_fig.to_json(),
-        bsdd_quantities_weekly=bsdd_quantities_weekly_fig.to_json(),
-        bsda_quantities_weekly=bsda_quantities_weekly_fig.to_json(),
-        bsff_quantities_weekly=bsff_quantities_weekly_fig.to_json(),
-        bsdasri_quantities_weekly=bsdasri_quantities_weekly_fig.to_json(),
-        bsvhu_quantities_weekly=bsvhu_quantities_weekly_fig.to_json(),
-        bsd_non_dangerous_quantities_weekly=bsd_non_dangerous_quantities_weekly_fig.to_json(),
-        bsdd_bordereaux_created=bsdd_bordereaux_created,
-        bsda_bordereaux_created=bsda_bordereaux_created,
-        bsff_bordereaux_created=bsff_bordereaux_created,
-        bsdasri_bordereaux_created=bsdasri_bordereaux_created,
-        bsvhu_bordereaux_created=bsvhu_bordereaux_created,
-        bsd_non_dangerous_bordereaux_created=bsd_non_dangerous_bordereaux_created,
-        bsdd_quantity_processed=bsdd_quantity_processed,
-        bsda_quantity_processed=bsda_quantity_processed,
-        bsff_quantity_processed=bsff_quantity_processed,
-        bsdasri_quantity_processed=bsdasri_quantity_processed,
-        bsvhu_quantity_processed=bsvhu_quantity_processed,
-        bsd_non_dangerous_quantity_processed=bsd_non_dangerous_quantity_processed,
-        mean_quantity_by_bsff_packagings=mean_quantity_by_bsff_packagings,
-        mean_packagings_by_bsff=mean_packagings_by_bsff,
-        produced_quantity_by_category=produced_quantity_by_category_fig.to_json(),
-        company_created_total_life=company_created_total_life,
-        user_created_total_life=user_created_total_life,
-        company_created_weekly=company_created_weekly_fig.to_json(),
-        user_created_weekly=user_created_weekly_fig.to_json(),
-        company_counts_by_category=treemap_companies_figure.to_json(),
-    )
+    if quantity_processed_series is None:
+        quantity_processed_series = get_recovered_and_eliminated_quantity_processed_by_week_series(
+            datasets.weekly_waste_processed_data
+        )
+    yearly_datasets = split_datasets_by_year(datasets, years)
+
+    fingerprints = {
+        year: get_year_fingerprint(year_datasets, waste_codes_data, quantity_processed_series)
+        for year, year_datasets in yearly_datasets.items()
+    }
+    if not force:
+        stored_fingerprints = get_stored_fingerprints(years)
+        for year, fingerprint in fingerprints.items():
+            if stored_fingerprints.get(year) == fingerprint:
+                logger.info("Inputs of %s unchanged, skipping its computation", year)
+                refresh_headline_statistics(year, yearly_totals_df)
+                del yearly_datasets[year]
+    if not yearly_datasets:
+        return
+
+    jobs = get_jobs_count(jobs, len(yearly_datasets))
+    if jobs == 1 and lazy:
+        plans = [
+            plan_stats_and_figs(year, yearly_totals_df, year_datasets, waste_codes_data, quantity_processed_series)
+            for year, year_datasets in yearly_datasets.items()
+        ]
+        for plan, fields in zip(plans, execute_plans(plans, lazy=True)):
+            store_computation(plan.inputs.year, {**fields, "fingerprint": fingerprints[plan.inputs.year]}, clear_years)
+        return
+
+    if jobs == 1:
+        for year, year_datasets in yearly_datasets.items():
+            fields = compute_stats_and_figs(
+                year, yearly_totals_df, year_datasets, waste_codes_data, quantity_processed_series
+            )
+            store_computation(year, {**fields, "fingerprint": fingerprints[year]}, clear_years)
+        return
+
+    with process_pool(jobs) as executor:
+        futures = {
+            executor.submit(
+                compute_stats_and_figs,
+                year,
+                yearly_totals_df,
+                year_datasets,
+                waste_codes_data,
+                quantity_processed_series,
+                lazy,
+            ): year
+            for year, year_datasets in yearly_datasets.items()
+        }
+        for future in as_completed(futures):
+            year = futures[future]
+            store_computation(year, {**future.result(), "fingerprint": fingerprints[year]}, clear_years)
@@ -0,0 +1,100 @@
+from datetime import date
+from io import StringIO
+
+import polars as pl
+import pytest
+from django.core.management import call_command
+
+from data.checkpoint import ExtractionCheckpoint
+from data.datasets import DATASETS_QUERIES, WEEKLY_DATASETS
+from data.manifests import get_storage_schema
+
+from ..processors import create_df
+from ..processors.create_df import build_dataframes
+
+
+def weekly_df(dataset_name, weeks, value):
+    # Other columns of the dataset are null
+    return pl.DataFrame({"semaine": weeks, "creations": [value] * len(weeks)}).with_columns(
+        pl.lit(None, dtype).alias(column)
+        for column, dtype in get_storage_schema(dataset_name).items()
+        if column not in ("semaine", "creations")
+    )
+
+
+@pytest.fixture
+def extracted(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    calls = []
+
+    def fake_extract_datasets_to_parquet(directory, max_workers=None, date_starts=None, batch_bs=None, mode=None):
+        calls.append(date_starts)
+        weeks = [date(2026, 1, 5), date(2026, 1, 12), date(2026, 1, 19)]
+        value = len(calls)
+        if date_starts:
+            weeks = [week for week in weeks if week >= min(date_starts.values())]
+        for dataset_name in DATASETS_QUERIES:
+            weekly_df(dataset_name, weeks, value).write_parquet(f"{directory}/{dataset_name}.parquet")
+
+    monkeypatch.setattr(create_df, "extract_datasets_to_parquet", fake_extract_datasets_to_parquet)
+    return calls
+
+
+def test_build_dataframes_incremental(extracted, tmp_path):
+    build_dataframes(full_refresh=True)
+    build_dataframes(full_refresh=False, reread_weeks=1)
+
+    assert extracted[0] == {}
+    assert extracted[1] == {dataset_name: date(2026, 1, 12) for dataset_name in WEEKLY_DATASETS}
+
+    bsdd_df = pl.read_parquet("temp_data/bsdd_weekly_data.parquet")
+    assert bsdd_df["semaine"].to_list() == [date(2026, 1, 5), date(2026, 1, 12), date(2026, 1, 19)]
+    assert bsdd_df["creations"].to_list() == [1, 2, 2]
+    assert not (tmp_path / "temp_data" / "increment").exists()
+
+    # The fact table is built from the merged snapshots
+    bs_facts_df = pl.read_parquet("temp_data/bs_facts.parquet")
+    assert bs_facts_df.filter(pl.col("bs_type") == "bsdd")["creations"].to_list() == [1, 2, 2]
+
+
+def test_build_dataframes_incremental_since(extracted):
+    build_dataframes(full_refresh=True)
+    build_dataframes(full_refresh=False, reread_weeks=1, since=date(2026, 1, 1))
+
+    assert extracted[1]["bsdd_weekly_data"] == date(2026, 1, 1)
+    assert pl.read_parquet("temp_data/bsdd_weekly_data.parquet")["creations"].to_list() == [2, 2, 2]
+
+
+def test_build_dataframes_full_refresh_after_interrupted_increment(extracted, monkeypatch, tmp_path):
+    build_dataframes(full_refresh=True)
+
+    def interrupted_extraction(directory, max_workers=None, date_starts=None, batch_bs=None, mode=None):
+        checkpoint = ExtractionCheckpoint(directory, mode)
+        weekly_df("bsdd_weekly_data", [date(2026, 1, 19)], 0).write_parquet(f"{directory}/bsdd_weekly_data.parquet")
+        checkpoint.mark_completed("bsdd_weekly_data", "SELECT 1", 1)
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(create_df, "extract_datasets_to_parquet", interrupted_extraction)
+        with pytest.raises(KeyboardInterrupt):
+            build_dataframes(full_refresh=False, reread_weeks=1)
+    assert ExtractionCheckpoint(tmp_path / "temp_data" / "increment").mode == "incremental"
+
+    # The checkpoint of the incremental run is not resumed by a full refresh
+    build_dataframes(full_refresh=True)
+
+    assert not (tmp_path / "temp_data" / "increment").exists()
+    assert pl.read_parquet("temp_data/bsdd_weekly_data.parquet")["creations"].to_list() == [2, 2, 2]
+
+
+def test_benchmark_staging(extracted, tmp_path):
+    build_dataframes(full_refresh=True)
+
+    stdout = StringIO()
+    call_command("benchmark_staging", repeat=2, stdout=stdout)
+
+    header, *lines = stdout.getvalue().splitlines()
+    assert header.split() == ["format", "best", "s", "median", "s", "anon", "MB", "file", "MB"]
+    assert [line.split()[0] for line in lines] == ["parquet", "ipc"]
+    # The IPC copies written for the benchmark are deleted
+    assert not list((tmp_path / "temp_data").glob("*.arrow"))
@@ -0,0 +1,67 @@
+from datetime import date, datetime
+
+import plotly.graph_objects as go
+import polars as pl
+import pytest
+
+from data.datasets import Computed
+
+from ..models import Computation
+from ..processors.metrics import (
+    ALL_WINDOW,
+    FIGURES,
+    METRICS,
+    TOTALS,
+    FigureSpec,
+    MetricSpec,
+    YearInputs,
+    YearPlan,
+    execute_plans,
+)
+
+
+def test_registry_fields():
+    fields = [spec.field for spec in [*TOTALS, *METRICS, *FIGURES]]
+
+    assert len(fields) == len(set(fields))
+    model_fields = {field.name for field in Computation._meta.get_fields()}
+    assert set(fields) <= model_fields
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_execute_plans(lazy):
+    bsff_df = pl.DataFrame(
+        {
+            "semaine": [date(2024, 12, 30), date(2025, 1, 13), date(2025, 1, 6)],
+            "quantite": [100.0, 2.0, 1.0],
+            "contenants": [1, 4, 2],
+        }
+    )
+    empty_df = pl.DataFrame(schema=bsff_df.schema)
+    datasets = Computed(**dict.fromkeys(Computed.__dataclass_fields__, empty_df) | {"bsff_weekly_data": bsff_df})
+    inputs = YearInputs(2025, (datetime(2025, 1, 1), datetime(2026, 1, 1)), pl.DataFrame(), [])
+    frames = []
+
+    def build(data_df, _):
+        frames.append(data_df)
+        return go.Figure()
+
+    metrics = [
+        MetricSpec("quantity", "bsff_weekly_data", pl.col("quantite").sum()),
+        MetricSpec("mean_quantity", "bsff_weekly_data", (pl.col("quantite") / pl.col("contenants")).mean(), digits=1),
+        MetricSpec("all_quantity", "bsff_weekly_data", pl.col("quantite").sum(), window=ALL_WINDOW),
+        MetricSpec("bsdd_quantity", "bsdd_weekly_data", pl.col("quantite").sum()),
+    ]
+    figures = [FigureSpec("first", "bsff_weekly_data", build), FigureSpec("second", "bsff_weekly_data", build)]
+
+    (fields,) = execute_plans([YearPlan(inputs, datasets, metrics=metrics, figures=figures)], lazy)
+
+    assert fields["quantity"] == 3.0
+    assert fields["mean_quantity"] == 0.5
+    assert fields["all_quantity"] == 103.0
+    # No rows
+    assert fields["bsdd_quantity"] is None
+    # Rows of the year, sorted by week, filtered once for both figures
+    assert frames[0]["semaine"].to_list() == [date(2025, 1, 6), date(2025, 1, 13)]
+    assert frames[0] is frames[1]
+    assert fields["first"] == go.Figure().to_json()
@@ -0,0 +1,324 @@
+import os
+import warnings
+from contextlib import nullcontext
+from dataclasses import fields as dataclass_fields
+from dataclasses import replace
+from datetime import UTC, date, datetime, timedelta
+
+import polars as pl
+import pytest
+from django.core.management import call_command
+
+from data.data_processing import compute_yearly_totals, get_recovered_and_eliminated_quantity_processed_by_week_series
+from data.datasets import BS_WEEKLY_TABLES, DATASETS_QUERIES, Computed, build_bs_facts, split_datasets_by_year
+from data.manifests import DATASET_MANIFESTS, NAF_COLUMNS, apply_dataset_schema
+
+from ..management.commands import build_stats
+from ..models import Computation, GlobalComputation
+from ..processors import parallel, stats_processor
+from ..processors.create_df import build_yearly_totals
+from ..processors.parallel import get_available_cpus
+from ..processors.stats_processor import (
+    build_global_computation,
+    build_stats_and_figs_for_years,
+    compute_stats_and_figs,
+    get_global_statistics_from_yearly_totals,
+    get_headline_statistics_from_yearly_totals,
+    get_stored_fingerprints,
+    get_year_fingerprint,
+)
+
+DATE_END = datetime(2025, 6, 2)
+
+
+def make_weekly_df(seed: int, columns: list[str]) -> pl.DataFrame:
+    weeks = [date(2023, 1, 2) + timedelta(weeks=index) for index in range(140)]
+    return pl.DataFrame(
+        {
+            "semaine": weeks,
+            **{column: [(index * seed) % 17 + 0.5 * (index % 3) for index in range(len(weeks))] for column in columns},
+        }
+    ).with_columns(pl.col("^creations.*$|^comptes_.*$").cast(pl.Int64))
+
+
+@pytest.fixture
+def weekly_datasets():
+    datasets = {}
+    for seed, dataset_name in enumerate(BS_WEEKLY_TABLES, start=1):
+        creations_column = "creations_bordereaux" if dataset_name == "bsff_weekly_data" else "creations"
+        datasets[dataset_name] = make_weekly_df(seed, [creations_column, "quantite_traitee_operations_finales"])
+    datasets["accounts_weekly_data"] = make_weekly_df(7, ["comptes_etablissements", "comptes_utilisateurs"])
+    return datasets
+
+
+def get_summed_statistics(df: pl.DataFrame, stat_column: str, date_interval: tuple | None = None) -> float:
+    """Sum of a column of weekly rows, within a left-inclusive date interval if given."""
+    if date_interval is not None:
+        df = df.filter(pl.col("semaine").is_between(*date_interval, closed="left"))
+    return df[stat_column].sum()
+
+
+def expected_headline_statistics(datasets: dict[str, pl.DataFrame], date_interval: tuple) -> dict:
+    """Headline numbers summed from the weekly rows of each dataset."""
+    bs_datasets = {name: df for name, df in datasets.items() if name in BS_WEEKLY_TABLES}
+    dangerous_datasets = {name: df for name, df in bs_datasets.items() if name != "bsd_non_dangerous_weekly_data"}
+    non_dangerous_df = datasets["bsd_non_dangerous_weekly_data"]
+    accounts_df = datasets["accounts_weekly_data"]
+
+    def creations(df, interval=None):
+        return get_summed_statistics(
+            df, "creations_bordereaux" if "creations_bordereaux" in df.columns else "creations", interval
+        )
+
+    def quantity(df, interval=None):
+        return get_summed_statistics(df, "quantite_traitee_operations_finales", interval)
+
+    headline_statistics = {
+        "total_bs_created": sum(creations(df) for df in bs_datasets.values()),
+        "total_quantity_processed": int(sum(quantity(df) for df in dangerous_datasets.values())),
+        "total_quantity_processed_non_dangerous": quantity(non_dangerous_df),
+        "total_companies_created": get_summed_statistics(accounts_df, "comptes_etablissements"),
+        "quantity_processed_yearly": int(sum(quantity(df, date_interval) for df in dangerous_datasets.values())),
+        "quantity_processed_non_dangerous_yearly": quantity(non_dangerous_df, date_interval),
+        "bs_created_yearly": sum(creations(df, date_interval) for df in bs_datasets.values()),
+        "company_created_total_life": get_summed_statistics(accounts_df, "comptes_etablissements", date_interval),
+        "user_created_total_life": get_summed_statistics(accounts_df, "comptes_utilisateurs", date_interval),
+    }
+    for dataset_name, df in bs_datasets.items():
+        prefix = dataset_name.removesuffix("_weekly_data")
+        headline_statistics[f"{prefix}_bordereaux_created"] = creations(df, date_interval)
+        headline_statistics[f"{prefix}_quantity_processed"] = quantity(df, date_interval)
+    return headline_statistics
+
+
+@pytest.mark.parametrize("year", [2023, 2025])
+def test_headline_statistics_from_yearly_totals(weekly_datasets, year):
+    date_interval = (datetime(year, 1, 1), DATE_END if year == 2025 else datetime(year + 1, 1, 1))
+    bs_facts_df = build_bs_facts({name: df for name, df in weekly_datasets.items() if name in BS_WEEKLY_TABLES})
+
+    yearly_totals_df = compute_yearly_totals(bs_facts_df, weekly_datasets["accounts_weekly_data"], DATE_END)
+    headline_statistics = {
+        **get_global_statistics_from_yearly_totals(yearly_totals_df),
+        **get_headline_statistics_from_yearly_totals(yearly_totals_df, year),
+    }
+
+    expected = expected_headline_statistics(weekly_datasets, date_interval)
+    assert headline_statistics.keys() == expected.keys()
+    for key, value in expected.items():
+        assert headline_statistics[key] == pytest.approx(value), key
+
+
+@pytest.fixture
+def datasets():
+    weeks = [date(2024, 1, 1) + timedelta(weeks=index) for index in range(104)]
+    frames = {}
+    for dataset_name in DATASETS_QUERIES:
+        manifest = DATASET_MANIFESTS[dataset_name]
+        if "semaine" in manifest:
+            data = {
+                column: weeks if column == "semaine" else [index % 13 + 1 for index in range(len(weeks))]
+                for column in manifest
+            }
+            if dataset_name == "weekly_waste_processed_data":
+                data["code_operation"] = ["R1", "D10"] * (len(weeks) // 2)
+                data["type_operation"] = ["Déchet valorisé", "Déchet éliminé"] * (len(weeks) // 2)
+        else:
+            data = {column: ["01.11Z", "Agriculture"] if column in NAF_COLUMNS else [1, 2] for column in manifest}
+            data["annee"] = [2024, 2025]
+        frames[dataset_name] = apply_dataset_schema(dataset_name, pl.DataFrame(data))
+    frames["bs_facts"] = apply_dataset_schema(
+        "bs_facts", build_bs_facts({dataset_name: frames[dataset_name] for dataset_name in BS_WEEKLY_TABLES})
+    )
+    return Computed(**frames)
+
+
+@pytest.mark.parametrize(("jobs", "lazy"), [(1, False), (2, False), (1, True)])
+def test_build_stats_and_figs_for_years_jobs(datasets, monkeypatch, jobs, lazy):
+    monkeypatch.setattr(
+        stats_processor,
+        "get_processing_operation_codes_data",
+        lambda: pl.DataFrame({"code": ["R1", "D10"], "description": ["Recyclage", "Incinération"]}),
+    )
+    monkeypatch.setattr(parallel, "get_available_cpus", lambda: 2)
+    monkeypatch.setattr(stats_processor, "get_stored_fingerprints", lambda years: {})
+    computations = {}
+    monkeypatch.setattr(
+        stats_processor, "store_computation", lambda year, fields, clear_year: computations.setdefault(year, fields)
+    )
+
+    build_stats_and_figs_for_years([2024, 2025], datasets=datasets, jobs=jobs, lazy=lazy)
+
+    # Same results as the build of each year on its own, from the datasets of every year
+    yearly_totals_df = build_yearly_totals(datasets)
+    waste_codes_data = stats_processor.get_processing_operation_codes_data()
+    assert computations.keys() == {2024, 2025}
+    for year, fields in computations.items():
+        assert fields.pop("fingerprint")
+        assert fields == compute_stats_and_figs(year, yearly_totals_df, datasets, waste_codes_data)
+    assert computations[2025]["bsdd_bordereaux_created"] > 0
+
+
+def test_build_stats_and_figs_for_years_skips_unchanged_years(datasets, monkeypatch):
+    monkeypatch.setattr(
+        stats_processor,
+        "get_processing_operation_codes_data",
+        lambda: pl.DataFrame({"code": ["R1", "D10"], "description": ["Recyclage", "Incinération"]}),
+    )
+    stored_fingerprints, computed_years, refreshed_years = {}, [], []
+
+    def store_computation(year, fields, clear_year):
+        stored_fingerprints[year] = fields["fingerprint"]
+        computed_years.append(year)
+
+    monkeypatch.setattr(stats_processor, "store_computation", store_computation)
+    monkeypatch.setattr(stats_processor, "get_stored_fingerprints", lambda years: dict(stored_fingerprints))
+    monkeypatch.setattr(stats_processor, "refresh_headline_statistics", lambda year, df: refreshed_years.append(year))
+
+    build_stats_and_figs_for_years([2024, 2025], datasets=datasets)
+    assert computed_years == [2024, 2025]
+    assert stored_fingerprints[2024] != stored_fingerprints[2025]
+
+    # Unchanged inputs: the Computations are kept, with their headline statistics updated
+    computed_years.clear()
+    build_stats_and_figs_for_years([2024, 2025], datasets=datasets)
+    assert computed_years == []
+    assert refreshed_years == [2024, 2025]
+
+    # Rows changed in 2025 only
+    bsdd_weekly_data = datasets.bsdd_weekly_data.with_columns(
+        pl.when(pl.col("semaine").dt.year() == 2025).then(pl.col("creations") + 1).otherwise(pl.col("creations"))
+    )
+    changed_datasets = replace(datasets, bsdd_weekly_data=bsdd_weekly_data)
+    build_stats_and_figs_for_years([2024, 2025], datasets=changed_datasets)
+    assert computed_years == [2025]
+
+    build_stats_and_figs_for_years([2024, 2025], datasets=changed_datasets, force=True)
+    assert computed_years == [2025, 2024, 2025]
+
+
+def test_build_stats_and_figs_for_years_from_rows_of_the_year(datasets, monkeypatch):
+    monkeypatch.setattr(
+        stats_processor,
+        "get_processing_operation_codes_data",
+        lambda: pl.DataFrame({"code": ["R1", "D10"], "description": ["Recyclage", "Incinération"]}),
+    )
+    monkeypatch.setattr(stats_processor, "get_stored_fingerprints", lambda years: {})
+    computations = []
+    monkeypatch.setattr(
+        stats_processor, "store_computation", lambda year, fields, clear_year: computations.append(fields)
+    )
+    # The largest weekly quantity is in 2024: it sets the scale of the weekly figure of 2025
+    weekly_waste_processed_data = datasets.weekly_waste_processed_data.with_columns(
+        pl.when(pl.col("semaine") == date(2024, 1, 1))
+        .then(1000.0)
+        .otherwise(pl.col("quantite_traitee"))
+        .alias("quantite_traitee")
+    )
+    datasets = replace(datasets, weekly_waste_processed_data=weekly_waste_processed_data)
+    yearly_totals_df = build_yearly_totals(datasets)
+    datasets_2025 = split_datasets_by_year(datasets, [2025])[2025]
+
+    build_stats_and_figs_for_years([2025], yearly_totals_df=yearly_totals_df, datasets=datasets)
+    build_stats_and_figs_for_years(
+        [2025],
+        yearly_totals_df=yearly_totals_df,
+        datasets=datasets_2025,
+        quantity_processed_series=get_recovered_and_eliminated_quantity_processed_by_week_series(
+            weekly_waste_processed_data
+        ),
+    )
+
+    # Same figure and fingerprint as from the datasets of every year
+    assert computations[0] == computations[1]
+
+
+@pytest.mark.parametrize("pushdown", [False, True])
+def test_build_stats_command_weekly_quantity_scale(datasets, monkeypatch, tmp_path, pushdown):
+    monkeypatch.chdir(tmp_path)
+    # The largest weekly quantity is in 2024, a year that is not built
+    weekly_waste_processed_data = datasets.weekly_waste_processed_data.with_columns(
+        pl.when(pl.col("semaine") == date(2024, 1, 1))
+        .then(1000.0)
+        .otherwise(pl.col("quantite_traitee"))
+        .alias("quantite_traitee")
+    )
+    datasets = replace(datasets, weekly_waste_processed_data=weekly_waste_processed_data)
+    (tmp_path / "temp_data").mkdir()
+    for field in dataclass_fields(datasets):
+        getattr(datasets, field.name).write_parquet(tmp_path / "temp_data" / f"{field.name}.parquet")
+
+    monkeypatch.setattr(build_stats, "YEARS", [2025])
+    monkeypatch.setattr(build_stats, "warehouse_connection", lambda pool_size: nullcontext())
+    monkeypatch.setattr(build_stats, "build_dataframes", lambda **options: None)
+    monkeypatch.setattr(build_stats, "build_yearly_totals", lambda *args: build_yearly_totals(datasets))
+    monkeypatch.setattr(build_stats, "clear_figs", lambda: None)
+    monkeypatch.setattr(build_stats, "build_global_computation", lambda yearly_totals_df: None)
+    monkeypatch.setattr(
+        stats_processor,
+        "get_processing_operation_codes_data",
+        lambda: pl.DataFrame({"code": ["R1", "D10"], "description": ["Recyclage", "Incinération"]}),
+    )
+    monkeypatch.setattr(stats_processor, "get_stored_fingerprints", lambda years: {})
+    computations = {}
+    monkeypatch.setattr(
+        stats_processor, "store_computation", lambda year, fields, clear_year: computations.setdefault(year, fields)
+    )
+
+    call_command("build_stats", aggregation_pushdown=pushdown, staging_format="parquet")
+
+    # Only the rows of 2025 are loaded with pushdown, but the figure keeps the scale of every year
+    expected = compute_stats_and_figs(
+        2025, build_yearly_totals(datasets), datasets, stats_processor.get_processing_operation_codes_data()
+    )
+    assert computations[2025]["quantity_processed_weekly"] == expected["quantity_processed_weekly"]
+    assert computations[2025]["fingerprint"] == get_year_fingerprint(
+        split_datasets_by_year(datasets, [2025])[2025],
+        stats_processor.get_processing_operation_codes_data(),
+        get_recovered_and_eliminated_quantity_processed_by_week_series(weekly_waste_processed_data),
+    )
+
+
+@pytest.mark.django_db
+def test_get_stored_fingerprints():
+    Computation.objects.create(year=2024, fingerprint="old", created=datetime(2025, 1, 1, tzinfo=UTC))
+    Computation.objects.create(year=2024, fingerprint="new", created=datetime(2025, 1, 2, tzinfo=UTC))
+    Computation.objects.create(year=2025)
+
+    assert get_stored_fingerprints([2024, 2025, 2026]) == {2024: "new", 2025: ""}
+
+
+def test_global_statistics_from_yearly_totals(weekly_datasets):
+    bs_facts_df = build_bs_facts({name: df for name, df in weekly_datasets.items() if name in BS_WEEKLY_TABLES})
+    yearly_totals_df = compute_yearly_totals(bs_facts_df, weekly_datasets["accounts_weekly_data"], DATE_END)
+
+    # The plan of the all-time totals has no year: no mask comparing the years with None is built.
+    # The warnings plugin of pytest is disabled (see pytest.ini), hence the explicit filter
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        global_statistics = get_global_statistics_from_yearly_totals(yearly_totals_df)
+
+    expected = expected_headline_statistics(weekly_datasets, (datetime(2025, 1, 1), DATE_END))
+    assert global_statistics["total_bs_created"] == expected["total_bs_created"]
+
+
+@pytest.mark.django_db
+def test_build_global_computation(weekly_datasets):
+    bs_facts_df = build_bs_facts({name: df for name, df in weekly_datasets.items() if name in BS_WEEKLY_TABLES})
+    yearly_totals_df = compute_yearly_totals(bs_facts_df, weekly_datasets["accounts_weekly_data"], DATE_END)
+
+    build_global_computation(yearly_totals_df)
+    build_global_computation(yearly_totals_df)
+
+    # A single record, replaced by each build
+    global_computation = GlobalComputation.objects.get()
+    expected = expected_headline_statistics(weekly_datasets, (datetime(2025, 1, 1), DATE_END))
+    assert global_computation.total_bs_created == expected["total_bs_created"]
+    assert global_computation.total_quantity_processed == expected["total_quantity_processed"]
+
+
+def test_get_available_cpus(tmp_path):
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+    assert get_available_cpus(tmp_path) == 1
+
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert get_available_cpus(tmp_path) == len(os.sched_getaffinity(0))
@@ -1,7 +1,7 @@
 import pytest
 from django.urls import reverse
 
-from ..factories import ComputationFactory
+from ..factories import GlobalComputationFactory
 
 pytestmark = pytest.mark.django_db
 
@@ -14,7 +14,7 @@ def test_home_no_content(anon_client):
 
 
 def test_home_with_content(anon_client):
-    ComputationFactory()
+    GlobalComputationFactory()
     url = reverse("main")
     res = anon_client.get(url)
     assert res.status_code == 200
@@ -29,7 +29,7 @@ def test_digest_no_content(anon_client):
 
 
 def test_digest_with_content(anon_client):
-    ComputationFactory(total_bs_created=11, total_quantity_processed=12, total_companies_created=13)
+    GlobalComputationFactory(total_bs_created=11, total_quantity_processed=12, total_companies_created=13)
     url = reverse("stats_digest")
     res = anon_client.get(url)
     assert res.status_code == 200
@@ -5,7 +5,7 @@ from django.core.mail import EmailMessage
 from django.http import Http404, JsonResponse
 from django.views.generic import TemplateView
 
-from stats.models import Computation
+from stats.models import Computation, GlobalComputation
 
 
 class BaseRender(TemplateView):
@@ -36,22 +36,33 @@ class BaseRender(TemplateView):
         )
         message.send()
 
-    def get_context_data(self, **kwargs):
+    def get_computation(self):
         year = self.get_year()
 
-        ctx = super().get_context_data(**kwargs)
         computation = None
         if year:
             computation = Computation.objects.filter(year=year).first()
         if not computation:
             self.handle_missing_computation(year)
-        ctx["computation"] = computation
+        return computation
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["computation"] = self.get_computation()
         return ctx
 
 
 class Main(BaseRender):
+    """Home page: the all-time totals, the statistics of the year being loaded by `yearly_stats`."""
+
     template_name = "stats/stats.html"
 
+    def get_computation(self):
+        computation = GlobalComputation.objects.first()
+        if not computation:
+            self.handle_missing_computation("les totaux globaux")
+        return computation
+
 
 class BaseBsdView(BaseRender):
     def get_year(self):
@@ -97,12 +108,12 @@ class UserView(BaseBsdView):
 
 def digest_view(request):
     """Minimal api to retrieve main numbers for td home page."""
-    last_computation = Computation.objects.order_by("year").last()
+    global_computation = GlobalComputation.objects.first()
     digest = {}
-    if last_computation:
+    if global_computation:
         digest = {
-            "total_bsdd_created": last_computation.total_bs_created,
-            "total_quantity_processed": last_computation.total_quantity_processed,
-            "total_companies": last_computation.total_companies_created,
+            "total_bsdd_created": global_computation.total_bs_created,
+            "total_quantity_processed": global_computation.total_quantity_processed,
+            "total_companies": global_computation.total_companies_created,
         }
     return JsonResponse(digest)